@@ -0,0 +1,241 @@
+"""
+Aggregator service for the dashboard. Fetches the processing stats, the
+analyzer stats and a random event of each type, and the latest consistency
+check once per interval into a cached snapshot, and pushes every new
+snapshot to the connected browsers over Server-Sent Events. Upstream load
+is one fetch of each source per interval, however many dashboards are open.
+
+Runs as a single process, so the snapshot is fetched once and shared by
+every connection.
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime as dt, timezone
+
+import connexion
+import httpx
+import yaml
+from connexion.middleware import MiddlewarePosition
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import StreamingResponse
+
+from common import metrics, logs
+
+# App Config
+with open("config/aggregator.prod.yaml", "r", encoding="utf-8") as f:
+    app_config = yaml.safe_load(f.read())
+
+# Logging
+with open("logger/log.prod.yaml", "r", encoding="utf-8") as f:
+    log_config = yaml.safe_load(f.read())
+    logs.configure(log_config, app_config.get("logging"))
+
+logger = logging.getLogger("basicLogger")
+
+INTERVAL = app_config["scheduler"]["interval"]
+KEEPALIVE = app_config.get("stream", {}).get("keepalive", 15)
+
+VIEWERS = metrics.Gauge(
+    "aggregator_viewers",
+    "Dashboards connected to the snapshot stream.",
+)
+UPSTREAM_ERRORS = metrics.Counter(
+    "aggregator_upstream_errors_total",
+    "Failed fetches of the snapshot sources.",
+    ("source",),
+)
+
+# Latest snapshot, its encoded stream event, and an event set when it is
+# replaced so the connected streams send the new one
+snapshot = {
+    "updated": None,
+    "processing": None,
+    "analyzer": None,
+    "attraction": None,
+    "expense": None,
+    "checks": None,
+    "errors": [],
+}
+encoded = None
+# Number of snapshots published, so a stream can tell if it missed one
+version = 0
+changed = asyncio.Event()
+viewers = 0
+
+
+async def fetch(client, source, errors, params=None, missing_ok=False):
+    """Gets the JSON of a snapshot source, adding the source to errors if
+    it could not be fetched.
+
+    Returns:
+    The JSON, or None if the source did not return it.
+    """
+    url = app_config["eventstores"][source]["url"]
+    try:
+        response = await client.get(url, params=params)
+    except httpx.HTTPError as e:
+        logger.error("Could not reach %s at %s: %s", source, url, e)
+    else:
+        if response.status_code == 200:
+            return response.json()
+        if response.status_code == 404 and missing_ok:
+            return None
+        logger.error("%s responded with %s.", source, response.status_code)
+
+    UPSTREAM_ERRORS.inc(source=source)
+    errors.append(source)
+    return None
+
+
+async def fetch_event(client, source, errors, count):
+    """Gets a random event from the analyzer, or None if there are none."""
+    if not count:
+        return None
+    return await fetch(client, source, errors, {"index": random.randrange(count)})
+
+
+def publish(updated):
+    """Replaces the snapshot and wakes the connected streams."""
+    global encoded, version, changed  # pylint: disable=global-statement
+    snapshot.update(updated)
+    encoded = f"event: snapshot\ndata: {json.dumps(snapshot)}\n\n".encode("utf-8")
+    version += 1
+    changed.set()
+    changed = asyncio.Event()
+
+
+async def refresh_snapshot(client):
+    """Fetches every source into a new snapshot. A source that fails keeps
+    its last value in the snapshot and is listed in its errors."""
+    errors = []
+    processing, analyzer, checks = await asyncio.gather(
+        fetch(client, "proc_stats", errors),
+        fetch(client, "analyzer_stats", errors),
+        # Not found until the first consistency check has run
+        fetch(client, "checks", errors, missing_ok=True),
+    )
+
+    attraction = expense = None
+    if analyzer is not None:
+        attraction, expense = await asyncio.gather(
+            fetch_event(client, "attr_info", errors, analyzer["num_attr"]),
+            fetch_event(client, "exp_info", errors, analyzer["num_exp"]),
+        )
+
+    updated = {
+        "updated": dt.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        "errors": [f"Could not get {source}." for source in errors],
+    }
+    for key, source, value in (
+        ("processing", "proc_stats", processing),
+        ("analyzer", "analyzer_stats", analyzer),
+        ("checks", "checks", checks),
+        ("attraction", "attr_info", attraction),
+        ("expense", "exp_info", expense),
+    ):
+        if source not in errors:
+            updated[key] = value
+
+    publish(updated)
+    logger.debug("Snapshot refreshed with %d errors.", len(errors))
+
+
+async def refresh_loop():
+    """Refreshes the snapshot once per interval."""
+    async with httpx.AsyncClient(
+        timeout=app_config.get("stream", {}).get("timeout", 10)
+    ) as client:
+        while True:
+            start = time.monotonic()
+            try:
+                with metrics.SCAN_DURATION.time(scan="refresh_snapshot"):
+                    await refresh_snapshot(client)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Snapshot refresh failed.")
+            await asyncio.sleep(max(0, INTERVAL - (time.monotonic() - start)))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    """Runs the snapshot refresh for the lifetime of the service."""
+    task = asyncio.create_task(refresh_loop())
+    try:
+        yield
+    finally:
+        task.cancel()
+
+
+# Endpoints
+def get_snapshot():
+    """Gets the latest snapshot.
+
+    Returns:
+    The snapshot, or 404 before the first refresh.
+    """
+    if snapshot["updated"] is None:
+        return {"message": "No snapshot yet."}, 404
+
+    return snapshot, 200
+
+
+async def stream_snapshots():
+    """Yields the latest snapshot, then each new one as it is published.
+    A slow connection skips to the latest snapshot instead of queueing
+    every one it missed."""
+    global viewers  # pylint: disable=global-statement
+    viewers += 1
+    VIEWERS.set(viewers)
+    try:
+        # Tells the browser how long to wait before reconnecting
+        yield f"retry: {INTERVAL * 1000}\n\n".encode("utf-8")
+        sent = 0
+        while True:
+            # A snapshot published while the last yield was suspended is
+            # sent before waiting for the next one
+            if version == sent:
+                try:
+                    await asyncio.wait_for(changed.wait(), KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # Comment line keeping idle proxies from closing the stream
+                    yield b": keepalive\n\n"
+                continue
+            sent = version
+            yield encoded
+    finally:
+        viewers -= 1
+        VIEWERS.set(viewers)
+
+
+def get_events():
+    """Streams the snapshots as Server-Sent Events."""
+    logger.info("A dashboard connected to the snapshot stream.")
+
+    return StreamingResponse(
+        stream_snapshots(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+app = connexion.AsyncApp(__name__, specification_dir="", lifespan=lifespan)
+app.add_api("aggregator.yaml", base_path="/aggregator", strict_validation=True, validate_responses=True)
+app.add_middleware(metrics.MetricsMiddleware, position=MiddlewarePosition.BEFORE_EXCEPTION)
+
+if "CORS_ALLOW_ALL" in os.environ and os.environ["CORS_ALLOW_ALL"] == "yes":
+    app.add_middleware(
+        CORSMiddleware,
+        position=MiddlewarePosition.BEFORE_EXCEPTION,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+if __name__ == "__main__":
+    app.run(port=8400, host="0.0.0.0")
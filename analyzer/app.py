@@ -4,16 +4,21 @@ event counts and event ids from the Kafka queue.
 """
 
 import os
+import time
+from datetime import datetime as dt, timezone
 import json
-import logging.config
-from threading import Thread
+import logging
+from threading import Thread, Lock
 
 import connexion
 import yaml
+from flask import Response
 from pykafka import KafkaClient
 from connexion.middleware import MiddlewarePosition
 from starlette.middleware.cors import CORSMiddleware
 
+from common import kafka_ranges, merkle, idstream, metrics, logs, topics
+
 # App Config
 with open("config/analyzer.prod.yaml", "r", encoding="utf-8") as f:
     app_config = yaml.safe_load(f.read())
@@ -21,7 +26,7 @@ with open("config/analyzer.prod.yaml", "r", encoding="utf-8") as f:
 # Logging
 with open("logger/log.prod.yaml", "r", encoding="utf-8") as f:
     log_config = yaml.safe_load(f.read())
-    logging.config.dictConfig(log_config)
+    logs.configure(log_config, app_config.get("logging"))
 
 
 logger = logging.getLogger("basicLogger")
@@ -29,7 +34,34 @@ logger = logging.getLogger("basicLogger")
 # Kafka Client Settings
 HOST_NAME = f"{app_config['events']['hostname']}:{app_config['events']['port']}"
 client = KafkaClient(hosts=HOST_NAME)
-topic = client.topics[str.encode(f"{app_config['events']['topic']}")]
+
+
+def get_topics(event_type=None):
+    """Gets the Kafka topics holding events of the given type, or of every
+    type if no event type is given.
+    """
+    return [
+        client.topics[str.encode(name)]
+        for name in topics.get_topic_names(app_config["events"], event_type)
+    ]
+
+
+def read_events(event_topics):
+    """Reads the topics up to the messages they held when the scan started
+    and yields each decoded message."""
+    start = time.perf_counter()
+    try:
+        for topic in event_topics:
+            consumed = 0
+            try:
+                for msg in kafka_ranges.scan_topic(topic):
+                    consumed += 1
+                    msg_str = msg.value.decode("utf-8")
+                    yield json.loads(msg_str)
+            finally:
+                metrics.KAFKA_CONSUMED.inc(consumed, topic=topic.name.decode("utf-8"))
+    finally:
+        metrics.SCAN_DURATION.observe(time.perf_counter() - start, scan="analyzer_read")
 
 
 def get_attr(index):
@@ -42,15 +74,8 @@ def get_attr(index):
     Message that matches the index, or 404 if there
     is no message at that index.
     """
-    consumer = topic.get_simple_consumer(
-        reset_offset_on_start=True, consumer_timeout_ms=1000
-    )
-
     counter = 0
-    for msg in consumer:
-        msg_str = msg.value.decode("utf-8")
-        msg = json.loads(msg_str)
-
+    for msg in read_events(get_topics("attraction_info")):
         if msg["type"] == "attraction_info":
             if counter == index:
                 logger.info("Attraction Message found at index %s", index)
@@ -71,15 +96,8 @@ def get_exp(index):
     Message that matches the index, or 404 if there
     is no message at that index.
     """
-    consumer = topic.get_simple_consumer(
-        reset_offset_on_start=True, consumer_timeout_ms=1000
-    )
-
     counter = 0
-    for msg in consumer:
-        msg_str = msg.value.decode("utf-8")
-        msg = json.loads(msg_str)
-
+    for msg in read_events(get_topics("expense_info")):
         if msg["type"] == "expense_info":
             if counter == index:
                 logger.info("Expense Message found at index %s", index)
@@ -105,16 +123,10 @@ def get_event_stats():
     """
     logger.info("Request received to get number of event type in queue.")
 
-    consumer = topic.get_simple_consumer(
-        reset_offset_on_start=True, consumer_timeout_ms=1000
-    )
-
     attr_counter = 0
     exp_counter = 0
 
-    for msg in consumer:
-        msg_str = msg.value.decode("utf-8")
-        msg = json.loads(msg_str)
+    for msg in read_events(get_topics()):
         if msg["type"] == "attraction_info":
             attr_counter += 1
         else:
@@ -128,9 +140,33 @@ def get_event_stats():
     }, 200
 
 
-def get_event_ids():
+def received_time(msg):
+    """Gets the UTC time an event was received as an ISO 8601 timestamp.
+    Events from older receivers only have their second-resolution time."""
+    if "ingest_ts" in msg:
+        received = dt.fromtimestamp(msg["ingest_ts"], timezone.utc)
+        return received.replace(tzinfo=None).isoformat(timespec="microseconds")
+    return msg["datetime"]
+
+
+def to_utc_time(value):
+    """Converts an ISO 8601 query timestamp to a naive UTC one, so it
+    compares as text with the received times."""
+    value = dt.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(timespec="microseconds")
+
+
+def get_event_ids(since=None, until=None):
     """Gets the user and trace ids for events in queue
 
+    Parameters:
+    since (str): if given, only events received at or after this timestamp
+    are returned, along with the time they were received in UTC
+    until (str): if given with since, only events received before this
+    timestamp are returned
+
     Returns:
     A list of dictionaries with the user and trace ids for
     each event in the queue
@@ -138,21 +174,23 @@ def get_event_ids():
     Example:
     [ {"user_id": "XXXX", "trace_id": "XXXX"}, {"user_id": "XXXX", "trace_id": "XXXX"} ]
     """
-    consumer = topic.get_simple_consumer(
-        reset_offset_on_start=True, consumer_timeout_ms=1000
-    )
-
     all_entries = []
 
-    for msg in consumer:
-        msg_str = msg.value.decode("utf-8")
-        msg = json.loads(msg_str)
+    if since is not None:
+        since = to_utc_time(since)
+        until = None if until is None else to_utc_time(until)
 
+    for msg in read_events(get_topics()):
         event_id = {
             "user_id": msg["payload"]["user_id"],
             "trace_id": msg["payload"]["trace_id"],
             "type": msg["type"]
         }
+        if since is not None:
+            received = received_time(msg)
+            if received < since or (until is not None and received >= until):
+                continue
+            event_id["datetime"] = received
         all_entries.append(event_id)
 
     logger.info("%s, entry ids found.", len(all_entries))
@@ -160,6 +198,121 @@ def get_event_ids():
     return all_entries, 200
 
 
+# Merkle index of the event ids, rebuilt when new messages are produced.
+# Each rebuild starts a new generation.
+id_index_lock = Lock()
+id_index = {"offsets": None, "index": None, "generation": 0}
+
+
+def get_id_index(generation=None):
+    """Gets the Merkle index of the user and trace ids in the queue. The
+    index is cached until the latest offsets of the topics change. A call
+    with the generation of an earlier call reads that same index instead,
+    so the calls of one consistency check compare a single snapshot.
+
+    Returns:
+    A tuple with the index, or None if the given generation was replaced,
+    and the generation of the index.
+    """
+    if generation is not None:
+        with id_index_lock:
+            if generation != id_index["generation"]:
+                return None, id_index["generation"]
+            return id_index["index"], generation
+
+    event_topics = get_topics()
+    offsets = [
+        (topic.name, partition_id, response.offset[0])
+        for topic in event_topics
+        for partition_id, response in sorted(topic.latest_available_offsets().items())
+    ]
+
+    with id_index_lock:
+        if id_index["offsets"] != offsets:
+            entries = [
+                {
+                    "user_id": msg["payload"]["user_id"],
+                    "trace_id": msg["payload"]["trace_id"],
+                    "type": msg["type"],
+                }
+                for msg in read_events(event_topics)
+            ]
+            id_index["index"] = merkle.MerkleIndex(entries)
+            id_index["offsets"] = offsets
+            id_index["generation"] += 1
+            logger.info(
+                "Rebuilt id index generation %d with %d entries.",
+                id_index["generation"],
+                len(entries),
+            )
+
+        return id_index["index"], id_index["generation"]
+
+
+def replaced_generation(generation, current):
+    """Logs and returns the response to a call for a replaced index."""
+    logger.warning(
+        "Id index generation %d was requested, the current one is %d.",
+        generation,
+        current,
+    )
+    return {"message": f"Id index generation {generation} was replaced"}, 409
+
+
+def get_id_digest(prefix="", generation=None):
+    """Gets the Merkle digests of the trace id buckets one level below the
+    prefix.
+
+    Returns:
+    A dictionary with the prefix, the generation of the id index and the
+    digest of each non-empty child bucket, or 409 if the requested
+    generation was replaced.
+    """
+    index, current = get_id_index(generation)
+    if index is None:
+        return replaced_generation(generation, current)
+    buckets = index.children(prefix)
+
+    logger.info("Computed %d id digests for prefix '%s'", len(buckets), prefix)
+
+    return {"prefix": prefix, "generation": current, "buckets": buckets}, 200
+
+
+def get_id_bucket(prefix, generation=None):
+    """Gets the user and trace ids for events in the queue whose trace id
+    starts with the prefix, or 409 if the requested generation of the id
+    index was replaced."""
+    index, current = get_id_index(generation)
+    if index is None:
+        return replaced_generation(generation, current)
+    entries = index.bucket(prefix)
+
+    logger.info("%s entry ids found for prefix '%s'.", len(entries), prefix)
+
+    return entries, 200
+
+
+def get_id_stream():
+    """Streams the user and trace ids for events in the queue, sorted by
+    trace id, as gzip compressed binary records. The topics are scanned and
+    sorted with an external merge sort rather than read from the id index,
+    so memory use is bounded by the sort run size."""
+    logger.info("Streaming sorted id records.")
+
+    records = (
+        idstream.encode_record(
+            msg["payload"]["trace_id"], msg["payload"]["user_id"], msg["type"]
+        )
+        for msg in read_events(get_topics())
+    )
+
+    return Response(
+        idstream.gzip_chunks(idstream.sort_records(records)),
+        mimetype="application/octet-stream",
+        headers={"Content-Encoding": "gzip"},
+    )
+
+
 def setup_kafka_thread():
     """Creates threads for single event extraction from Kafka queue."""
     t1 = Thread(target=get_attr)
@@ -173,6 +326,7 @@ def setup_kafka_thread():
 
 app = connexion.FlaskApp(__name__, specification_dir="")
 app.add_api("analyzer.yaml", base_path="/analyzer", strict_validation=True, validate_responses=True)
+app.add_middleware(metrics.MetricsMiddleware, position=MiddlewarePosition.BEFORE_EXCEPTION)
 
 if "CORS_ALLOW_ALL" in os.environ and os.environ["CORS_ALLOW_ALL"] == "yes":
     app.add_middleware(
@@ -1,13 +1,21 @@
 import os
 import time
+from datetime import datetime as dt
 import json
-import logging.config
+import logging
+import sqlite3
 from threading import Thread
 
 import connexion
 from connexion import NoContent
+from connexion.middleware import MiddlewarePosition
 import yaml
 from pykafka import KafkaClient
+from pykafka.common import OffsetType
+
+import rules
+from store import AnomalyStore
+from common import metrics, logs, topics
 
 # App Config
 with open("config/anomaly.prod.yaml", "r", encoding="utf-8") as f:
@@ -16,113 +24,174 @@ with open("config/anomaly.prod.yaml", "r", encoding="utf-8") as f:
 # Logging
 with open("logger/log.prod.yaml", "r", encoding="utf-8") as f:
     log_config = yaml.safe_load(f.read())
-    logging.config.dictConfig(log_config)
+    logs.configure(log_config, app_config.get("logging"))
 
 logger = logging.getLogger("basicLogger")
+event_logger = logs.EventLogger.from_settings(logger, app_config.get("logging"))
 
 # Kafka Client Settings
 HOST_NAME = f"{app_config['events']['hostname']}:{app_config['events']['port']}"
 client = KafkaClient(hosts=HOST_NAME)
-topic = client.topics[str.encode(f"{app_config['events']['topic']}")]
 
-def update_anomalies():
-    logger.debug("Request to update anomalies process started.")
-    start_time = time.time()
 
-    # read from kafka queue
+def get_topics():
+    """Gets the Kafka topics holding the events to check for anomalies."""
+    return [
+        client.topics[str.encode(name)]
+        for name in topics.get_topic_names(app_config["events"])
+    ]
+
+
+RULES = rules.load_rules(app_config.setdefault("rules", {}))
+
+
+def find_anomaly(msg):
+    """Checks an event against the compiled rules and returns the anomaly
+    entry, or None if the event is not anomalous."""
+    anomaly = rules.find_anomaly(RULES, msg)
+    if anomaly is not None:
+        event_logger.debug(anomaly["description"])
+
+    return anomaly
+
+
+store = AnomalyStore(app_config["datastore"]["filepath"])
+
+
+# Time from the receiver accepting an event to its batch being flushed
+PERSIST_LATENCY = metrics.LatencySummary(
+    "event_ingest_to_persist_seconds",
+    "Percentiles of the time from ingest to the event's anomalies being stored.",
+    app_config.get("latency", {}).get("windows", [60, 300]),
+)
+
+
+def consume_anomalies(topic):
+    """Consumes a topic as part of the anomaly consumer group, appending new
+    anomalies to the datastore. Offsets are committed after every flush, so a
+    restart resumes from the last flushed message instead of rescanning the
+    topic.
+    """
     consumer = topic.get_simple_consumer(
-        reset_offset_on_start=True, consumer_timeout_ms=1000
+        consumer_group=str.encode(app_config["consumer"]["group"]),
+        reset_offset_on_start=False,
+        auto_offset_reset=OffsetType.EARLIEST,
+        auto_commit_enable=False,
+        consumer_timeout_ms=app_config["consumer"]["flush_interval_ms"],
     )
+    topic_name = topic.name.decode("utf-8")
+    metrics.track_consumer(topic_name, consumer)
+
+    pending = []
+    ingest_times = []
+    processed = 0
+
+    while True:
+        # Stops at a full batch, or when no message arrives for an interval
+        for msg in consumer:
+            if processed == 0:
+                batch_start = time.perf_counter()
+            msg_str = msg.value.decode("utf-8")
+            event = json.loads(msg_str)
+            if "ingest_ts" in event:
+                ingest_times.append(event["ingest_ts"])
+            anomaly = find_anomaly(event)
+            if anomaly is not None:
+                pending.append(anomaly)
+
+            processed += 1
+            if processed >= app_config["consumer"]["batch_size"]:
+                break
+
+        if processed == 0:
+            continue
+
+        start_time = time.time()
+        store.append(pending)
+        consumer.commit_offsets()
+        elapsed_time = round((time.time() - start_time) * 1000)
+
+        flushed_at = time.time()
+        for ingest_ts in ingest_times:
+            PERSIST_LATENCY.observe(flushed_at - ingest_ts)
+
+        metrics.KAFKA_CONSUMED.inc(processed, topic=topic_name)
+        metrics.SCAN_DURATION.observe(
+            time.perf_counter() - batch_start, scan="anomaly_batch"
+        )
+
+        logger.info(
+            f"Anomalies flushed | processing_time_ms={elapsed_time}"
+            f" | events = {processed} | anomalies found = {len(pending)}"
+        )
+
+        pending = []
+        ingest_times = []
+        processed = 0
 
-    anomalies = []
-
-    for msg in consumer:
-        msg_str = msg.value.decode("utf-8")
-        msg = json.loads(msg_str)
-
-        # find events with anomalies (based on env variable threshold)
-        if msg["type"] == "attraction_info":
-            if msg["payload"]["hours_open"] < int(os.environ["MIN_HOURS"]):
-                anom_info = {
-                    "user_id": msg["payload"]["user_id"],
-                    "trace_id": msg["payload"]["trace_id"],
-                    "event_type": "attraction_info",
-                    "anomaly_type": "Too Low",
-                    "description": f"Detected: {msg["payload"]["hours_open"]}; too low (threshold {os.environ["MIN_HOURS"]})"
-                }
-                logger.debug(f"Detected: {msg["payload"]["hours_open"]}; too low (threshold {os.environ["MIN_HOURS"]})")
-                anomalies.append(anom_info)
-        else:
-            if msg["payload"]["amount"] > int(os.environ["MAX_PRICE"]):
-                anom_info = {
-                    "user_id": msg["payload"]["user_id"],
-                    "trace_id": msg["payload"]["trace_id"],
-                    "event_type": "expense_info",
-                    "anomaly_type": "Too High",
-                    "description": f"Detected: {msg["payload"]["amount"]}; too high (threshold {os.environ["MAX_PRICE"]})"
-                }
-                logger.debug(f"Detected: {msg["payload"]["amount"]}; too high (threshold {os.environ["MAX_PRICE"]})")
-                anomalies.append(anom_info)
-
-    # update the json with the anomaly info
-    with open(app_config["datastore"]["filepath"], "w", encoding="utf-8") as w:
-        json.dump(anomalies, w, indent=4)
-
-    end_time = time.time()
-    # calculate processing time
-    elapsed_time = round((end_time - start_time) * 1000)
-
-    logger.info(
-        f"Update anomalies process completed | processing_time_ms={elapsed_time}"
-        f" | anomalies found = {len(anomalies)}"
-    )
+
+def update_anomalies():
+    """Reports the number of anomalies in the datastore. Detection runs
+    continuously in the consumer threads, so no scan is done here.
+    """
+    logger.debug("Request to update anomalies received.")
 
     # returns anomalies_count, as an object, { anomalies_count: 1000 }
-    return { "anomalies_count": len(anomalies) }, 200
+    return {"anomalies_count": store.count()}, 200
+
+
+def get_anomalies(event_type=None, user_id=None, since=None, cursor=None, limit=100):
+    """Gets a page of anomalies, optionally filtered by event type and user.
 
-def get_anomalies(event_type=None):
+    Parameters:
+    event_type (str): attraction_info or expense_info
+    user_id (str): only return anomalies of this user
+    since (str): only return anomalies detected at or after this timestamp
+    cursor (int): the X-Next-Cursor header of the previous page
+    limit (int): maximum number of anomalies to return
+
+    Returns:
+    The page of anomalies, with an X-Next-Cursor header if there are more.
+    """
     logger.debug("Request to get anomalies received")
     # wrong event type - return 400
     if event_type not in ["attraction_info", "expense_info"] and event_type != None:
-        return 400
+        return {"message": "Event type must be attraction_info or expense_info"}, 400
+
+    if since is not None:
+        since = dt.fromisoformat(since)
 
-    # load json
     try:
-        with open(
-            app_config["datastore"]["filepath"], "r", encoding="utf-8"
-        ) as read_content:
-            anom_file = json.load(read_content)
-    except FileNotFoundError:
-        logger.error("The Anomalies file does not exist.")
-        return {"message": "The anomalies datastore is missing or corrupted."}, 404
-    except IOError:
-        logger.error("An error occurred while reading the anomaly file.")
+        anomalies, next_cursor = store.page(event_type, user_id, since, cursor, limit)
+    except sqlite3.Error:
+        logger.exception("An error occurred while reading the anomalies datastore.")
         return {"message": "The anomalies datastore is corrupted."}, 404
 
     # no anomalies - return empty response, 204
-    if len(anom_file) == 0:
-        logger.debug("Anomalies Response returned: No anomalies found in file.")
+    if len(anomalies) == 0:
+        logger.debug("Anomalies Response returned: No anomalies found.")
         return NoContent, 204
 
-    # no event type - return all, or filter
-    if event_type == None and len(anom_file) != 0:
-        logger.debug("Anomalies Response returned: All anomalies returned.")
-        return anom_file, 200
-    else:
-        logger.debug(f"Anomalies Response returned: {event_type} entries returned.")
-        return [ entry for entry in anom_file if entry["event_type"] == event_type ], 200
+    logger.debug(f"Anomalies Response returned: {len(anomalies)} entries returned.")
 
-def setup_kafka_thread():
-    """Creates threads for single event extraction from Kafka queue."""
-    t1 = Thread(target=update_anomalies)
-    t1.daemon = True
+    if next_cursor is None:
+        return anomalies, 200
 
-    t1.start()
+    return anomalies, 200, {"X-Next-Cursor": str(next_cursor)}
+
+
+def setup_kafka_thread():
+    """Creates an anomaly consumer thread for each topic."""
+    for topic in get_topics():
+        t1 = Thread(target=consume_anomalies, args=(topic,))
+        t1.daemon = True
+        t1.start()
 
 app = connexion.FlaskApp(__name__, specification_dir="")
 app.add_api("anomaly.yaml", base_path="/anomaly", strict_validation=True, validate_responses=True)
+app.add_middleware(metrics.MetricsMiddleware, position=MiddlewarePosition.BEFORE_EXCEPTION)
 
 if __name__ == "__main__":
-    logger.info(f"The thresholds are min hours {os.environ["MIN_HOURS"]} and max price {os.environ["MAX_PRICE"]}.")
+    logger.info("The anomaly rules are %s.", app_config["rules"])
     setup_kafka_thread()
     app.run(port=8400, host="0.0.0.0")
\ No newline at end of file
@@ -0,0 +1,175 @@
+"""
+Backfill command for the anomaly detector. Re-evaluates the whole history of
+the event topics with the current rules and replaces the anomalies datastore.
+
+Each topic is split by partition and offset range across a process pool.
+Workers prime the statistical detectors with the messages just before their
+range. Anomalies are stamped with the time their event was received, not
+the time of the backfill, so the since filter keeps selecting by when events
+happened. The results are merged in event time, then topic, partition and
+offset order, so repeated backfills give the same datastore.
+
+Stop the anomaly detector before running a backfill. The anomaly consumer
+group offsets are moved to the end of the backfilled ranges, so the service
+resumes with the messages produced after the backfill started. If a range
+could not be read to its end, the datastore and offsets are left as they
+were.
+
+Usage: python3 backfill.py [--workers N] [--chunk-size M] [--warmup W]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime as dt, timezone
+
+import yaml
+from pykafka import KafkaClient
+
+import rules
+from store import AnomalyStore
+from common import kafka_ranges, topics
+
+# App Config
+with open("config/anomaly.prod.yaml", "r", encoding="utf-8") as f:
+    app_config = yaml.safe_load(f.read())
+
+HOST_NAME = f"{app_config['events']['hostname']}:{app_config['events']['port']}"
+
+# Kafka client of each worker process
+client = None
+
+
+def init_worker():
+    """Connects each worker process to Kafka once."""
+    global client
+    client = KafkaClient(hosts=HOST_NAME)
+
+
+def get_event_time(msg):
+    """Gets the time the receiver accepted an event, from its ingest_ts, or
+    from its datetime, in UTC, for events published before ingest_ts."""
+    if "ingest_ts" in msg:
+        return dt.fromtimestamp(msg["ingest_ts"], timezone.utc)
+    return dt.fromisoformat(msg["datetime"]).replace(tzinfo=timezone.utc)
+
+
+def evaluate_range(task):
+    """Evaluates the messages of one offset range with freshly compiled rules.
+
+    Parameters:
+    task (tuple): topic index, topic name, partition id, start and end
+    offsets of the range, and the offset to start priming detectors from
+
+    Returns:
+    A tuple with the task, the number of events evaluated and a list of
+    (topic index, partition id, offset, anomaly) tuples.
+    """
+    topic_index, topic_name, partition_id, start, end, warmup_start = task
+    topic = client.topics[str.encode(topic_name)]
+    compiled_rules = rules.load_rules(app_config.setdefault("rules", {}))
+
+    events = 0
+    anomalies = []
+    for msg in kafka_ranges.read_range(topic, partition_id, warmup_start, end):
+        event = json.loads(msg.value)
+        anomaly = rules.find_anomaly(compiled_rules, event)
+
+        # Messages before the range only prime the statistical detectors
+        if msg.offset < start:
+            continue
+
+        events += 1
+        if anomaly is not None:
+            anomaly["detected_at"] = get_event_time(event)
+            anomalies.append((topic_index, partition_id, msg.offset, anomaly))
+
+    return task, events, anomalies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfills the anomalies datastore.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument("--warmup", type=int, default=1_000)
+    args = parser.parse_args()
+
+    kafka_client = KafkaClient(hosts=HOST_NAME)
+
+    tasks = []
+    end_offsets = {}
+    topic_names = topics.get_topic_names(app_config["events"])
+    for topic_index, topic_name in enumerate(topic_names):
+        topic = kafka_client.topics[str.encode(topic_name)]
+        first_offsets = {}
+        for partition_id, start, end in kafka_ranges.get_offset_ranges(
+            topic, args.chunk_size
+        ):
+            first = first_offsets.setdefault(partition_id, start)
+            warmup_start = max(first, start - args.warmup)
+            tasks.append(
+                (topic_index, topic_name, partition_id, start, end, warmup_start)
+            )
+            end_offsets.setdefault(topic_name, {})[partition_id] = end
+
+    print(f"Backfilling {len(tasks)} ranges with {args.workers} workers.")
+
+    start_time = time.time()
+    total_events = 0
+    results = []
+    failed = 0
+
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+    ) as pool:
+        futures = [pool.submit(evaluate_range, task) for task in tasks]
+
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                task, events, anomalies = future.result()
+            except TimeoutError as e:
+                failed += 1
+                print(f"[{done}/{len(tasks)}] {e}")
+                continue
+            total_events += events
+            results.extend(anomalies)
+
+            elapsed = time.time() - start_time
+            print(
+                f"[{done}/{len(tasks)}] {task[1]} partition {task[2]}"
+                f" offsets {task[3]}-{task[4]} | events = {events}"
+                f" | anomalies = {len(anomalies)}"
+                f" | {total_events / max(elapsed, 1e-9):,.0f} events/s"
+            )
+
+    if failed:
+        sys.exit(
+            f"{failed} ranges were not read to their end, the anomalies"
+            " datastore was not replaced."
+        )
+
+    # Sort by event time, then topic, partition and offset so the merge is
+    # deterministic and detected_at increases with the id
+    results.sort(key=lambda result: (result[3]["detected_at"],) + result[:3])
+    store = AnomalyStore(app_config["datastore"]["filepath"])
+    store.replace_all([result[3] for result in results])
+    kafka_ranges.commit_group_offsets(
+        kafka_client, str.encode(app_config["consumer"]["group"]), end_offsets
+    )
+
+    elapsed = time.time() - start_time
+    print(
+        f"Backfill completed | processing_time_ms={round(elapsed * 1000)}"
+        f" | events = {total_events} | anomalies found = {len(results)}"
+        f" | {total_events / max(elapsed, 1e-9):,.0f} events/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
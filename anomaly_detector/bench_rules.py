@@ -0,0 +1,120 @@
+"""
+Throughput benchmark for the anomaly rule engine. Evaluates synthetic
+events with the compiled rules and with the previous per-message
+environment variable checks, and reports events per second for each.
+
+Usage: python3 bench_rules.py [--config PATH] [--events N]
+"""
+
+import argparse
+import os
+import random
+import time
+import uuid
+
+import yaml
+
+import rules
+
+ATTR_CATEGORIES = ["Museum", "Park", "Gallery", "Zoo"]
+EXP_CATEGORIES = ["Food", "Lodging", "Fees", "Transport"]
+
+
+def make_events(count):
+    """Creates a list of random attraction and expense events."""
+    user_id = str(uuid.uuid4())
+    events = []
+    for i in range(count):
+        if i % 2 == 0:
+            payload = {
+                "user_id": user_id,
+                "attraction_category": random.choice(ATTR_CATEGORIES),
+                "hours_open": random.randint(0, 24),
+                "trace_id": str(uuid.uuid4()),
+            }
+            events.append({"type": "attraction_info", "payload": payload})
+        else:
+            payload = {
+                "user_id": user_id,
+                "expense_category": random.choice(EXP_CATEGORIES),
+                "amount": round(random.lognormvariate(2.5, 0.8), 2),
+                "trace_id": str(uuid.uuid4()),
+            }
+            events.append({"type": "expense_info", "payload": payload})
+
+    return events
+
+
+def legacy_evaluate(msg):
+    """The checks as done before the rule engine, parsing the environment
+    variables and formatting the description for every message."""
+    if msg["type"] == "attraction_info":
+        if msg["payload"]["hours_open"] < int(os.environ["MIN_HOURS"]):
+            return (
+                "Too Low",
+                f"Detected: {msg['payload']['hours_open']}; too low "
+                f"(threshold {os.environ['MIN_HOURS']})",
+            )
+    elif msg["payload"]["amount"] > int(os.environ["MAX_PRICE"]):
+        return (
+            "Too High",
+            f"Detected: {msg['payload']['amount']}; too high "
+            f"(threshold {os.environ['MAX_PRICE']})",
+        )
+
+    return None
+
+
+def run(name, evaluate, events):
+    """Times the evaluation of every event and prints the throughput."""
+    start = time.perf_counter()
+    found = sum(1 for msg in events if evaluate(msg) is not None)
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{name:<24} {len(events) / elapsed:>12,.0f} events/s"
+        f" | anomalies = {found}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default="config/anomaly.prod.yaml")
+    parser.add_argument("--events", type=int, default=500_000)
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        rules_config = yaml.safe_load(f.read())["rules"]
+
+    os.environ.setdefault(
+        "MIN_HOURS", str(rules_config["attraction_info"].get("min", 4))
+    )
+    os.environ.setdefault(
+        "MAX_PRICE", str(rules_config["expense_info"].get("max", 20))
+    )
+
+    events = make_events(args.events)
+
+    thresholds_only = rules.compile_rules(
+        {
+            event_type: {k: v for k, v in rule.items() if k != "statistical"}
+            for event_type, rule in rules_config.items()
+        }
+    )
+    compiled = rules.compile_rules(rules_config)
+
+    run("legacy env checks", legacy_evaluate, events)
+    run(
+        "compiled thresholds",
+        lambda msg: thresholds_only[msg["type"]](msg["payload"]),
+        events,
+    )
+    run(
+        "compiled + statistical",
+        lambda msg: compiled[msg["type"]](msg["payload"]),
+        events,
+    )
+
+
+if __name__ == "__main__":
+    main()
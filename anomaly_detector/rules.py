@@ -0,0 +1,240 @@
+"""Anomaly rule engine. Rules are loaded once from the app config and
+compiled into one evaluation function per event type, with optional
+per-category thresholds and streaming statistical detectors.
+"""
+
+import math
+import os
+from collections import deque
+from threading import Lock
+
+
+class EwmaDetector:
+    """Flags values far from an exponentially weighted moving average.
+    Uses O(1) time and memory per event.
+    """
+
+    def __init__(self, alpha, threshold, warmup):
+        if not 0 < alpha <= 1:
+            raise ValueError(f"ewma alpha must be in (0, 1], got {alpha}")
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+
+    def update(self, value):
+        """Scores the value against the current average, then adds it.
+
+        Returns:
+        The z-score of the value, or None during warmup.
+        """
+        score = None
+        if self.count >= self.warmup and self.var > 0:
+            score = (value - self.mean) / math.sqrt(self.var)
+
+        if self.count == 0:
+            self.mean = float(value)
+        else:
+            diff = value - self.mean
+            incr = self.alpha * diff
+            self.mean += incr
+            self.var = (1 - self.alpha) * (self.var + diff * incr)
+        self.count += 1
+
+        return score
+
+
+class RollingZScoreDetector:
+    """Flags values far from the mean of the last `window` values.
+    Keeps running sums so each event costs O(1) time.
+    """
+
+    def __init__(self, window, threshold, warmup):
+        if window < 2:
+            raise ValueError(f"zscore window must be at least 2, got {window}")
+        self.threshold = threshold
+        self.warmup = max(warmup, 2)
+        self.values = deque(maxlen=window)
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def update(self, value):
+        """Scores the value against the current window, then adds it.
+
+        Returns:
+        The z-score of the value, or None during warmup.
+        """
+        score = None
+        count = len(self.values)
+        if count >= self.warmup:
+            mean = self.total / count
+            var = self.total_sq / count - mean * mean
+            if var > 0:
+                score = (value - mean) / math.sqrt(var)
+
+        if count == self.values.maxlen:
+            oldest = self.values[0]
+            self.total -= oldest
+            self.total_sq -= oldest * oldest
+        self.values.append(value)
+        self.total += value
+        self.total_sq += value * value
+
+        return score
+
+
+DETECTORS = {
+    "ewma": lambda conf: EwmaDetector(
+        conf.get("alpha", 0.1), conf["threshold"], conf.get("warmup", 30)
+    ),
+    "zscore": lambda conf: RollingZScoreDetector(
+        conf.get("window", 100), conf["threshold"], conf.get("warmup", 30)
+    ),
+}
+
+
+def compile_rule(rule):
+    """Compiles one event type's rule into an evaluation function.
+
+    Parameters:
+    rule (dict): rule config with the checked `field`, optional `min`/`max`
+    thresholds, optional `category_field` and per-category `categories`
+    overrides, and a list of `statistical` detectors.
+
+    Returns:
+    A function taking an event payload and returning a tuple of anomaly type
+    and description, or None if the value is not anomalous.
+
+    Raises:
+    ValueError: if the rule is invalid
+    """
+    if "field" not in rule:
+        raise ValueError("Rule has no field to check")
+    field = rule["field"]
+    category_field = rule.get("category_field")
+    statistical = rule.get("statistical", [])
+    for conf in statistical:
+        if conf.get("type") not in DETECTORS:
+            raise ValueError(f"Unknown statistical detector {conf.get('type')}")
+        if "threshold" not in conf:
+            raise ValueError(f"Statistical detector {conf['type']} has no threshold")
+        # Building one checks the detector parameters before any event
+        DETECTORS[conf["type"]](conf)
+
+    def make_bounds(conf):
+        # Description suffixes are formatted once here, not per event
+        low = conf.get("min")
+        high = conf.get("max")
+        if low is not None and high is not None and low > high:
+            raise ValueError(f"Rule min {low} is above its max {high}")
+        return (
+            low,
+            high,
+            f"; too low (threshold {low})",
+            f"; too high (threshold {high})",
+        )
+
+    default_bounds = make_bounds(rule)
+    category_bounds = {
+        category: make_bounds({**rule, **conf})
+        for category, conf in rule.get("categories", {}).items()
+    }
+
+    # Statistical detector state, kept per category
+    detectors = {}
+    lock = Lock()
+
+    def evaluate(payload):
+        value = payload[field]
+        category = payload.get(category_field) if category_field else None
+        low, high, low_suffix, high_suffix = category_bounds.get(
+            category, default_bounds
+        )
+
+        # Values breaking a threshold are kept out of the statistical baselines
+        if low is not None and value < low:
+            return "Too Low", f"Detected: {value}{low_suffix}"
+        if high is not None and value > high:
+            return "Too High", f"Detected: {value}{high_suffix}"
+
+        if not statistical:
+            return None
+
+        with lock:
+            category_detectors = detectors.get(category)
+            if category_detectors is None:
+                category_detectors = [
+                    DETECTORS[conf["type"]](conf) for conf in statistical
+                ]
+                detectors[category] = category_detectors
+
+            # Every detector sees the value so their state stays current
+            scores = [detector.update(value) for detector in category_detectors]
+
+        for conf, detector, score in zip(statistical, category_detectors, scores):
+            if score is not None and abs(score) > detector.threshold:
+                direction = "above" if score > 0 else "below"
+                return (
+                    "Too High" if score > 0 else "Too Low",
+                    f"Detected: {value}; {abs(score):.1f} standard deviations "
+                    f"{direction} the {conf['type']} mean",
+                )
+
+        return None
+
+    return evaluate
+
+
+def compile_rules(rules_config):
+    """Compiles the rules for every event type.
+
+    Returns:
+    A dictionary of event type to evaluation function.
+    """
+    compiled = {}
+    for event_type, rule in rules_config.items():
+        try:
+            compiled[event_type] = compile_rule(rule)
+        except ValueError as e:
+            raise ValueError(f"Invalid rule for {event_type}: {e}") from e
+
+    return compiled
+
+
+def find_anomaly(compiled_rules, msg):
+    """Checks an event message against the compiled rules.
+
+    Returns:
+    The anomaly entry, or None if the event is not anomalous.
+    """
+    result = compiled_rules[msg["type"]](msg["payload"])
+    if result is None:
+        return None
+
+    anomaly_type, description = result
+
+    return {
+        "user_id": msg["payload"]["user_id"],
+        "trace_id": msg["payload"]["trace_id"],
+        "event_type": msg["type"],
+        "anomaly_type": anomaly_type,
+        "description": description,
+    }
+
+
+def load_rules(rules_config):
+    """Compiles the rules from the app config. The MIN_HOURS and MAX_PRICE
+    environment variables are used as the default thresholds when the config
+    does not set them.
+    """
+    attr_rule = rules_config.setdefault("attraction_info", {"field": "hours_open"})
+    exp_rule = rules_config.setdefault("expense_info", {"field": "amount"})
+
+    if "min" not in attr_rule and "MIN_HOURS" in os.environ:
+        attr_rule["min"] = int(os.environ["MIN_HOURS"])
+    if "max" not in exp_rule and "MAX_PRICE" in os.environ:
+        exp_rule["max"] = int(os.environ["MAX_PRICE"])
+
+    return compile_rules(rules_config)
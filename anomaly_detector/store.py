@@ -0,0 +1,140 @@
+"""SQLite anomaly datastore, indexed by event type, user and detection time
+so pages of anomalies are read without scanning the whole store.
+"""
+
+import sqlite3
+from datetime import datetime as dt, timezone
+from threading import Lock
+
+COLUMNS = ("user_id", "trace_id", "event_type", "anomaly_type", "description")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS anomalies (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    trace_id TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    anomaly_type TEXT NOT NULL,
+    description TEXT NOT NULL,
+    detected_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_anomalies_event_type ON anomalies (event_type, id);
+CREATE INDEX IF NOT EXISTS ix_anomalies_user_id ON anomalies (user_id, id);
+CREATE INDEX IF NOT EXISTS ix_anomalies_detected_at ON anomalies (detected_at);
+"""
+
+
+def to_timestamp(value):
+    """Formats a datetime as a fixed width UTC ISO 8601 string, so stored
+    timestamps sort correctly as text."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(timespec="microseconds") + "Z"
+
+
+def make_rows(anomalies):
+    """Converts anomaly entries into table rows stamped with their
+    detected_at datetime, or with the current time if they have none."""
+    now = dt.now(timezone.utc)
+    return [
+        tuple(anomaly[column] for column in COLUMNS)
+        + (to_timestamp(anomaly.get("detected_at", now)),)
+        for anomaly in anomalies
+    ]
+
+
+class AnomalyStore:
+    """Anomaly datastore shared by the consumer threads and the API."""
+
+    def __init__(self, filepath):
+        self.conn = sqlite3.connect(filepath, check_same_thread=False)
+        self.lock = Lock()
+
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+            self.total = self.conn.execute(
+                "SELECT count(*) FROM anomalies"
+            ).fetchone()[0]
+
+    def append(self, anomalies):
+        """Appends new anomalies in a single transaction. They are stamped
+        under the lock, so detected_at increases with the id."""
+        with self.lock, self.conn:
+            rows = make_rows(anomalies)
+            self.conn.executemany(
+                f"INSERT INTO anomalies ({', '.join(COLUMNS)}, detected_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.total += len(rows)
+
+    def replace_all(self, anomalies):
+        """Replaces every anomaly in the store in a single transaction. The
+        anomalies must be in detected_at order, as pages rely on detected_at
+        increasing with the id."""
+        with self.lock, self.conn:
+            rows = make_rows(anomalies)
+            self.conn.execute("DELETE FROM anomalies")
+            self.conn.executemany(
+                f"INSERT INTO anomalies ({', '.join(COLUMNS)}, detected_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.total = len(rows)
+
+    def count(self):
+        """Gets the number of anomalies in the store."""
+        with self.lock:
+            return self.total
+
+    def page(self, event_type=None, user_id=None, since=None, cursor=None, limit=100):
+        """Gets a page of anomalies in detection order.
+
+        Parameters:
+        event_type (str): only return anomalies of this event type
+        user_id (str): only return anomalies of this user
+        since (datetime): only return anomalies detected at or after this time
+        cursor (int): only return anomalies after this cursor
+        limit (int): maximum number of anomalies to return
+
+        Returns:
+        A tuple with the list of anomalies and the cursor of the next page,
+        or None if this is the last page.
+        """
+        conditions = []
+        params = []
+
+        with self.lock:
+            if since is not None:
+                # detected_at increases with the id, so since becomes an id bound
+                first_id = self.conn.execute(
+                    "SELECT min(id) FROM anomalies WHERE detected_at >= ?",
+                    (to_timestamp(since),),
+                ).fetchone()[0]
+                if first_id is None:
+                    return [], None
+                conditions.append("id >= ?")
+                params.append(first_id)
+            if cursor is not None:
+                conditions.append("id > ?")
+                params.append(cursor)
+            if event_type is not None:
+                conditions.append("event_type = ?")
+                params.append(event_type)
+            if user_id is not None:
+                conditions.append("user_id = ?")
+                params.append(user_id)
+
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            rows = self.conn.execute(
+                f"SELECT id, {', '.join(COLUMNS)} FROM anomalies {where}"
+                " ORDER BY id LIMIT ?",
+                params + [limit + 1],
+            ).fetchall()
+
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        anomalies = [dict(zip(COLUMNS, row[1:])) for row in rows[:limit]]
+
+        return anomalies, next_cursor
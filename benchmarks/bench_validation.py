@@ -0,0 +1,142 @@
+"""
+Benchmark of OpenAPI validation on the high-volume endpoints. Serves the
+receiver POSTs and the storage list endpoints in-process with Connexion's
+default validators, with the fast-path validators from
+common/validation.py, and with response validation off, and reports
+requests per second for each.
+
+Usage: python3 benchmarks/bench_validation.py [--requests N] [--sample-rate R]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import connexion
+import pykafka
+from starlette.testclient import TestClient
+
+import fake_kafka
+import run_pipeline
+
+STORAGE_FAST_OPERATIONS = [
+    "app.get_attraction_info",
+    "app.get_expense_info",
+    "app.get_attr_ids",
+    "app.get_exp_ids",
+]
+
+
+def build_client(module, spec, base_path, validate_responses, validator_map):
+    """Serves a service module's API with the given validation settings."""
+    sys.modules["app"] = module
+    from common import validation
+
+    app = connexion.FlaskApp(
+        module.__name__,
+        specification_dir=os.path.dirname(module.__file__),
+        middlewares=validation.middlewares() if validator_map else None,
+    )
+    app.add_api(
+        spec,
+        base_path=base_path,
+        strict_validation=True,
+        validate_responses=validate_responses,
+        validator_map=validator_map,
+    )
+    client = TestClient(app)
+    # Resolves the operationIds while app is this service
+    client.get(f"{base_path}/metrics")
+    del sys.modules["app"]
+
+    return client
+
+
+def run(name, requests, send):
+    """Times the requests and prints the throughput."""
+    start = time.perf_counter()
+    for i in range(requests):
+        response = send(i)
+        assert response.status_code < 300, response.text
+    elapsed = time.perf_counter() - start
+
+    print(f"{name:<46} {requests / elapsed:>10,.0f} requests/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2_000)
+    parser.add_argument("--sample-rate", type=float, default=0.01)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="validation-bench-")
+    run_pipeline.prepare_workdir(workdir)
+    sys.path.insert(0, run_pipeline.ROOT)
+    pykafka.KafkaClient = fake_kafka.KafkaClient
+
+    receiver = run_pipeline.load_service(workdir, "receiver")
+    storage = run_pipeline.load_service(workdir, "storage")
+    from common import validation
+
+    sys.modules["create_db"].create_tables()
+
+    modes = [
+        ("default validators", True, None),
+        ("fast-path validators", True, "fast"),
+        ("no response validation", False, None),
+    ]
+
+    bodies = run_pipeline.make_bodies(args.requests)
+    for name, validate_responses, fast in modes:
+        validator_map = validation.validator_map({}) if fast else None
+        client = build_client(
+            receiver, "receiver.yaml", "/receiver", validate_responses, validator_map
+        )
+        run(
+            f"POST /receiver/info/* | {name}",
+            args.requests,
+            lambda i: client.post(bodies[i][0], json=bodies[i][1]),
+        )
+
+    # Stores the POSTed events for the list responses
+    topic_names = [
+        str.encode(name) for name in storage.app_config["events"]["topics"].values()
+    ]
+    for topic_name in topic_names:
+        fake_kafka.broker.commit(b"event_group", topic_name, 0)
+    storage.setup_kafka_thread()
+    fake_kafka.broker.wait_for_commits(b"event_group", topic_names)
+
+    params = {
+        "start_timestamp": "1970-01-01T00:00:00Z",
+        "end_timestamp": "2100-01-01T00:00:00Z",
+    }
+    list_requests = max(args.requests // 20, 10)
+    stored = len(fake_kafka.broker.topics[topic_names[0]].messages)
+    print(f"Storage lists hold {stored} events each.")
+    for name, validate_responses, fast in modes:
+        validator_map = None
+        if fast:
+            validator_map = validation.validator_map(
+                {
+                    "fast_operations": STORAGE_FAST_OPERATIONS,
+                    "response_sample_rate": args.sample_rate,
+                }
+            )
+        client = build_client(
+            storage, "storage.yaml", "/storage", validate_responses, validator_map
+        )
+        run(
+            f"GET /storage/get/* | {name}",
+            list_requests,
+            lambda i: client.get(
+                "/storage/get/attractions" if i % 2 == 0 else "/storage/get/expenses",
+                params=params,
+            ),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""In-memory stand-in for the parts of the pykafka client and the aiokafka
+producer the services use. Each topic has a single partition holding a
+list of messages, consumer groups keep committed offsets, and consumers
+block or time out at the end of a topic like pykafka consumers do.
+
+The broker also records how long the consumer of each group spends on
+every message, from handing it out to being asked for the next one, so
+the benchmarks can report per-event latencies of each stage.
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from collections import defaultdict
+from threading import Condition
+
+from pykafka.common import OffsetType
+
+
+class OffsetResponse:
+    """Offset response of a partition, as returned by pykafka."""
+
+    def __init__(self, offset):
+        self.offset = [offset]
+        self.err = 0
+
+
+class Message:
+    """A message read from a topic."""
+
+    __slots__ = ("value", "offset", "partition_id")
+
+    def __init__(self, value, offset, partition_id=0):
+        self.value = value
+        self.offset = offset
+        self.partition_id = partition_id
+
+
+class Partition:
+    def __init__(self, partition_id):
+        self.id = partition_id
+
+
+class Broker:
+    """Topics, committed offsets and per-message service times."""
+
+    def __init__(self):
+        self.condition = Condition()
+        self.topics = {}
+        self.committed = defaultdict(dict)
+        self.service_times = defaultdict(list)
+        # Longest wait of a consumer with a timeout at the end of a topic
+        self.idle_wait = 0.01
+        # Round trip of a produce request to the broker
+        self.produce_latency = 0
+
+    def topic(self, name):
+        with self.condition:
+            if name not in self.topics:
+                self.topics[name] = Topic(self, name)
+            return self.topics[name]
+
+    def commit(self, group, topic_name, offset):
+        """Sets the committed offset of a consumer group, the next offset
+        its consumers read."""
+        with self.condition:
+            self.committed[group][topic_name] = offset
+
+    def wait_for_commits(self, group, topic_names, timeout=600):
+        """Waits until a consumer group has committed the end of each topic."""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while any(
+                self.committed[group].get(name, 0) < len(self.topics[name].messages)
+                for name in topic_names
+            ):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Consumer group {group!r} did not catch up")
+                self.condition.wait(remaining)
+
+
+broker = Broker()
+
+
+class TopicDict(dict):
+    """Creates topics on first access, like auto created Kafka topics."""
+
+    def __missing__(self, name):
+        topic = broker.topic(name)
+        self[name] = topic
+        return topic
+
+
+class Topic:
+    def __init__(self, topic_broker, name):
+        self.broker = topic_broker
+        self.name = name
+        self.messages = []
+        self.partitions = {0: Partition(0)}
+
+    def latest_available_offsets(self):
+        with self.broker.condition:
+            return {0: OffsetResponse(len(self.messages))}
+
+    def earliest_available_offsets(self):
+        return {0: OffsetResponse(0)}
+
+    def get_sync_producer(self, **kwargs):
+        return Producer(self)
+
+    def get_producer(self, delivery_reports=False, **kwargs):
+        return Producer(self, sync=False, delivery_reports=delivery_reports)
+
+    def append(self, value):
+        with self.broker.condition:
+            self.messages.append(Message(value, len(self.messages)))
+            self.broker.condition.notify_all()
+
+    def get_simple_consumer(
+        self,
+        consumer_group=None,
+        auto_offset_reset=OffsetType.EARLIEST,
+        reset_offset_on_start=False,
+        consumer_timeout_ms=-1,
+        **kwargs,
+    ):
+        return SimpleConsumer(
+            self, consumer_group, auto_offset_reset, reset_offset_on_start, consumer_timeout_ms
+        )
+
+
+class Producer:
+    """Producer of a topic. A sync producer returns once the message is
+    stored, an async one stores it after the produce round trip and posts
+    a delivery report to the queue of the producing thread."""
+
+    def __init__(self, topic, sync=True, delivery_reports=False):
+        self.topic = topic
+        self.sync = sync
+        self.delivery_reports = delivery_reports
+        self.reports = threading.local()
+
+    def produce(self, message, partition_key=None):
+        latency = self.topic.broker.produce_latency
+        if self.sync:
+            if latency:
+                time.sleep(latency)
+            self.topic.append(message)
+            return message
+
+        msg = Message(message, None)
+        report_queue = self.get_report_queue() if self.delivery_reports else None
+
+        def deliver():
+            self.topic.append(message)
+            if report_queue is not None:
+                report_queue.put((msg, None))
+
+        if latency:
+            threading.Timer(latency, deliver).start()
+        else:
+            deliver()
+        return msg
+
+    def get_report_queue(self):
+        if not hasattr(self.reports, "queue"):
+            self.reports.queue = queue.Queue()
+        return self.reports.queue
+
+    def get_delivery_report(self, block=True, timeout=None):
+        return self.get_report_queue().get(block, timeout)
+
+    def stop(self):
+        pass
+
+
+class AIOKafkaProducer:
+    """Stand-in for the aiokafka producer on the shared broker."""
+
+    def __init__(self, bootstrap_servers=None, **kwargs):
+        self.bootstrap_servers = bootstrap_servers
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def send_and_wait(self, topic, value=None, **kwargs):
+        if broker.produce_latency:
+            await asyncio.sleep(broker.produce_latency)
+        KafkaClient.topics[str.encode(topic)].append(value)
+
+
+class SimpleConsumer:
+    def __init__(self, topic, group, auto_offset_reset, reset_offset_on_start, timeout_ms):
+        self.topic = topic
+        self.broker = topic.broker
+        self.group = group
+        self.timeout_ms = timeout_ms
+        self.auto_offset_reset = auto_offset_reset
+
+        committed = self.broker.committed[group].get(topic.name) if group else None
+        if committed is not None and not reset_offset_on_start:
+            self.position = committed
+        elif auto_offset_reset == OffsetType.LATEST:
+            self.position = len(topic.messages)
+        else:
+            self.position = 0
+
+    @property
+    def held_offsets(self):
+        return {0: self.position - 1}
+
+    def consume(self, block=True):
+        """Gets the next message, waiting up to the consumer timeout (capped
+        at the broker idle wait) or forever if there is no timeout."""
+        with self.broker.condition:
+            if self.position >= len(self.topic.messages) and block:
+                if self.timeout_ms is None or self.timeout_ms < 0:
+                    while self.position >= len(self.topic.messages):
+                        self.broker.condition.wait()
+                else:
+                    wait = min(self.timeout_ms / 1000, self.broker.idle_wait)
+                    if wait > 0:
+                        self.broker.condition.wait(wait)
+
+            if self.position >= len(self.topic.messages):
+                return None
+
+            message = self.topic.messages[self.position]
+            self.position += 1
+            return message
+
+    def __iter__(self):
+        while True:
+            message = self.consume()
+            if message is None:
+                return
+
+            start = time.perf_counter()
+            yield message
+            self.broker.service_times[self.group].append(time.perf_counter() - start)
+
+    def commit_offsets(self, partition_offsets=None):
+        # Like pykafka, explicit offsets are committed as given and the
+        # default is the offset after the last consumed message
+        if partition_offsets:
+            offset = partition_offsets[0][1]
+        else:
+            offset = self.position
+        with self.broker.condition:
+            self.broker.committed[self.group][self.topic.name] = offset
+            self.broker.condition.notify_all()
+
+    def reset_offsets(self, partition_offsets=None):
+        # Like pykafka, offsets are the last consumed message, except the
+        # magic EARLIEST and LATEST offsets, which are looked up
+        offset = partition_offsets[0][1] if partition_offsets else self.auto_offset_reset
+        if offset == OffsetType.EARLIEST:
+            self.position = 0
+        elif offset == OffsetType.LATEST:
+            self.position = len(self.topic.messages)
+        else:
+            self.position = offset + 1
+
+    def stop(self):
+        pass
+
+
+class KafkaClient:
+    """Client connected to the shared in-memory broker."""
+
+    topics = TopicDict()
+
+    def __init__(self, hosts=None, **kwargs):
+        self.hosts = hosts
@@ -0,0 +1,111 @@
+"""
+Load test of the receiver in Flask mode (app.py) and native ASGI mode
+(async_app.py). Serves each mode with uvicorn, on the in-memory Kafka
+stand-in with a simulated produce round trip, POSTs events from many
+concurrent clients, and reports requests per second and latency
+percentiles.
+
+Usage: python3 benchmarks/load_receiver.py [--requests N] [--concurrency C]
+    [--workers W] [--produce-latency-ms MS]
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+import run_pipeline
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PORT = 8089
+
+
+def start_server(workdir, mode, workers, produce_latency_ms):
+    """Starts uvicorn with the receiver app of a mode and waits for it."""
+    env = dict(
+        os.environ,
+        RECEIVER_MODE=mode,
+        RECEIVER_PRODUCE_LATENCY_MS=str(produce_latency_ms),
+        PYTHONPATH=os.pathsep.join(
+            [BENCH_DIR, os.path.join(run_pipeline.ROOT, "receiver"), run_pipeline.ROOT]
+        ),
+    )
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "serve_receiver:app",
+            "--port", str(PORT), "--workers", str(workers), "--log-level", "warning",
+        ],
+        cwd=os.path.join(workdir, "receiver"),
+        env=env,
+    )
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{PORT}/receiver/metrics").raise_for_status()
+            return server
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.terminate()
+    raise TimeoutError(f"Receiver in {mode} mode did not start")
+
+
+async def load(bodies, concurrency):
+    """POSTs the bodies from concurrent clients and times each request."""
+    latencies = []
+    queue = iter(bodies)
+
+    async def client_loop(client):
+        for path, body in queue:
+            start = time.perf_counter()
+            response = await client.post(path, json=body)
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 201, response.text
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=60
+    ) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5_000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--produce-latency-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="receiver-load-")
+    run_pipeline.prepare_workdir(workdir)
+    bodies = run_pipeline.make_bodies(args.requests)
+
+    print(
+        f"Receiver load test: {args.requests} requests, {args.concurrency} clients,"
+        f" {args.produce_latency_ms:g} ms produce round trip"
+    )
+    for mode in ("flask", "async"):
+        for workers in sorted({1, args.workers}):
+            server = start_server(workdir, mode, workers, args.produce_latency_ms)
+            try:
+                elapsed, latencies = asyncio.run(load(bodies, args.concurrency))
+            finally:
+                server.terminate()
+                server.wait()
+            run_pipeline.report(
+                f"{mode} x{workers}", len(bodies), elapsed, latencies, "request"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Offline end-to-end pipeline benchmark. Runs the receiver, storage,
+processing, analyzer and anomaly detector in one process, with an
+in-memory Kafka stand-in and a SQLite storage database, and reports
+events per second and latency percentiles for each stage.
+
+Stages run one after another on the same events:
+  receive  POSTs synthetic events to the receiver API
+  store    storage consumer threads insert the events into SQLite
+  process  processing computes the stats from the storage API
+  analyze  analyzer stats and id scans over the topics
+  anomaly  anomaly detector consumer threads evaluate the events
+
+Usage: python3 benchmarks/run_pipeline.py [--events N] [--runs R]
+    [--workdir PATH]
+"""
+
+import argparse
+import importlib
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import types
+import uuid
+from urllib.parse import urlparse
+
+import pykafka
+import yaml
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import functions
+from starlette.testclient import TestClient
+
+import fake_kafka
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Service directory, config directory and config name, and API base path
+SERVICES = {
+    "receiver": ("receiver", "receiver", "receiver"),
+    "storage": ("storage", "storage", "storage"),
+    "processing": ("processing", "processing", "processing"),
+    "analyzer": ("analyzer", "analyzer", "analyzer"),
+    "anomaly": ("anomaly_detector", "anomaly", "anomaly"),
+}
+
+ATTR_CATEGORIES = ["Museum", "Park", "Gallery", "Zoo"]
+EXP_CATEGORIES = ["Food", "Lodging", "Fees", "Transport"]
+
+
+@compiles(functions.now, "sqlite")
+def sqlite_now(element, compiler, **kw):
+    """Renders now() with milliseconds on SQLite, where it would otherwise
+    be CURRENT_TIMESTAMP with whole seconds. date_created defaults to
+    now(6) on MySQL."""
+    return "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+def write_yaml(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(data, f)
+
+
+def prepare_workdir(workdir):
+    """Writes the config of each service into its own working directory,
+    with absolute data paths, split topics and a SQLite database."""
+    with open(os.path.join(ROOT, "config/logger/log.dev.yaml"), encoding="utf-8") as f:
+        log_config = yaml.safe_load(f.read())
+
+    for name, (_, config_dir, config_name) in SERVICES.items():
+        service_dir = os.path.join(workdir, name)
+        for sub in ("config", "logger", "logs", "data"):
+            os.makedirs(os.path.join(service_dir, sub), exist_ok=True)
+
+        with open(
+            os.path.join(ROOT, f"config/{config_dir}/{config_name}.dev.yaml"),
+            encoding="utf-8",
+        ) as f:
+            config = yaml.safe_load(f.read())
+
+        if "events" in config:
+            config["events"]["mode"] = "split"
+        if name == "storage":
+            database = os.path.join(service_dir, "data", "storage.sqlite")
+            config["datastore"] = {"url": f"sqlite:///{database}"}
+        if name in ("processing", "anomaly"):
+            filename = os.path.basename(config["datastore"]["filepath"])
+            config["datastore"]["filepath"] = os.path.join(service_dir, "data", filename)
+        write_yaml(os.path.join(service_dir, f"config/{config_name}.prod.yaml"), config)
+
+        # Log to the service file only, so the report stays readable
+        service_log = dict(log_config)
+        service_log["handlers"] = {
+            "file": dict(
+                log_config["handlers"]["file"],
+                filename=os.path.join(service_dir, "logs", "app.log"),
+            )
+        }
+        service_log["loggers"] = {
+            "basicLogger": {"level": "INFO", "handlers": ["file"], "propagate": False}
+        }
+        service_log["root"] = {"level": "WARNING", "handlers": []}
+        write_yaml(os.path.join(service_dir, "logger/log.prod.yaml"), service_log)
+
+
+def load_service(workdir, name):
+    """Imports a service app from its working directory. Connexion resolves
+    operationIds like app.get_stats on the first request, so a request is
+    made before the next service takes over the app module name."""
+    service_src, _, base_path = SERVICES[name]
+    os.chdir(os.path.join(workdir, name))
+    sys.path.insert(0, os.path.join(ROOT, service_src))
+
+    module = importlib.import_module("app")
+    TestClient(module.app).get(f"/{base_path}/metrics")
+
+    sys.modules[f"{name}_app"] = sys.modules.pop("app")
+    sys.path.remove(os.path.join(ROOT, service_src))
+    os.chdir(workdir)
+
+    return module
+
+
+def make_bodies(count):
+    """Creates alternating attraction and expense POST bodies."""
+    users = [str(uuid.uuid4()) for _ in range(50)]
+    bodies = []
+    for i in range(count):
+        if i % 2 == 0:
+            bodies.append(
+                (
+                    "/receiver/info/attractions",
+                    {
+                        "user_id": random.choice(users),
+                        "attraction_category": random.choice(ATTR_CATEGORIES),
+                        "hours_open": random.randint(0, 24),
+                        "attraction_timestamp": "2030-07-08 21:00:49",
+                    },
+                )
+            )
+        else:
+            bodies.append(
+                (
+                    "/receiver/info/expenses",
+                    {
+                        "user_id": random.choice(users),
+                        "amount": round(random.lognormvariate(2.5, 0.8), 2),
+                        "expense_category": random.choice(EXP_CATEGORIES),
+                        "expense_timestamp": "2030-07-08 21:00:49",
+                    },
+                )
+            )
+    return bodies
+
+
+def report(stage, events, elapsed, latencies, unit="event"):
+    """Prints the throughput and latency percentiles of a stage."""
+    latencies = sorted(latencies)
+
+    def percentile(q):
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000
+
+    print(
+        f"{stage:<8} {events / elapsed:>12,.0f} events/s"
+        f" | per {unit} p50 = {percentile(0.5):.3f} ms"
+        f" | p95 = {percentile(0.95):.3f} ms | p99 = {percentile(0.99):.3f} ms"
+    )
+
+
+def bench_receive(receiver, bodies):
+    client = TestClient(receiver.app)
+    latencies = []
+    start = time.perf_counter()
+    for path, body in bodies:
+        request_start = time.perf_counter()
+        response = client.post(path, json=body)
+        latencies.append(time.perf_counter() - request_start)
+        assert response.status_code == 201, response.text
+    report("receive", len(bodies), time.perf_counter() - start, latencies, "request")
+
+
+def bench_consumer(stage, start_threads, group, topic_names, events):
+    """Starts a service's consumer threads and times them to the end of
+    the topics."""
+    fake_kafka.broker.service_times[group].clear()
+    start = time.perf_counter()
+    start_threads()
+    fake_kafka.broker.wait_for_commits(group, topic_names)
+    elapsed = time.perf_counter() - start
+    report(stage, events, elapsed, fake_kafka.broker.service_times[group])
+
+
+def bench_process(processing, storage, events, runs):
+    """Runs the processing stats from scratch, with its storage requests
+    served in-process."""
+    storage_client = TestClient(storage.app)
+
+    def get(url, params=None):
+        return storage_client.get(urlparse(url).path, params=params)
+
+    processing.httpx = types.SimpleNamespace(get=get)
+
+    latencies = []
+    for _ in range(runs):
+        if os.path.exists(processing.app_config["datastore"]["filepath"]):
+            os.remove(processing.app_config["datastore"]["filepath"])
+        start = time.perf_counter()
+        processing.populate_stats()
+        latencies.append(time.perf_counter() - start)
+    report("process", events, statistics.median(latencies), latencies, "run")
+
+
+def bench_analyze(analyzer, events, runs):
+    """Times the analyzer stats and id scans over the topics, which return
+    as soon as they reach the high watermarks of a topic."""
+    latencies = []
+    for _ in range(runs):
+        for scan in (analyzer.get_event_stats, analyzer.get_event_ids):
+            start = time.perf_counter()
+            scan()
+            latencies.append(time.perf_counter() - start)
+    report("analyze", events, statistics.median(latencies), latencies, "scan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=5_000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workdir")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pipeline-bench-")
+    prepare_workdir(workdir)
+    sys.path.insert(0, ROOT)
+    pykafka.KafkaClient = fake_kafka.KafkaClient
+
+    receiver = load_service(workdir, "receiver")
+    storage = load_service(workdir, "storage")
+    processing = load_service(workdir, "processing")
+    analyzer = load_service(workdir, "analyzer")
+    anomaly = load_service(workdir, "anomaly")
+
+    sys.modules["create_db"].create_tables()
+
+    topic_names = [
+        str.encode(name) for name in storage.app_config["events"]["topics"].values()
+    ]
+    # Storage starts from the latest offsets, so it starts at the first event
+    for name in topic_names:
+        fake_kafka.broker.commit(b"event_group", name, 0)
+
+    print(f"Pipeline benchmark: {args.events} events, workdir {workdir}")
+
+    bench_receive(receiver, make_bodies(args.events))
+    bench_consumer(
+        "store", storage.setup_kafka_thread, b"event_group", topic_names, args.events
+    )
+    bench_process(processing, storage, args.events, args.runs)
+    bench_analyze(analyzer, args.events, args.runs)
+    bench_consumer(
+        "anomaly",
+        anomaly.setup_kafka_thread,
+        str.encode(anomaly.app_config["consumer"]["group"]),
+        topic_names,
+        args.events,
+    )
+
+
+if __name__ == "__main__":
+    main()
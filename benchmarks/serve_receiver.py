@@ -0,0 +1,23 @@
+"""
+Receiver app for the load test, served by uvicorn in each worker process
+with the in-memory Kafka stand-in. Set up by load_receiver.py through the
+environment:
+  RECEIVER_MODE               flask (app.py) or async (async_app.py)
+  RECEIVER_PRODUCE_LATENCY_MS simulated round trip of a Kafka produce
+"""
+
+import os
+
+import aiokafka
+import pykafka
+
+import fake_kafka
+
+fake_kafka.broker.produce_latency = float(os.environ.get("RECEIVER_PRODUCE_LATENCY_MS", 0)) / 1000
+pykafka.KafkaClient = fake_kafka.KafkaClient
+aiokafka.AIOKafkaProducer = fake_kafka.AIOKafkaProducer
+
+if os.environ.get("RECEIVER_MODE", "flask") == "async":
+    from async_app import app
+else:
+    from app import app
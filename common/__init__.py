@@ -0,0 +1 @@
+"""Helpers shared by the services. Mounted into each service at /app/common."""
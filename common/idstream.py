@@ -0,0 +1,101 @@
+"""Binary id streams. Each event is a fixed size record of its 16-byte trace
+id, 16-byte user id and a one byte event type code. Streams are sorted by
+trace id and gzip compressed, so two of them can be diffed with a
+merge-join in constant memory. Records not read in trace id order are
+sorted with an external merge sort, so producing a stream also takes
+memory bounded by the sort run size, not by the number of events.
+"""
+
+import heapq
+import tempfile
+import uuid
+import zlib
+
+EVENT_TYPES = ("attraction_info", "expense_info")
+RECORD_SIZE = 33
+
+# Records per compressed chunk
+CHUNK_RECORDS = 4096
+
+# Records sorted in memory before a sorted run is spilled to disk
+RUN_RECORDS = 1 << 19
+
+
+def encode_record(trace_id, user_id, event_type):
+    """Encodes an event's ids as a binary record."""
+    return (
+        uuid.UUID(trace_id).bytes
+        + uuid.UUID(user_id).bytes
+        + bytes((EVENT_TYPES.index(event_type),))
+    )
+
+
+def decode_record(record):
+    """Decodes a binary record into an id entry dictionary."""
+    return {
+        "user_id": str(uuid.UUID(bytes=bytes(record[16:32]))),
+        "trace_id": str(uuid.UUID(bytes=bytes(record[:16]))),
+        "type": EVENT_TYPES[record[32]],
+    }
+
+
+def gzip_chunks(records):
+    """Compresses a stream of records into gzip chunks."""
+    compressor = zlib.compressobj(wbits=31)
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == CHUNK_RECORDS:
+            chunk = compressor.compress(b"".join(batch))
+            batch = []
+            if chunk:
+                yield chunk
+
+    yield compressor.compress(b"".join(batch)) + compressor.flush()
+
+
+def spill_run(run):
+    """Sorts a run of records into a temporary file."""
+    f = tempfile.TemporaryFile()
+    f.write(b"".join(sorted(run)))
+    return f
+
+
+def read_run(f):
+    """Reads the records of a spilled run a chunk at a time."""
+    f.seek(0)
+    while True:
+        block = f.read(RECORD_SIZE * CHUNK_RECORDS)
+        if not block:
+            return
+        for start in range(0, len(block), RECORD_SIZE):
+            yield block[start : start + RECORD_SIZE]
+
+
+def sort_records(records, run_records=RUN_RECORDS):
+    """Sorts records by trace id. Runs of run_records are sorted in memory
+    and spilled to temporary files, which are then merged.
+
+    Yields:
+    Each record in trace id order.
+    """
+    runs = []
+    try:
+        run = []
+        for record in records:
+            run.append(record)
+            if len(run) == run_records:
+                runs.append(spill_run(run))
+                run = []
+
+        if not runs:
+            # A single run is sorted without touching the disk
+            yield from sorted(run)
+            return
+
+        if run:
+            runs.append(spill_run(run))
+        yield from heapq.merge(*(read_run(f) for f in runs))
+    finally:
+        for f in runs:
+            f.close()
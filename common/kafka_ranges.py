@@ -0,0 +1,178 @@
+"""Splits Kafka topics into partition offset ranges and reads them, so a
+topic's history can be processed by parallel workers, and scans whole
+topics up to the offsets they had when the scan started."""
+
+from pykafka.common import OffsetType
+
+# Fetch settings of bulk reads. Larger fetches and a deeper queue than the
+# pykafka defaults of 1 MB and 2000 messages, so a scan waits on fewer
+# fetch round trips.
+FETCH_MESSAGE_MAX_BYTES = 4 * 1024 * 1024
+QUEUED_MAX_MESSAGES = 20_000
+
+
+def get_offset_ranges(topic, chunk_size, start_offsets=None):
+    """Splits every partition of a topic into offset ranges.
+
+    Parameters:
+    topic (pykafka.Topic): topic to split
+    chunk_size (int): maximum number of messages in a range
+    start_offsets (dict): optional partition id to first offset to read,
+    defaults to the earliest available offset of each partition
+
+    Returns:
+    A list of (partition_id, start, end) tuples ordered by partition and
+    offset, where end is exclusive.
+    """
+    earliest = topic.earliest_available_offsets()
+    latest = topic.latest_available_offsets()
+
+    ranges = []
+    for partition_id in sorted(latest):
+        first = earliest[partition_id].offset[0]
+        if start_offsets is not None and partition_id in start_offsets:
+            first = max(first, start_offsets[partition_id])
+        end = latest[partition_id].offset[0]
+
+        for start in range(first, end, chunk_size):
+            ranges.append((partition_id, start, min(start + chunk_size, end)))
+
+    return ranges
+
+
+def get_earliest_offset(topic, partition_id):
+    """Gets the earliest offset still held by a partition."""
+    return topic.earliest_available_offsets()[partition_id].offset[0]
+
+
+def read_range(topic, partition_id, start, end, consumer_timeout_ms=5000):
+    """Reads the messages of one partition with start <= offset < end.
+
+    Yields:
+    Each pykafka message in offset order. The range is read to its end once
+    the message at end - 1, or a later one if compaction removed it, was
+    consumed, or once retention removed every offset before end.
+
+    Raises:
+    TimeoutError if no message arrives within the timeout before the range
+    was read to its end, so the caller retries the range instead of
+    treating it as done.
+    """
+    if start >= end:
+        return
+
+    earliest = get_earliest_offset(topic, partition_id)
+    if earliest >= end:
+        # Removed by retention
+        return
+
+    partition = topic.partitions[partition_id]
+    consumer = topic.get_simple_consumer(
+        partitions=[partition],
+        reset_offset_on_start=False,
+        consumer_timeout_ms=consumer_timeout_ms,
+        fetch_message_max_bytes=FETCH_MESSAGE_MAX_BYTES,
+        queued_max_messages=QUEUED_MAX_MESSAGES,
+    )
+    if start <= earliest:
+        # start - 1 would be the magic LATEST offset -1 when start is 0
+        consumer.reset_offsets([(partition, OffsetType.EARLIEST)])
+    else:
+        # The counter holds the last consumed offset, so start - 1 reads start next
+        consumer.reset_offsets([(partition, start - 1)])
+
+    try:
+        for msg in consumer:
+            if msg.offset >= end:
+                return
+            yield msg
+            if msg.offset >= end - 1:
+                return
+    finally:
+        consumer.stop()
+
+    # Timed out, which only completes the range if retention removed the rest
+    if get_earliest_offset(topic, partition_id) < end:
+        raise TimeoutError(
+            f"Partition {partition_id} of {topic.name.decode()} was not read"
+            f" to offset {end}"
+        )
+
+
+def commit_group_offsets(client, group, end_offsets):
+    """Moves a consumer group to the end of processed offset ranges, so its
+    consumers resume with the next message.
+
+    Parameters:
+    client (pykafka.KafkaClient): client to commit with
+    group (bytes): consumer group name
+    end_offsets (dict): topic name to a dict of partition id to the end
+    offset, exclusive, of the processed range
+    """
+    for topic_name, partition_ends in end_offsets.items():
+        topic = client.topics[str.encode(topic_name)]
+        consumer = topic.get_simple_consumer(
+            consumer_group=group,
+            reset_offset_on_start=False,
+            auto_commit_enable=False,
+        )
+        # Committed offsets are the next offset the group reads
+        consumer.commit_offsets(
+            [
+                (topic.partitions[partition_id], end)
+                for partition_id, end in partition_ends.items()
+            ]
+        )
+        consumer.stop()
+
+
+def get_high_watermarks(topic):
+    """Gets the high watermark, the offset after the last message, of each
+    partition of a topic holding messages."""
+    earliest = topic.earliest_available_offsets()
+    latest = topic.latest_available_offsets()
+
+    return {
+        partition_id: latest[partition_id].offset[0]
+        for partition_id in latest
+        if latest[partition_id].offset[0] > earliest[partition_id].offset[0]
+    }
+
+
+def scan_topic(topic, consumer_timeout_ms=5000):
+    """Reads a topic from the earliest offsets up to the high watermarks
+    its partitions had when the scan started.
+
+    Yields:
+    Each pykafka message, in offset order within each partition. Stops as
+    soon as every partition reaches its watermark, or returns at once if
+    the topic is empty. The timeout only stops a scan whose last offsets
+    were removed by compaction.
+    """
+    watermarks = get_high_watermarks(topic)
+    if not watermarks:
+        return
+
+    consumer = topic.get_simple_consumer(
+        partitions=[topic.partitions[partition_id] for partition_id in watermarks],
+        auto_offset_reset=OffsetType.EARLIEST,
+        reset_offset_on_start=True,
+        consumer_timeout_ms=consumer_timeout_ms,
+        fetch_message_max_bytes=FETCH_MESSAGE_MAX_BYTES,
+        queued_max_messages=QUEUED_MAX_MESSAGES,
+    )
+
+    try:
+        for msg in consumer:
+            end = watermarks.get(msg.partition_id)
+            if end is None:
+                # Produced to a partition already read to its watermark
+                continue
+
+            yield msg
+            if msg.offset >= end - 1:
+                del watermarks[msg.partition_id]
+                if not watermarks:
+                    break
+    finally:
+        consumer.stop()
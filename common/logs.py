@@ -0,0 +1,128 @@
+"""Logging setup for the services. Handlers from the logger config run on a
+background listener thread behind a queue, so request and consumer threads
+only pay for putting the record on the queue. Per-event log lines go
+through an EventLogger, which samples or rate-limits them.
+"""
+
+import atexit
+import logging
+import logging.config
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener
+from threading import Lock
+
+# Queue listeners started by configure, stopped at exit
+listeners = []
+
+
+def configure(log_config, settings=None):
+    """Applies a logging dictConfig, then moves the handlers of each
+    configured logger behind a queue unless settings["queue"] is false.
+
+    Parameters:
+    log_config (dict): logging dictConfig
+    settings (dict): the logging section of the service config
+
+    """
+    settings = settings or {}
+    shutdown()
+    logging.config.dictConfig(log_config)
+
+    if not settings.get("queue", True):
+        return
+
+    names = list(log_config.get("loggers", {}))
+    if "root" in log_config:
+        names.append(None)
+
+    for name in names:
+        logger = logging.getLogger(name)
+        handlers = list(logger.handlers)
+        if not handlers:
+            continue
+
+        records = queue.SimpleQueue()
+        listener = QueueListener(records, *handlers, respect_handler_level=True)
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(QueueHandler(records))
+
+        listener.start()
+        listeners.append(listener)
+
+
+@atexit.register
+def shutdown():
+    """Stops the queue listeners after they write the queued records."""
+    while listeners:
+        listeners.pop().stop()
+
+
+class EventLogger:
+    """Logger for lines written once per event. Keeps a random sample_rate
+    share of the records, and at most rate_limit records per second; dropped
+    records are counted and reported on the next record kept.
+    """
+
+    def __init__(self, logger, sample_rate=1.0, rate_limit=None):
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self.rate_limit = rate_limit
+        self.lock = Lock()
+        self.dropped = 0
+        self.tokens = rate_limit
+        self.refilled_at = time.monotonic()
+
+    @classmethod
+    def from_settings(cls, logger, settings=None):
+        """Creates an event logger from the logging section of a service
+        config."""
+        events = (settings or {}).get("events", {})
+        return cls(logger, events.get("sample_rate", 1.0), events.get("rate_limit"))
+
+    def allow(self):
+        """Decides whether to keep the next record.
+
+        Returns:
+        0 to drop the record, otherwise the number of records it stands for.
+        """
+        with self.lock:
+            keep = self.sample_rate >= 1 or random.random() < self.sample_rate
+
+            if keep and self.rate_limit is not None:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.rate_limit,
+                    self.tokens + (now - self.refilled_at) * self.rate_limit,
+                )
+                self.refilled_at = now
+                keep = self.tokens >= 1
+                if keep:
+                    self.tokens -= 1
+
+            if not keep:
+                self.dropped += 1
+                return 0
+
+            dropped = self.dropped
+            self.dropped = 0
+            return dropped + 1
+
+    def log(self, level, msg, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+
+        count = self.allow()
+        if count == 0:
+            return
+        if count > 1:
+            msg = f"{msg} [1 of {count} events logged]"
+        self.logger.log(level, msg, *args)
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(logging.INFO, msg, *args)
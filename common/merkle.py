@@ -0,0 +1,137 @@
+"""Merkle digests of trace IDs. IDs are bucketed by the hex characters at the
+start of the UUID, so each bucket is a node in a 16-way tree whose digest is
+the ID count and the sum of the ID hashes. A parent digest is the sum of its
+children, so two services hold the same IDs in a bucket if its digests match.
+"""
+
+import hashlib
+from bisect import bisect_left
+
+HEX_CHARS = "0123456789abcdef"
+HASH_MODULUS = 1 << 128
+
+# Prefixes are limited to the first group of the UUID, before any hyphen
+MAX_PREFIX_LENGTH = 8
+
+
+def id_hash(trace_id):
+    """Hashes a trace ID to a 128-bit integer."""
+    return int.from_bytes(
+        hashlib.blake2b(trace_id.encode("utf-8"), digest_size=16).digest(), "big"
+    )
+
+
+def format_digest(count, total):
+    """Formats a bucket's ID count and hash sum as its digest."""
+    return f"{count}:{total % HASH_MODULUS:032x}"
+
+
+def prefix_bounds(prefix):
+    """Gets the range of UUID strings starting with a hex prefix.
+
+    Returns:
+    A tuple of the inclusive lower bound and exclusive upper bound, where
+    None means unbounded.
+    """
+    if prefix == "":
+        return None, None
+
+    def pad(value):
+        return value.ljust(MAX_PREFIX_LENGTH, "0") + "-0000-0000-0000-000000000000"
+
+    upper = int(prefix, 16) + 1
+    if upper >= 16 ** len(prefix):
+        return pad(prefix), None
+
+    return pad(prefix), pad(f"{upper:0{len(prefix)}x}")
+
+
+def add_to_buckets(sums, trace_ids, depth):
+    """Adds trace IDs to the running bucket sums of the children of a prefix.
+
+    Parameters:
+    sums (dict): the next hex character to the [count, hash sum] of that
+        child bucket, updated in place
+    trace_ids (iterable): the trace IDs starting with the prefix
+    depth (int): length of the prefix
+    """
+    for trace_id in trace_ids:
+        bucket = sums.setdefault(trace_id[depth], [0, 0])
+        bucket[0] += 1
+        bucket[1] = (bucket[1] + id_hash(trace_id)) % HASH_MODULUS
+
+    return sums
+
+
+def combine_buckets(*bucket_sums):
+    """Adds up the bucket sums of separate sets of trace IDs."""
+    combined = {}
+    for sums in bucket_sums:
+        for char, (count, total) in sums.items():
+            bucket = combined.setdefault(char, [0, 0])
+            bucket[0] += count
+            bucket[1] = (bucket[1] + total) % HASH_MODULUS
+
+    return combined
+
+
+def format_digests(sums):
+    """Formats the bucket sums of add_to_buckets as the digests of the child
+    buckets, by hex character."""
+    return {char: format_digest(*sums[char]) for char in sorted(sums) if sums[char][0]}
+
+
+def digest_children(trace_ids, prefix):
+    """Computes the digests of the child buckets of a prefix.
+
+    Parameters:
+    trace_ids (iterable): the trace IDs starting with the prefix
+    prefix (str): hex prefix of the parent bucket
+
+    Returns:
+    A dictionary of the next hex character to the digest of that child
+    bucket. Empty buckets are left out.
+    """
+    return format_digests(add_to_buckets({}, trace_ids, len(prefix)))
+
+
+class MerkleIndex:
+    """In-memory index of ID entries sorted by trace ID, with cumulative hash
+    sums so any bucket's digest is found with two binary searches.
+    """
+
+    def __init__(self, entries):
+        self.entries = sorted(entries, key=lambda entry: entry["trace_id"])
+        self.trace_ids = [entry["trace_id"] for entry in self.entries]
+
+        self.sums = [0]
+        for trace_id in self.trace_ids:
+            self.sums.append(self.sums[-1] + id_hash(trace_id))
+
+    def _slice(self, prefix):
+        """Gets the index range of the entries starting with the prefix."""
+        lower, upper = prefix_bounds(prefix)
+        start = 0
+        end = len(self.trace_ids)
+        if lower is not None:
+            start = bisect_left(self.trace_ids, lower)
+        if upper is not None:
+            end = bisect_left(self.trace_ids, upper)
+
+        return start, end
+
+    def children(self, prefix):
+        """Gets the digests of the non-empty child buckets of a prefix."""
+        digests = {}
+        for char in HEX_CHARS:
+            start, end = self._slice(prefix + char)
+            if end > start:
+                total = self.sums[end] - self.sums[start]
+                digests[char] = format_digest(end - start, total)
+
+        return digests
+
+    def bucket(self, prefix):
+        """Gets the ID entries starting with the prefix."""
+        start, end = self._slice(prefix)
+        return self.entries[start:end]
@@ -0,0 +1,272 @@
+"""Prometheus metrics for the services. Metrics register themselves in a
+module level registry, which the /metrics endpoint of each service renders
+in the Prometheus text format.
+"""
+
+import bisect
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+from common.sketch import WindowedSketch
+
+# Prometheus reads plain text as its 0.0.4 exposition format
+CONTENT_TYPE = "text/plain"
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+registry = []
+
+
+def escape(value):
+    """Escapes a label value."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labelnames, values, extra=()):
+    """Formats label names and values as a Prometheus label set."""
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    """Formats a sample value."""
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class of a metric with a fixed set of label names."""
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = Lock()
+        self.values = {}
+        registry.append(self)
+
+    def key(self, labels):
+        """Gets the label values in label name order."""
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Gets the (suffix, label values, extra labels, value) samples."""
+        with self.lock:
+            return [("", key, (), value) for key, value in self.values.items()]
+
+    def render(self):
+        """Renders the metric in the Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for suffix, key, extra, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{format_labels(self.labelnames, key, extra)}"
+                f" {format_value(value)}"
+            )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Monotonically increasing count."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that goes up and down. Gauges can also be read from a function
+    when the metrics are rendered, for values that are costly to keep up to
+    date on every event."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.functions = {}
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def set_function(self, function, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.functions[key] = function
+
+    def samples(self):
+        samples = super().samples()
+        with self.lock:
+            functions = list(self.functions.items())
+
+        for key, function in functions:
+            try:
+                value = function()
+            except Exception:  # pylint: disable=broad-except
+                # A failed read leaves the sample out of this scrape
+                continue
+            if value is not None:
+                samples.append(("", key, (), value))
+
+        return samples
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the time spent in the block, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            values = [
+                (key, list(counts), total) for key, (counts, total) in self.values.items()
+            ]
+
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(
+                    ("_bucket", key, (("le", format_value(bound)),), cumulative)
+                )
+            samples.append(("_sum", key, (), total))
+            samples.append(("_count", key, (), cumulative))
+
+        return samples
+
+
+class LatencySummary:
+    """Percentiles of a latency over sliding windows, read from streaming
+    sketches and exported as a gauge per window and quantile."""
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, name, documentation, windows=(60, 300)):
+        self.sketches = [WindowedSketch(window) for window in windows]
+        self.gauge = Gauge(name, documentation, ("window", "quantile"))
+
+        for window, sketch in zip(windows, self.sketches):
+            for i, quantile in enumerate(self.QUANTILES):
+                self.gauge.set_function(
+                    lambda sketch=sketch, i=i: sketch.quantiles(self.QUANTILES)[i],
+                    window=f"{window}s",
+                    quantile=quantile,
+                )
+
+    def observe(self, value):
+        for sketch in self.sketches:
+            sketch.add(value)
+
+
+def render():
+    """Renders every registered metric in the Prometheus text format."""
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+def get_metrics():
+    """Gets the metrics of the service in the Prometheus text format."""
+    return render(), 200, {"Content-Type": CONTENT_TYPE}
+
+
+# Shared metrics
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Latency of API requests by operationId.",
+    ("operation", "status"),
+)
+KAFKA_PRODUCED = Counter(
+    "kafka_produced_messages_total", "Messages produced to Kafka.", ("topic",)
+)
+KAFKA_CONSUMED = Counter(
+    "kafka_consumed_messages_total", "Messages consumed from Kafka.", ("topic",)
+)
+KAFKA_LAG = Gauge(
+    "kafka_consumer_lag", "Messages behind the end of the topic.", ("topic",)
+)
+SCAN_DURATION = Histogram(
+    "scan_duration_seconds",
+    "Duration of scans and batches over the events.",
+    ("scan",),
+)
+
+
+def consumer_lag(consumer):
+    """Gets the number of messages after the last consumed offsets of a
+    pykafka consumer, summed over its partitions."""
+    latest = consumer.topic.latest_available_offsets()
+    held = consumer.held_offsets
+    return sum(
+        max(latest[partition_id].offset[0] - 1 - held.get(partition_id, -1), 0)
+        for partition_id in latest
+    )
+
+
+def track_consumer(topic_name, consumer):
+    """Reports the lag of a consumer when the metrics are rendered."""
+    KAFKA_LAG.set_function(lambda: consumer_lag(consumer), topic=topic_name)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the latency of each request under the
+    operationId resolved by the Connexion router."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            routing = scope.get("extensions", {}).get("connexion_routing", {})
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - start,
+                operation=routing.get("operation_id") or "unknown",
+                status=status["code"],
+            )
@@ -0,0 +1,86 @@
+"""Streaming percentile sketch over a sliding time window. Values are counted
+in logarithmic buckets, so every percentile is within a fixed relative error
+and memory depends on the range of values rather than their number. The
+window is split into slices, and the oldest slice is dropped as time moves
+on.
+"""
+
+import math
+import time
+from collections import deque
+from threading import Lock
+
+# Values below this are counted as zero
+MIN_VALUE = 1e-6
+
+
+class WindowedSketch:
+    """Log-bucket percentile sketch of the values added in the last window
+    seconds."""
+
+    def __init__(self, window, slices=6, relative_accuracy=0.01, clock=time.monotonic):
+        self.slice_length = window / slices
+        self.slice_count = slices
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.clock = clock
+        self.lock = Lock()
+        # (slice number, {bucket key: count}), oldest first
+        self.slices = deque()
+
+    def _current_slice(self):
+        return int(self.clock() // self.slice_length)
+
+    def _expire(self, current):
+        while self.slices and self.slices[0][0] <= current - self.slice_count:
+            self.slices.popleft()
+
+    def add(self, value):
+        """Counts a value in the current slice."""
+        key = None if value < MIN_VALUE else math.ceil(math.log(value) / self.log_gamma)
+        current = self._current_slice()
+
+        with self.lock:
+            if not self.slices or self.slices[-1][0] != current:
+                self.slices.append((current, {}))
+                self._expire(current)
+            counts = self.slices[-1][1]
+            counts[key] = counts.get(key, 0) + 1
+
+    def quantiles(self, quantiles):
+        """Estimates quantiles of the values in the window.
+
+        Parameters:
+        quantiles (list): quantiles between 0 and 1, in increasing order
+
+        Returns:
+        A list with the estimate of each quantile, or None for each if the
+        window is empty.
+        """
+        with self.lock:
+            self._expire(self._current_slice())
+            merged = {}
+            for _, counts in self.slices:
+                for key, count in counts.items():
+                    merged[key] = merged.get(key, 0) + count
+
+        total = sum(merged.values())
+        if total == 0:
+            return [None] * len(quantiles)
+
+        # Zero bucket first, then the log buckets in increasing order
+        keys = sorted(merged, key=lambda key: -math.inf if key is None else key)
+        estimates = []
+        cumulative = 0
+        position = 0
+        for quantile in quantiles:
+            rank = quantile * (total - 1)
+            while cumulative + merged[keys[position]] <= rank:
+                cumulative += merged[keys[position]]
+                position += 1
+            key = keys[position]
+            estimates.append(
+                0.0 if key is None else 2 * self.gamma**key / (self.gamma + 1)
+            )
+
+        return estimates
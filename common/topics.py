@@ -0,0 +1,36 @@
+"""Resolves the Kafka topics of the events from the events section of a
+service config. Its mode sets the topic layout:
+
+combined: every event type on the single events.topic
+split: each event type on its own topic from events.topics
+both: consumers only, reads the combined topic and the per-type topics
+"""
+
+
+def get_mode(events_config):
+    """Gets the topic layout of the events, combined by default."""
+    return events_config.get("mode", "combined")
+
+
+def get_topic_name(events_config, event_type):
+    """Gets the name of the topic the event type is published to."""
+    if get_mode(events_config) == "split":
+        return events_config["topics"][event_type]
+
+    return events_config["topic"]
+
+
+def get_topic_names(events_config, event_type=None):
+    """Gets the names of the topics holding events of the given type, or
+    of every type if no event type is given."""
+    mode = get_mode(events_config)
+    topic_names = []
+    if mode in ("combined", "both"):
+        topic_names.append(events_config["topic"])
+    if mode in ("split", "both"):
+        if event_type is None:
+            topic_names.extend(events_config["topics"].values())
+        else:
+            topic_names.append(events_config["topics"][event_type])
+
+    return topic_names
@@ -0,0 +1,197 @@
+"""Fast-path OpenAPI validation. Connexion builds a new JSON schema validator
+for every request and response body. With these middlewares, each operation
+compiles the validator of each of its schemas once, when add_api builds it,
+and for the operations listed as fast, only a sample of the bulk list
+responses is validated.
+
+Usage:
+    app = connexion.FlaskApp(__name__, middlewares=validation.middlewares())
+    app.add_api(..., validator_map=validation.validator_map(app_config.get("validation")))
+"""
+
+import random
+
+from connexion.datastructures import MediaTypeDict
+from connexion.json_schema import Draft4RequestValidator, Draft4ResponseValidator
+from connexion.middleware.main import ConnexionMiddleware
+from connexion.middleware.request_validation import (
+    RequestValidationAPI,
+    RequestValidationMiddleware,
+)
+from connexion.middleware.response_validation import (
+    ResponseValidationAPI,
+    ResponseValidationMiddleware,
+)
+from connexion.validators import (
+    VALIDATOR_MAP,
+    JSONRequestBodyValidator,
+    JSONResponseBodyValidator,
+    TextResponseBodyValidator,
+)
+from jsonschema import Draft4Validator
+
+
+class CompiledSchema(dict):
+    """Schema of an operation with its compiled validator."""
+
+    def __init__(self, schema, validator_cls):
+        super().__init__(schema)
+        self.validator = validator_cls(self, format_checker=Draft4Validator.FORMAT_CHECKER)
+
+
+def compiled_validator(schema, validator_cls):
+    """Gets the compiled validator of a schema, or compiles one for a schema
+    served by the default Connexion middlewares."""
+    if isinstance(schema, CompiledSchema):
+        return schema.validator
+    return validator_cls(schema, format_checker=Draft4Validator.FORMAT_CHECKER)
+
+
+class CompiledOperation:
+    """Operation whose body and response schemas are resolved once and kept
+    with their compiled validators. Connexion resolves a new copy of a
+    schema on every request otherwise."""
+
+    def __init__(self, operation):
+        self._operation = operation
+        self._schemas = {}
+
+    def __getattr__(self, name):
+        return getattr(self._operation, name)
+
+    def _compiled(self, key, validator_cls, resolve):
+        schema = self._schemas.get(key)
+        if schema is None:
+            schema = self._schemas.setdefault(
+                key, CompiledSchema(resolve(), validator_cls)
+            )
+        return schema
+
+    def body_schema(self, content_type=None):
+        return self._compiled(
+            ("body", content_type),
+            Draft4RequestValidator,
+            lambda: self._operation.body_schema(content_type),
+        )
+
+    def response_schema(self, status_code=None, content_type=None):
+        return self._compiled(
+            ("response", status_code, content_type),
+            Draft4ResponseValidator,
+            lambda: self._operation.response_schema(status_code, content_type),
+        )
+
+
+class CompiledRequestValidationAPI(RequestValidationAPI):
+    """Request validation of operations with compiled schemas."""
+
+    def make_operation(self, operation):
+        return super().make_operation(CompiledOperation(operation))
+
+
+class CompiledRequestValidationMiddleware(RequestValidationMiddleware):
+    """Request validation middleware compiling each schema once."""
+
+    api_cls = CompiledRequestValidationAPI
+
+
+class CompiledResponseValidationAPI(ResponseValidationAPI):
+    """Response validation of operations with compiled schemas."""
+
+    def make_operation(self, operation):
+        return super().make_operation(CompiledOperation(operation))
+
+
+class CompiledResponseValidationMiddleware(ResponseValidationMiddleware):
+    """Response validation middleware compiling each schema once."""
+
+    api_cls = CompiledResponseValidationAPI
+
+
+def middlewares():
+    """Gets the Connexion middleware stack with the validation middlewares
+    that compile each schema once."""
+    replacements = {
+        RequestValidationMiddleware: CompiledRequestValidationMiddleware,
+        ResponseValidationMiddleware: CompiledResponseValidationMiddleware,
+    }
+    return [
+        replacements.get(middleware, middleware)
+        for middleware in ConnexionMiddleware.default_middlewares
+    ]
+
+
+class CachedJSONRequestBodyValidator(JSONRequestBodyValidator):
+    """JSON request body validator with a compiled schema validator."""
+
+    @property
+    def _validator(self):
+        return compiled_validator(self._schema, Draft4RequestValidator)
+
+
+class CachedJSONResponseBodyValidator(JSONResponseBodyValidator):
+    """JSON response body validator with a compiled schema validator, which
+    validates a sample of the list responses of fast operations."""
+
+    fast_operations = frozenset()
+    sample_rate = 1.0
+
+    @property
+    def validator(self):
+        return compiled_validator(self._schema, Draft4ResponseValidator)
+
+    def wrap_send(self, send):
+        routing = self._scope.get("extensions", {}).get("connexion_routing", {})
+        if (
+            routing.get("operation_id") in self.fast_operations
+            and (self._schema or {}).get("type") == "array"
+            and random.random() >= self.sample_rate
+        ):
+            # Passes the response through without buffering it
+            return send
+
+        return super().wrap_send(send)
+
+
+class CachedTextResponseBodyValidator(TextResponseBodyValidator):
+    """Text response body validator with a compiled schema validator."""
+
+    @property
+    def validator(self):
+        return compiled_validator(self._schema, Draft4ResponseValidator)
+
+
+def validator_map(settings=None):
+    """Creates the Connexion validator map for a service.
+
+    Parameters:
+    settings (dict): the validation section of the service config, with
+    fast_operations, the operationIds to sample list responses of, and
+    response_sample_rate, the share of those responses to validate
+
+    Returns:
+    A validator map for add_api.
+    """
+    settings = settings or {}
+    response_validator = type(
+        "ServiceJSONResponseBodyValidator",
+        (CachedJSONResponseBodyValidator,),
+        {
+            "fast_operations": frozenset(settings.get("fast_operations", [])),
+            "sample_rate": settings.get("response_sample_rate", 1.0),
+        },
+    )
+
+    body = MediaTypeDict(VALIDATOR_MAP["body"])
+    body["*/*json"] = CachedJSONRequestBodyValidator
+
+    return {
+        "parameter": VALIDATOR_MAP["parameter"],
+        "body": body,
+        "response": MediaTypeDict(
+            {
+                "*/*json": response_validator,
+                "text/plain": CachedTextResponseBodyValidator,
+            }
+        ),
+    }
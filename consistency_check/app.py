@@ -5,16 +5,22 @@ and analyzer services about the counts and user/trace ids for comparison.
 
 import os
 import time
-from datetime import timezone, datetime as dt
+import asyncio
+from datetime import timezone, timedelta, datetime as dt
 import json
-import logging.config
+import logging
+from collections import deque
+from threading import Lock
 
 import connexion
 import yaml
 import httpx
+from apscheduler.schedulers.background import BackgroundScheduler
 from connexion.middleware import MiddlewarePosition
 from starlette.middleware.cors import CORSMiddleware
 
+from common import idstream, metrics, logs
+
 # App Config
 with open("config/check.prod.yaml", "r", encoding="utf-8") as f:
     app_config = yaml.safe_load(f.read())
@@ -22,11 +28,49 @@ with open("config/check.prod.yaml", "r", encoding="utf-8") as f:
 # Logging
 with open("logger/log.prod.yaml", "r", encoding="utf-8") as f:
     log_config = yaml.safe_load(f.read())
-    logging.config.dictConfig(log_config)
+    logs.configure(log_config, app_config.get("logging"))
 
 logger = logging.getLogger("basicLogger")
 
 
+# Columns of the compact rows kept in the check history
+HISTORY_FIELDS = [
+    "last_updated",
+    "mode",
+    "processing_time_ms",
+    "complete",
+    "missing_in_db",
+    "missing_in_queue",
+    "db_attractions",
+    "db_expenses",
+    "queue_attractions",
+    "queue_expenses",
+    "processing_attractions",
+    "processing_expenses",
+]
+
+check_lock = Lock()
+
+
+def load_history():
+    """Loads the watermark and the bounded check history from the history
+    file, starting from UNIX time 0 if it does not exist."""
+    try:
+        with open(
+            app_config["history"]["filepath"], "r", encoding="utf-8"
+        ) as read_content:
+            state = json.load(read_content)
+    except FileNotFoundError:
+        state = {"watermark": "1970-01-01T00:00:00.000000Z", "rows": []}
+
+    state["rows"] = deque(state["rows"], maxlen=app_config["history"]["size"])
+
+    return state
+
+
+history = load_history()
+
+
 def compare_ids(analyzer_data, storage_data):
     """Compares the input ID lists from storage and analyzer
     by trace_id and outputs the differences.
@@ -68,91 +112,492 @@ def compare_ids(analyzer_data, storage_data):
     return missing_in_db, missing_in_queue
 
 
-def run_consistency_checks():
-    """Gathers the counts and ID statistics from storage,
-    processing, and analyzer microservices and writes
-    the information in a dictionary to a JSON file.
+async def fetch_json(client, sources, name, params=None):
+    """Gets JSON from an event store, recording the latency and payload size
+    of the call under the event store name.
 
     Returns:
-    A JSON with the gathered statistics
+    The decoded JSON, or None if the call failed or timed out.
     """
-    # log info started processing
-    logger.info("Consistency checks started.")
-    start_time = time.time()
+    stats = sources.setdefault(
+        name, {"calls": 0, "errors": 0, "latency_ms": 0, "bytes": 0}
+    )
+    start_time = time.perf_counter()
 
-    # get storage counts
-    storage_counts = httpx.get(
-        app_config["eventstores"]["storage_counts"]["url"]
-    ).json()
+    try:
+        response = await client.get(
+            app_config["eventstores"][name]["url"], params=params
+        )
+        response.raise_for_status()
+        data = response.json()
+        stats["bytes"] += len(response.content)
+    except (httpx.HTTPError, ValueError) as e:
+        logger.error("Request to %s failed: %r", name, e)
+        stats["errors"] += 1
+        data = None
+
+    stats["calls"] += 1
+    stats["latency_ms"] += round((time.perf_counter() - start_time) * 1000)
+
+    return data
+
+
+async def stream_records(client, sources, name):
+    """Streams the binary id records of an event store, recording the
+    latency and compressed size of the call under the event store name.
+    Errors are recorded and raised to the caller.
+
+    Yields:
+    Each record, in the order sent by the event store.
+    """
+    stats = sources.setdefault(
+        name, {"calls": 0, "errors": 0, "latency_ms": 0, "bytes": 0}
+    )
+    start_time = time.perf_counter()
+    stats["calls"] += 1
 
-    # get storage ids
-    storage_attr_ids = httpx.get(
-        app_config["eventstores"]["storage_attr_ids"]["url"]
-    ).json()
-    storage_exp_ids = httpx.get(
-        app_config["eventstores"]["storage_exp_ids"]["url"]
-    ).json()
+    try:
+        async with client.stream(
+            "GET", app_config["eventstores"][name]["url"]
+        ) as response:
+            response.raise_for_status()
+            buffer = b""
+            async for chunk in response.aiter_bytes():
+                buffer += chunk
+                end = len(buffer) - len(buffer) % idstream.RECORD_SIZE
+                for start in range(0, end, idstream.RECORD_SIZE):
+                    yield buffer[start : start + idstream.RECORD_SIZE]
+                buffer = buffer[end:]
+            stats["bytes"] += response.num_bytes_downloaded
+
+        if buffer:
+            raise httpx.DecodingError(f"Truncated id record from {name}")
+    except httpx.HTTPError as e:
+        logger.error("Request to %s failed: %r", name, e)
+        stats["errors"] += 1
+        raise
+    finally:
+        stats["latency_ms"] += round((time.perf_counter() - start_time) * 1000)
+
+
+async def compare_streams(stream):
+    """Compares the trace ids of storage and analyzer with a merge-join of
+    their sorted id streams. Only the current record of each stream is held,
+    so memory use does not grow with the number of events.
 
-    # get analyzer counts
-    analyzer_counts = httpx.get(
-        app_config["eventstores"]["analyzer_counts"]["url"]
-    ).json()
+    Returns:
+    The missing_in_db and missing_in_queue lists, or None for both if an
+    event store could not be reached.
+    """
+    analyzer = stream("analyzer_stream")
+    storage = stream("storage_stream")
+    missing_in_db = []
+    missing_in_queue = []
 
-    # get analyzer ids
-    analyzer_ids = httpx.get(app_config["eventstores"]["analyzer_ids"]["url"]).json()
+    try:
+        analyzer_record = await anext(analyzer, None)
+        storage_record = await anext(storage, None)
+
+        while analyzer_record is not None or storage_record is not None:
+            if storage_record is None or (
+                analyzer_record is not None
+                and analyzer_record[:16] < storage_record[:16]
+            ):
+                missing_in_db.append(idstream.decode_record(analyzer_record))
+                analyzer_record = await anext(analyzer, None)
+            elif analyzer_record is None or storage_record[:16] < analyzer_record[:16]:
+                missing_in_queue.append(idstream.decode_record(storage_record))
+                storage_record = await anext(storage, None)
+            else:
+                # Skip every copy of a matching trace id on both sides
+                trace_id = analyzer_record[:16]
+                while analyzer_record is not None and analyzer_record[:16] == trace_id:
+                    analyzer_record = await anext(analyzer, None)
+                while storage_record is not None and storage_record[:16] == trace_id:
+                    storage_record = await anext(storage, None)
+    except httpx.HTTPError:
+        return None, None
+    finally:
+        await analyzer.aclose()
+        await storage.aclose()
 
-    # get processing stats
-    proc_stats = httpx.get(app_config["eventstores"]["proc_stats"]["url"]).json()
+    return missing_in_db, missing_in_queue
+
+
+async def compare_all_ids(fetch):
+    """Compares the trace ids of storage and analyzer by downloading all of
+    them.
+
+    Returns:
+    The missing_in_db and missing_in_queue lists, or None for both if an
+    event store could not be reached.
+    """
+    # get storage and analyzer ids
+    storage_attr_ids, storage_exp_ids, analyzer_ids = await asyncio.gather(
+        fetch("storage_attr_ids"), fetch("storage_exp_ids"), fetch("analyzer_ids")
+    )
+    if None in (storage_attr_ids, storage_exp_ids, analyzer_ids):
+        return None, None
 
     # Combine the id entries from storage
     all_storage_ids = storage_attr_ids + storage_exp_ids
 
     # Compare trace_ids
-    missing_in_db, missing_in_queue = compare_ids(analyzer_ids, all_storage_ids)
+    return compare_ids(analyzer_ids, all_storage_ids)
+
+
+async def compare_digests(fetch):
+    """Compares the trace ids of storage and analyzer by walking down their
+    Merkle trees a level at a time, only descending into buckets whose
+    digests differ. IDs are only downloaded for differing leaf buckets, or
+    for whole subtrees that one side is missing. Every analyzer call after
+    the root digest passes the generation of its id index, so the walk
+    compares one snapshot of the queue even while events are produced.
+
+    Returns:
+    The missing_in_db and missing_in_queue lists, or None for both if an
+    event store could not be reached.
+    """
+    leaf_depth = app_config["check"]["leaf_depth"]
+    missing_in_db = []
+    missing_in_queue = []
+    generation = None
+
+    def params(source, prefix):
+        if source == "analyzer" and generation is not None:
+            return {"prefix": prefix, "generation": generation}
+        return {"prefix": prefix}
+
+    prefixes = [""]
+    while prefixes:
+        digests = await asyncio.gather(
+            *(
+                fetch(f"{source}_digest", params(source, prefix))
+                for prefix in prefixes
+                for source in ("analyzer", "storage")
+            )
+        )
+        if None in digests:
+            return None, None
+        if generation is None:
+            generation = digests[0].get("generation")
+
+        next_prefixes = []
+        bucket_fetches = []
+        for i, prefix in enumerate(prefixes):
+            analyzer_digests = digests[2 * i]["buckets"]
+            storage_digests = digests[2 * i + 1]["buckets"]
+
+            for char in sorted(analyzer_digests.keys() | storage_digests.keys()):
+                analyzer_digest = analyzer_digests.get(char)
+                storage_digest = storage_digests.get(char)
+                if analyzer_digest == storage_digest:
+                    continue
+
+                child = prefix + char
+                if analyzer_digest is None or storage_digest is None or (
+                    len(child) >= leaf_depth
+                ):
+                    bucket_fetches.append(child)
+                else:
+                    next_prefixes.append(child)
+
+        buckets = await asyncio.gather(
+            *(
+                fetch(f"{source}_bucket", params(source, prefix))
+                for prefix in bucket_fetches
+                for source in ("analyzer", "storage")
+            )
+        )
+        if None in buckets:
+            return None, None
+
+        for i in range(len(bucket_fetches)):
+            bucket_missing_in_db, bucket_missing_in_queue = compare_ids(
+                buckets[2 * i], buckets[2 * i + 1]
+            )
+            missing_in_db.extend(bucket_missing_in_db)
+            missing_in_queue.extend(bucket_missing_in_queue)
+
+        prefixes = next_prefixes
+
+    return missing_in_db, missing_in_queue
+
+
+async def compare_since(fetch, since, until, slack):
+    """Compares only the ids of events received in the settled window
+    between the last clean check and `until`.
+
+    Both services give their times in UTC, and an event is always stored
+    after it is received and within `slack` of it. Events received in the
+    window are looked for among those stored since its start, and events
+    stored in the window among those received up to `slack` before it.
+    Events received after `until` are still on their way to the database,
+    so they are only checked by the next run.
+
+    Parameters:
+    since (datetime): watermark of the last clean check, in UTC
+    until (datetime): end of the settled window, in UTC
+    slack (timedelta): maximum time from receiving to storing an event
+
+    Returns:
+    The missing_in_db and missing_in_queue lists, or None for both if an
+    event store could not be reached.
+    """
+    storage_attr_ids, storage_exp_ids, analyzer_ids = await asyncio.gather(
+        fetch("storage_attr_ids", {"since": format_time(since)}),
+        fetch("storage_exp_ids", {"since": format_time(since)}),
+        fetch(
+            "analyzer_ids",
+            {"since": format_time(since - slack), "until": format_time(until)},
+        ),
+    )
+    if None in (storage_attr_ids, storage_exp_ids, analyzer_ids):
+        return None, None
+
+    # Both times are naive UTC ISO 8601 timestamps, so they compare as text
+    since_str = since.isoformat(timespec="microseconds")
+    until_str = until.isoformat(timespec="microseconds")
+    all_storage_ids = storage_attr_ids + storage_exp_ids
+    received_ids = [entry for entry in analyzer_ids if entry["datetime"] >= since_str]
+    stored_ids = [entry for entry in all_storage_ids if entry["date_created"] < until_str]
+
+    missing_in_db, _ = compare_ids(received_ids, all_storage_ids)
+    _, missing_in_queue = compare_ids(analyzer_ids, stored_ids)
+
+    return missing_in_db, missing_in_queue
+
+
+def format_time(value):
+    """Formats a naive UTC datetime as an ISO 8601 timestamp."""
+    return value.isoformat(timespec="microseconds") + "Z"
+
+
+def get_count(stats, key):
+    """Gets a count from an event store response, or None if it failed."""
+    return None if stats is None else stats[key]
+
+
+async def gather_checks(compare):
+    """Fetches the counts from storage, analyzer and processing and compares
+    the ids concurrently, using one pooled client with per-call timeouts.
+
+    Parameters:
+    compare (function): takes the fetch and stream functions and returns
+    the coroutine comparing the ids
+
+    Returns:
+    A dictionary with the check results. Counts and id lists are None
+    for event stores that could not be reached.
+    """
+    sources = {}
+    timeout = app_config.get("check", {}).get("timeout", 10)
+
+    async with httpx.AsyncClient(
+        timeout=timeout, limits=httpx.Limits(max_connections=20)
+    ) as client:
+
+        def fetch(name, params=None):
+            return fetch_json(client, sources, name, params)
+
+        def stream(name):
+            return stream_records(client, sources, name)
+
+        storage_counts, analyzer_counts, proc_stats, missing = await asyncio.gather(
+            fetch("storage_counts"),
+            fetch("analyzer_counts"),
+            fetch("proc_stats"),
+            compare(fetch, stream),
+        )
+
+    missing_in_db, missing_in_queue = missing
 
     # Construct JSON
-    check_stats = {
+    return {
         "last_updated": dt.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        "complete": not any(stats["errors"] for stats in sources.values()),
         "counts": {
             # storage
             "db": {
-                "attractions": storage_counts["num_attr"],
-                "expenses": storage_counts["num_exp"],
+                "attractions": get_count(storage_counts, "num_attr"),
+                "expenses": get_count(storage_counts, "num_exp"),
             },
             # analyzer
             "queue": {
-                "attractions": analyzer_counts["num_attr"],
-                "expenses": analyzer_counts["num_exp"],
+                "attractions": get_count(analyzer_counts, "num_attr"),
+                "expenses": get_count(analyzer_counts, "num_exp"),
             },
             # processing
             "processing": {
-                "attractions": proc_stats["num_attr"],
-                "expenses": proc_stats["num_exp"],
+                "attractions": get_count(proc_stats, "num_attr"),
+                "expenses": get_count(proc_stats, "num_exp"),
             },
         },
-        "missing_in_db": missing_in_db,
-        "missing_in_queue": missing_in_queue,
+        "missing_in_db": missing_in_db if missing_in_db is not None else [],
+        "missing_in_queue": missing_in_queue if missing_in_queue is not None else [],
+        "sources": sources,
     }
 
-    # write to file
-    with open(app_config["datastore"]["filepath"], "w", encoding="utf-8") as w:
-        json.dump(check_stats, w, indent=4)
 
-    end_time = time.time()
+@metrics.SCAN_DURATION.time(scan="consistency_check")
+def run_consistency_checks():
+    """Gathers the counts and ID statistics from storage,
+    processing, and analyzer microservices and writes
+    the information in a dictionary to a JSON file.
+
+    Returns:
+    A JSON with the gathered statistics
+    """
+    # log info started processing
+    logger.info("Consistency checks started.")
+    start_time = time.time()
+
+    mode = app_config.get("check", {}).get("mode", "full")
+    if mode == "merkle":
+        # Compare trace_ids by digest, only fetching ids of differing buckets
+        def compare(fetch, stream):
+            return compare_digests(fetch)
+    elif mode == "stream":
+        # Merge-join the sorted binary id streams
+        def compare(fetch, stream):
+            return compare_streams(stream)
+    else:
+        def compare(fetch, stream):
+            return compare_all_ids(fetch)
 
-    # calculate processing time
-    elapsed_time = round((end_time - start_time) * 1000)
+    with check_lock:
+        checked_at = dt.now(timezone.utc).replace(tzinfo=None)
+        check_stats = asyncio.run(gather_checks(compare))
+
+        # write to file
+        with open(app_config["datastore"]["filepath"], "w", encoding="utf-8") as w:
+            json.dump(check_stats, w, indent=4)
+
+        end_time = time.time()
+
+        # calculate processing time
+        elapsed_time = round((end_time - start_time) * 1000)
+
+        # A clean full check covers everything settled before it started
+        slack = timedelta(seconds=app_config["scheduler"]["slack"])
+        record_check(check_stats, mode, elapsed_time, checked_at - slack)
+
+    missing_in_db = check_stats["missing_in_db"]
+    missing_in_queue = check_stats["missing_in_queue"]
 
     # log processing time and missing stats
     logger.info(
         f"Consistency checks completed | processing_time_ms={elapsed_time}"
         f" | missing_in_db = {len(missing_in_db)} | missing_in_queue = {len(missing_in_queue)}"
+        f" | complete = {check_stats['complete']}"
     )
 
     # return JSON
     return check_stats, 200
 
 
+@metrics.SCAN_DURATION.time(scan="scheduled_check")
+def run_scheduled_check():
+    """Runs an incremental consistency check over the events added since the
+    last clean check, and moves the watermark forward if it is clean."""
+    logger.info("Scheduled consistency check started.")
+    start_time = time.time()
+
+    with check_lock:
+        slack = timedelta(seconds=app_config["scheduler"]["slack"])
+        since = dt.fromisoformat(history["watermark"].rstrip("Z"))
+        until = dt.now(timezone.utc).replace(tzinfo=None) - slack
+
+        check_stats = asyncio.run(
+            gather_checks(
+                lambda fetch, stream: compare_since(fetch, since, until, slack)
+            )
+        )
+        check_stats["window"] = {
+            "since": format_time(since),
+            "until": format_time(until),
+        }
+
+        with open(app_config["datastore"]["filepath"], "w", encoding="utf-8") as w:
+            json.dump(check_stats, w, indent=4)
+
+        elapsed_time = round((time.time() - start_time) * 1000)
+        record_check(check_stats, "incremental", elapsed_time, until)
+
+    logger.info(
+        f"Scheduled consistency check completed | processing_time_ms={elapsed_time}"
+        f" | missing_in_db = {len(check_stats['missing_in_db'])}"
+        f" | missing_in_queue = {len(check_stats['missing_in_queue'])}"
+        f" | watermark = {history['watermark']}"
+    )
+
+
+def record_check(check_stats, mode, elapsed_time, clean_until):
+    """Adds a check result to the history as a compact row, and moves the
+    watermark to clean_until if the check was complete and found nothing
+    missing."""
+    counts = check_stats["counts"]
+    history["rows"].append(
+        [
+            check_stats["last_updated"],
+            mode,
+            elapsed_time,
+            check_stats["complete"],
+            len(check_stats["missing_in_db"]),
+            len(check_stats["missing_in_queue"]),
+            counts["db"]["attractions"],
+            counts["db"]["expenses"],
+            counts["queue"]["attractions"],
+            counts["queue"]["expenses"],
+            counts["processing"]["attractions"],
+            counts["processing"]["expenses"],
+        ]
+    )
+
+    clean = (
+        check_stats["complete"]
+        and not check_stats["missing_in_db"]
+        and not check_stats["missing_in_queue"]
+    )
+    if clean and format_time(clean_until) > history["watermark"]:
+        history["watermark"] = format_time(clean_until)
+
+    with open(app_config["history"]["filepath"], "w", encoding="utf-8") as w:
+        json.dump(
+            {"watermark": history["watermark"], "rows": list(history["rows"])},
+            w,
+            separators=(",", ":"),
+        )
+
+
+def get_history(limit=100):
+    """Gets the most recent consistency check results, newest first.
+
+    Returns:
+    The watermark and a list of check summaries.
+    """
+    with check_lock:
+        rows = list(history["rows"])[-limit:]
+        watermark = history["watermark"]
+
+    return {
+        "watermark": watermark,
+        "checks": [dict(zip(HISTORY_FIELDS, row)) for row in reversed(rows)],
+    }, 200
+
+
+def init_scheduler():
+    """Runs the incremental consistency check every X seconds."""
+    sched = BackgroundScheduler(daemon=True)
+    sched.add_job(
+        run_scheduled_check,
+        "interval",
+        seconds=app_config["scheduler"]["interval"],
+        max_instances=1,
+    )
+    sched.start()
+
+
 def get_checks():
     """Reads the consistency check JSON file and
     returns the JSON.
@@ -183,6 +628,7 @@ def get_checks():
 
 app = connexion.FlaskApp(__name__, specification_dir="")
 app.add_api("consistency_check.yaml", base_path="/consistency_check", strict_validation=True, validate_responses=True)
+app.add_middleware(metrics.MetricsMiddleware, position=MiddlewarePosition.BEFORE_EXCEPTION)
 
 if "CORS_ALLOW_ALL" in os.environ and os.environ["CORS_ALLOW_ALL"] == "yes":
     app.add_middleware(
@@ -196,4 +642,5 @@ if "CORS_ALLOW_ALL" in os.environ and os.environ["CORS_ALLOW_ALL"] == "yes":
 
 
 if __name__ == "__main__":
+    init_scheduler()
     app.run(port=8300, host="0.0.0.0")
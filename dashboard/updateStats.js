@@ -1,52 +1,7 @@
-const ANALYZER_EP = "analyzer"
-
-const PROCESSING_STATS_API_URL = "/processing/stats";
-const ANALYZER_API_URL = {
-    stats: `/${ANALYZER_EP}/stats`,
-    attr_info: `/${ANALYZER_EP}/attr_info`,
-    exp_info: `/${ANALYZER_EP}/exp_info`
-}
+const SNAPSHOT_EVENTS_URL = "/aggregator/events";
 const CHECK_API_URL = "/consistency_check/update";
 
-const getRandomInt = (max) => {
-  return Math.floor(Math.random() * max);
-};
-
 // Requests
-const makeReq = (url, cb) => {
-  fetch(url)
-    .then((res) => res.json())
-    .then((result) => {
-      console.log("Received data: ", result);
-      cb(result);
-    })
-    .catch((error) => {
-      updateErrorMessages(error.message);
-    });
-};
-
-const makeParamReq = (url, stats, cb) => {
-  if (url === ANALYZER_API_URL.attr_info) {
-    max = stats["num_attr"];
-  } else {
-    max = stats["num_exp"];
-  }
-
-  if (max === 0) {
-    cb(0);
-  } else {
-    fetch(`${url}?index=${getRandomInt(max_sp)}`)
-      .then((res) => res.json())
-      .then((result) => {
-        console.log("Received data: ", result);
-        cb(result);
-      })
-      .catch((error) => {
-        updateErrorMessages(error.message);
-      });
-  }
-};
-
 const makePostReq = (url, cb) => {
   fetch(url, { method: "post" })
     .then((res) => res.json())
@@ -146,21 +101,25 @@ const updateCheck = (result) => {
 // Statistics Gathering
 const getLocaleDateStr = () => new Date().toLocaleString();
 
-const getStats = () => {
-  document.getElementById("last-updated-value").innerText = getLocaleDateStr();
+const updateSnapshot = (snapshot) => {
+  console.log("Received snapshot: ", snapshot);
+  document.getElementById("last-updated-value").innerText = new Date(
+    snapshot["updated"]
+  ).toLocaleString();
 
-  makeReq(PROCESSING_STATS_API_URL, (result) => updateProc(result));
-  makeReq(ANALYZER_API_URL.stats, (result) => updateAnSt(result));
-  makeReq(ANALYZER_API_URL.stats, (stats) =>
-    makeParamReq(ANALYZER_API_URL.attr_info, stats, (result) =>
-      updateAttr(result)
-    )
-  );
-  makeReq(ANALYZER_API_URL.stats, (stats) =>
-    makeParamReq(ANALYZER_API_URL.exp_info, stats, (result) =>
-      updateExp(result)
-    )
-  );
+  if (snapshot["processing"]) {
+    updateProc(snapshot["processing"]);
+  }
+  if (snapshot["analyzer"]) {
+    updateAnSt(snapshot["analyzer"]);
+  }
+  updateAttr(snapshot["attraction"] || 0);
+  updateExp(snapshot["expense"] || 0);
+  if (snapshot["checks"]) {
+    updateCheck(snapshot["checks"]);
+  }
+
+  snapshot["errors"].forEach((message) => updateErrorMessages(message));
 };
 
 const updateErrorMessages = (message) => {
@@ -182,13 +141,20 @@ const updateErrorMessages = (message) => {
 const button = document.querySelector("#post-btn");
 button.addEventListener(
   "click",
-  () => makePostReq(CHECK_API_URL, (result) => updateCheck(result)),
+  // The new check results arrive with the next snapshot
+  () => makePostReq(CHECK_API_URL, () => {}),
   { capture: true }
 );
 
 const setup = () => {
-  getStats();
-  setInterval(() => getStats(), 4000); // Update every 4 seconds
+  // The aggregator pushes a snapshot on connect and after every refresh,
+  // and the browser reconnects on its own if the stream drops
+  const events = new EventSource(SNAPSHOT_EVENTS_URL);
+  events.addEventListener("snapshot", (event) =>
+    updateSnapshot(JSON.parse(event.data))
+  );
+  events.onerror = () =>
+    updateErrorMessages("Lost the connection to the aggregator, reconnecting.");
 };
 
 document.addEventListener("DOMContentLoaded", setup);
\ No newline at end of file
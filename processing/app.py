@@ -3,13 +3,14 @@ Processing microservice to gather statistics about the
 attraction and expense events, such as the number of each
 and averages. Runs periodically, making a query to the
 storage service to get new event entries, then re-calculating
-and updating the statistics and saving them to a JSON file.
+and updating the statistics and saving them to the state shared by
+the replicas (see state.py).
 """
 
 import os
+import socket
 from datetime import datetime as dt, timezone
-import json
-import logging.config
+import logging
 
 import connexion
 from connexion import NoContent
@@ -20,6 +21,9 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from connexion.middleware import MiddlewarePosition
 from starlette.middleware.cors import CORSMiddleware
 
+import state
+from common import metrics, logs
+
 # Variable Loading
 with open("config/processing.prod.yaml", "r", encoding="utf-8") as f:
     app_config = yaml.safe_load(f.read())
@@ -28,11 +32,23 @@ with open("config/processing.prod.yaml", "r", encoding="utf-8") as f:
 # Logging
 with open("logger/log.prod.yaml", "r", encoding="utf-8") as f:
     log_config = yaml.safe_load(f.read())
-    logging.config.dictConfig(log_config)
+    logs.configure(log_config, app_config.get("logging"))
 
 
 logger = logging.getLogger("basicLogger")
 
+# Stats snapshot shared by the replicas, computed by the lease holder
+shared_state = state.from_config(app_config)
+OWNER = f"{socket.gethostname()}-{os.getpid()}"
+LEASE_SECONDS = app_config.get("state", {}).get(
+    "lease_seconds", 3 * app_config["scheduler"]["interval"]
+)
+
+LEADER = metrics.Gauge(
+    "processing_leader",
+    "Whether this replica holds the processing lease.",
+)
+
 
 def calc_stats(past_values, attr, exp):
     """Calculates the stats for the
@@ -153,6 +169,7 @@ def calc_stats(past_values, attr, exp):
     return updated_stats
 
 
+@metrics.SCAN_DURATION.time(scan="populate_stats")
 def populate_stats():
     """
     Loads from stats file, if not found, uses UNIX time 0 as start
@@ -162,17 +179,16 @@ def populate_stats():
     Returns: None
     """
 
+    if not shared_state.acquire(OWNER, LEASE_SECONDS):
+        LEADER.set(0)
+        logger.debug("Another replica holds the processing lease.")
+        return NoContent, 200
+    LEADER.set(1)
+
     logger.info("Periodic processing has started.")
 
-    # Read file
-    try:
-        with open(
-            app_config["datastore"]["filepath"], "r", encoding="utf-8"
-        ) as read_content:
-            stat_file = json.load(read_content)
-            start_time = stat_file["last_updated"]
-    except FileNotFoundError:
-        start_time = "1970-01-01T00:00:00Z"
+    stat_file = shared_state.read()
+    if stat_file is None:
         stat_file = {
             "num_attr": 0,
             "avg_hours_open": 0,
@@ -180,8 +196,7 @@ def populate_stats():
             "avg_amount": 0,
             "last_updated": "1970-01-01T00:00:00Z",
         }
-    except IOError:
-        logger.error("An error occurred while reading the stats file.")
+    start_time = stat_file["last_updated"]
 
     end_time = dt.now(timezone.utc).isoformat().replace("+00:00", "Z")
 
@@ -223,8 +238,10 @@ def populate_stats():
     else:
         updated_stats = calc_stats(stat_file, attr_res, exp_res)
 
-    with open(app_config["datastore"]["filepath"], "w", encoding="utf-8") as w:
-        json.dump(updated_stats, w, indent=4)
+    if not shared_state.write(updated_stats, OWNER):
+        LEADER.set(0)
+        logger.warning("Lost the processing lease, the stats were not saved.")
+        return NoContent, 200
 
     update_string = (
         f"num_attr:{updated_stats['num_attr']}, "
@@ -240,26 +257,20 @@ def populate_stats():
 
 
 def get_stats():
-    """Reads the processing JSON file and
+    """Reads the shared stats snapshot and
     returns the JSON.
 
     Returns:
-    The JSON from the processing JSON file
+    The JSON of the stats snapshot
     with the counts and averages for the
     two events.
     """
     logger.info("A request was received.")
 
-    try:
-        with open(
-            app_config["datastore"]["filepath"], "r", encoding="utf-8"
-        ) as read_content:
-            stat_file = json.load(read_content)
-    except FileNotFoundError:
-        logger.error("The stats file does not exist.")
+    stat_file = shared_state.read()
+    if stat_file is None:
+        logger.error("The stats do not exist.")
         return "Statistics do not exist.", 404
-    except IOError:
-        logger.error("An error occurred while reading the stats file.")
 
     logger.debug(stat_file)
     logger.info("Request was completed.")
@@ -278,6 +289,7 @@ def init_scheduler():
 
 app = connexion.FlaskApp(__name__, specification_dir="")
 app.add_api("processing.yaml", base_path="/processing", strict_validation=True, validate_responses=True)
+app.add_middleware(metrics.MetricsMiddleware, position=MiddlewarePosition.BEFORE_EXCEPTION)
 if "CORS_ALLOW_ALL" in os.environ and os.environ["CORS_ALLOW_ALL"] == "yes":
     app.add_middleware(
         CORSMiddleware,
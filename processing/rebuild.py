@@ -0,0 +1,222 @@
+"""
+Rebuild command for processing. Recomputes the stats snapshot from the
+whole event history in storage, e.g. after losing the snapshot or when it
+has drifted from the stored events.
+
+The history from the first to the last stored event is split into equal
+time shards, and a process pool streams each shard of both tables from the
+storage export endpoint, reducing it to a partial aggregate of counts, sums
+and the last date_created. Rows are read one export chunk at a time, so no
+process holds more than a chunk of the history. The partials are merged in
+shard order with exactly rounded sums, so the snapshot does not depend on
+which worker finished first.
+
+The snapshot is written under the processing lease. Stop the processing
+replicas before rebuilding, or the leader keeps renewing the lease. Once
+restarted, the leader resumes from the last event of the rebuild.
+
+Usage: python3 rebuild.py [--workers N] [--shards S]
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import socket
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime as dt, timedelta
+
+import httpx
+import yaml
+
+import state
+
+# App Config
+with open("config/processing.prod.yaml", "r", encoding="utf-8") as f:
+    app_config = yaml.safe_load(f.read())
+
+OWNER = f"rebuild-{socket.gethostname()}-{os.getpid()}"
+LEASE_SECONDS = app_config.get("state", {}).get(
+    "lease_seconds", 3 * app_config["scheduler"]["interval"]
+)
+
+# Averaged column of each table, and the count and average keys of the stats
+TABLES = {
+    "attraction_info": ("hours_open", "num_attr", "avg_hours_open"),
+    "expense_info": ("amount", "num_exp", "avg_amount"),
+}
+
+# Resolution of date_created, DATETIME(6)
+RESOLUTION = timedelta(microseconds=1)
+
+
+def split_shards(start, end, shards):
+    """Splits the range from start to end, inclusive, into contiguous
+    shards of equal duration.
+
+    Returns:
+    A list of (start, end) tuples, each end excluded from its shard.
+    """
+    total = (end - start) // RESOLUTION + 1
+    bounds = [start + RESOLUTION * (total * i // shards) for i in range(shards + 1)]
+    return [
+        (bounds[i], bounds[i + 1]) for i in range(shards) if bounds[i] < bounds[i + 1]
+    ]
+
+
+def aggregate_shard(index, start, end):
+    """Reduces the events of both tables created in one shard to a partial
+    aggregate.
+
+    Parameters:
+    index (int): position of the shard in the history
+    start (datetime): first date_created of the shard
+    end (datetime): date_created the shard ends before
+
+    Returns:
+    A tuple with the shard index and a dict of the count, the sum of the
+    averaged column and the last date_created of each table.
+    """
+    partial = {}
+    for table, (column, _, _) in TABLES.items():
+        count = 0
+        sums = []
+        last = None
+
+        params = {
+            "table": table,
+            "format": "columnar",
+            "start_timestamp": start.isoformat(),
+            "end_timestamp": end.isoformat(),
+        }
+        with httpx.stream(
+            "GET", app_config["eventstores"]["export"]["url"], params=params, timeout=None
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                count += chunk["rows"]
+                sums.append(math.fsum(chunk["columns"][column]))
+                chunk_last = max(map(dt.fromisoformat, chunk["columns"]["date_created"]))
+                if last is None or chunk_last > last:
+                    last = chunk_last
+
+        partial[table] = {"count": count, "sum": math.fsum(sums), "last": last}
+
+    return index, partial
+
+
+def merge_partials(partials):
+    """Merges the partial aggregates of the shards, in shard order, into a
+    stats snapshot in the format of calc_stats."""
+    stats = {}
+    lasts = []
+    for table, (_, count_key, average_key) in TABLES.items():
+        count = sum(partial[table]["count"] for partial in partials)
+        total = math.fsum(partial[table]["sum"] for partial in partials)
+        lasts.extend(
+            partial[table]["last"] for partial in partials if partial[table]["last"]
+        )
+        stats[count_key] = count
+        stats[average_key] = round(total / count, 2) if count else 0
+
+    if lasts:
+        last_updated = max(lasts).isoformat("T", "microseconds").replace("+00:00", "Z")
+    else:
+        last_updated = "1970-01-01T00:00:00Z"
+    stats["last_updated"] = last_updated
+
+    return stats
+
+
+def get_date_range():
+    """Gets the first and last date_created of the stored events, or None
+    if there are none."""
+    response = httpx.get(app_config["eventstores"]["date_range"]["url"])
+    response.raise_for_status()
+    if response.status_code == 204:
+        return None
+
+    date_range = response.json()
+    return dt.fromisoformat(date_range["start"]), dt.fromisoformat(date_range["end"])
+
+
+def acquire_lease(shared_state, wait):
+    """Takes the processing lease, waiting up to wait seconds for the
+    current holder's lease to expire."""
+    deadline = time.time() + wait
+    while not shared_state.acquire(OWNER, LEASE_SECONDS):
+        if time.time() >= deadline:
+            return False
+        time.sleep(1)
+
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuilds the processing stats.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--shards", type=int, help="time shards, 4 per worker by default")
+    args = parser.parse_args()
+    shards = args.shards or 4 * args.workers
+
+    shared_state = state.from_config(app_config)
+    if not acquire_lease(shared_state, 2 * LEASE_SECONDS):
+        sys.exit("The processing lease is held, stop the processing replicas first.")
+
+    start_time = time.time()
+    date_range = get_date_range()
+    tasks = split_shards(*date_range, shards) if date_range else []
+    print(f"Rebuilding from {len(tasks)} shards with {args.workers} workers.")
+
+    partials = [None] * len(tasks)
+    total_events = 0
+
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as pool:
+        futures = [
+            pool.submit(aggregate_shard, index, start, end)
+            for index, (start, end) in enumerate(tasks)
+        ]
+
+        for done, future in enumerate(as_completed(futures), 1):
+            index, partial = future.result()
+            partials[index] = partial
+            events = sum(table["count"] for table in partial.values())
+            total_events += events
+
+            elapsed = time.time() - start_time
+            print(
+                f"[{done}/{len(tasks)}] {tasks[index][0].isoformat()}"
+                f" to {tasks[index][1].isoformat()}"
+                f" | events = {events}"
+                f" | {total_events / max(elapsed, 1e-9):,.0f} events/s"
+            )
+
+    stats = merge_partials(partials)
+
+    # The lease may have expired during a long rebuild
+    if not acquire_lease(shared_state, 2 * LEASE_SECONDS) or not shared_state.write(
+        stats, OWNER
+    ):
+        sys.exit("Lost the processing lease, the stats were not saved.")
+    shared_state.release(OWNER)
+
+    elapsed = time.time() - start_time
+    print(
+        f"Rebuild completed | processing_time_ms={round(elapsed * 1000)}"
+        f" | events = {total_events}"
+        f" | {total_events / max(elapsed, 1e-9):,.0f} events/s"
+    )
+    print(json.dumps(stats, indent=4))
+
+
+if __name__ == "__main__":
+    main()
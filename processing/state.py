@@ -0,0 +1,238 @@
+"""
+Shared state of the processing replicas: the stats snapshot and the lease
+of the replica that computes it.
+
+Every replica serves /processing/stats from the shared snapshot, but only
+the replica holding the lease runs populate_stats. The leader renews the
+lease every interval, and another replica takes over once it has not been
+renewed for lease_seconds. Writes of the snapshot are fenced by the lease,
+so a replica that lost it cannot overwrite the new leader's stats.
+
+Backends:
+  file  the snapshot and lease in JSON files on a volume shared by the
+        replicas, guarded by an advisory flock
+  db    a processing_state table in a SQL database
+"""
+
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import (
+    DOUBLE,
+    Column,
+    Double,
+    MetaData,
+    String,
+    Table,
+    Text,
+    create_engine,
+    insert,
+    inspect,
+    or_,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.exc import IntegrityError
+
+
+class FileState:
+    """Snapshot and lease in files next to each other.
+
+    Parameters:
+    filepath (str): path of the stats JSON file
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.lease_path = f"{filepath}.lease"
+        self.lock_path = f"{filepath}.lock"
+
+    @contextmanager
+    def locked(self):
+        """Holds the advisory lock shared by the replicas."""
+        with open(self.lock_path, "a", encoding="utf-8") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def read_lease(self):
+        """Gets the current lease, expired if there is none."""
+        try:
+            with open(self.lease_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {"owner": None, "expires": 0}
+
+    def replace(self, path, data):
+        """Writes a JSON file through a temporary file, so readers never see
+        it half written."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, path)
+
+    def acquire(self, owner, lease_seconds):
+        """Takes or renews the lease.
+
+        Returns:
+        True if the owner holds the lease.
+        """
+        with self.locked():
+            lease = self.read_lease()
+            now = time.time()
+            if lease["owner"] not in (owner, None) and lease["expires"] > now:
+                return False
+            self.replace(self.lease_path, {"owner": owner, "expires": now + lease_seconds})
+            return True
+
+    def release(self, owner):
+        """Gives up the lease if the owner holds it, so a replica can take
+        it over without waiting for it to expire."""
+        with self.locked():
+            if self.read_lease()["owner"] == owner:
+                self.replace(self.lease_path, {"owner": None, "expires": 0})
+
+    def read(self):
+        """Gets the stats snapshot, or None if there is none yet."""
+        try:
+            with open(self.filepath, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def write(self, stats, owner):
+        """Saves the stats snapshot if the owner still holds the lease.
+
+        Returns:
+        True if the snapshot was saved.
+        """
+        with self.locked():
+            lease = self.read_lease()
+            if lease["owner"] != owner or lease["expires"] <= time.time():
+                return False
+            self.replace(self.filepath, stats)
+            return True
+
+
+metadata = MetaData()
+
+state_table = Table(
+    "processing_state",
+    metadata,
+    Column("name", String(50), primary_key=True),
+    Column("stats", Text),
+    Column("lease_owner", String(250)),
+    # Epoch seconds need a double, a MySQL FLOAT only resolves to minutes
+    Column("lease_expires", Double, nullable=False, default=0),
+)
+
+
+class DBState:
+    """Snapshot and lease in a row of the processing_state table. The lease
+    is taken with a conditional update, so the database decides between
+    replicas racing for it.
+
+    Parameters:
+    url (str): SQLAlchemy database URL
+    name (str): key of the state row
+    """
+
+    def __init__(self, url, name="stats"):
+        self.engine = create_engine(url, pool_pre_ping=True)
+        self.name = name
+        metadata.create_all(self.engine)
+        self.migrate_lease_expires()
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(insert(state_table).values(name=name, lease_expires=0))
+        except IntegrityError:
+            # Created by another replica
+            pass
+
+    def migrate_lease_expires(self):
+        """Widens a lease_expires column created as a MySQL FLOAT."""
+        if self.engine.dialect.name != "mysql":
+            return
+        columns = inspect(self.engine).get_columns("processing_state")
+        lease_type = next(c["type"] for c in columns if c["name"] == "lease_expires")
+        if not isinstance(lease_type, DOUBLE):
+            with self.engine.begin() as conn:
+                conn.execute(
+                    text(
+                        "ALTER TABLE processing_state"
+                        " MODIFY lease_expires DOUBLE NOT NULL"
+                    )
+                )
+
+    def acquire(self, owner, lease_seconds):
+        """Takes or renews the lease.
+
+        Returns:
+        True if the owner holds the lease.
+        """
+        now = time.time()
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                update(state_table)
+                .where(state_table.c.name == self.name)
+                .where(
+                    or_(
+                        state_table.c.lease_owner == owner,
+                        state_table.c.lease_owner.is_(None),
+                        state_table.c.lease_expires <= now,
+                    )
+                )
+                .values(lease_owner=owner, lease_expires=now + lease_seconds)
+            )
+        return result.rowcount == 1
+
+    def release(self, owner):
+        """Gives up the lease if the owner holds it, so a replica can take
+        it over without waiting for it to expire."""
+        with self.engine.begin() as conn:
+            conn.execute(
+                update(state_table)
+                .where(state_table.c.name == self.name)
+                .where(state_table.c.lease_owner == owner)
+                .values(lease_owner=None, lease_expires=0)
+            )
+
+    def read(self):
+        """Gets the stats snapshot, or None if there is none yet."""
+        with self.engine.connect() as conn:
+            stats = conn.execute(
+                select(state_table.c.stats).where(state_table.c.name == self.name)
+            ).scalar()
+        return json.loads(stats) if stats else None
+
+    def write(self, stats, owner):
+        """Saves the stats snapshot if the owner still holds the lease.
+
+        Returns:
+        True if the snapshot was saved.
+        """
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                update(state_table)
+                .where(state_table.c.name == self.name)
+                .where(state_table.c.lease_owner == owner)
+                .where(state_table.c.lease_expires > time.time())
+                .values(stats=json.dumps(stats))
+            )
+        return result.rowcount == 1
+
+
+def from_config(app_config):
+    """Creates the state backend set in the state section of the config,
+    a file at datastore.filepath by default."""
+    settings = app_config.get("state", {})
+    if settings.get("backend", "file") == "db":
+        return DBState(settings["url"])
+
+    return FileState(app_config["datastore"]["filepath"])
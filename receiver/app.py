@@ -3,18 +3,24 @@ Receiver service to accept event entries from post requests
 and publish them to a Kafka queue.
 """
 import os
-from datetime import datetime as dt
+import time
+from datetime import datetime as dt, timezone
 import json
-import logging.config
+import logging
+import queue
 import uuid
 
 import connexion
 from connexion import NoContent
 import yaml
 from pykafka import KafkaClient
+from pykafka.exceptions import ProduceFailureError
 from connexion.middleware import MiddlewarePosition
 from starlette.middleware.cors import CORSMiddleware
 
+from common import metrics, logs, topics, validation
+from spool import Spool
+
 # Endpoint configuration
 with open("config/receiver.prod.yaml", "r", encoding="utf-8") as f:
     app_config = yaml.safe_load(f.read())
@@ -22,22 +28,120 @@ with open("config/receiver.prod.yaml", "r", encoding="utf-8") as f:
 # Logging
 with open("logger/log.prod.yaml", "r", encoding="utf-8") as f:
     log_config = yaml.safe_load(f.read())
-    logging.config.dictConfig(log_config)
+    logs.configure(log_config, app_config.get("logging"))
 
 logger = logging.getLogger("basicLogger")
+event_logger = logs.EventLogger.from_settings(logger, app_config.get("logging"))
 
 
 def make_log(event_type, trace_id):
     """Creates log for events with type and trace ID."""
-    logger.info("Received event %s with a trace id of %s", event_type, trace_id)
+    event_logger.info("Received event %s with a trace id of %s", event_type, trace_id)
 
 
 # Kafka variables
 client = KafkaClient(
     hosts=f"{app_config['events']['hostname']}:{app_config['events']['port']}"
 )
-topic = client.topics[str.encode(f"{app_config['events']['topic']}")]
-producer = topic.get_sync_producer()
+
+
+def get_topic_name(event_type):
+    """Gets the name of the topic the event type is published to."""
+    return topics.get_topic_name(app_config["events"], event_type)
+
+
+def get_producer(topic_name):
+    """Creates a producer for a topic. Each message is sent as soon as it is
+    produced, and its delivery report is waited for by send, so the wait
+    can be bounded."""
+    return client.topics[str.encode(topic_name)].get_producer(
+        delivery_reports=True, min_queued_messages=1, linger_ms=0
+    )
+
+
+# One producer per topic, shared by the event types published to it
+producers = {
+    topic_name: get_producer(topic_name)
+    for topic_name in {
+        get_topic_name(event_type) for event_type in ("attraction_info", "expense_info")
+    }
+}
+
+PRODUCE_DURATION = metrics.Histogram(
+    "kafka_produce_duration_seconds",
+    "Duration of synchronous Kafka produce calls.",
+    ("topic",),
+)
+
+
+# Longest wait for the delivery report of a replayed message, the default
+# pending_timeout_ms of a pykafka sync producer
+REPLAY_TIMEOUT = 5
+
+
+def wait_for_delivery(producer, msg, timeout):
+    """Waits up to timeout seconds for the delivery report of a message,
+    raising if it failed or was not reported in time. Delivery reports are
+    kept per thread, so reports of this thread's earlier messages that
+    timed out are skipped."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            reported, error = producer.get_delivery_report(
+                timeout=max(0, deadline - time.monotonic())
+            )
+        except queue.Empty as e:
+            raise ProduceFailureError(
+                f"Delivery not reported within {timeout * 1000:.0f} ms"
+            ) from e
+        if reported is msg:
+            break
+
+    if error is not None:
+        raise error
+
+
+def send(event_type, value, timeout=REPLAY_TIMEOUT):
+    """Publishes an encoded message to the topic of its event type,
+    recording the produce latency and count. Raises if Kafka has not
+    acknowledged the message within timeout seconds."""
+    topic_name = get_topic_name(event_type)
+    producer = producers[topic_name]
+    with PRODUCE_DURATION.time(topic=topic_name):
+        wait_for_delivery(producer, producer.produce(value), timeout)
+    metrics.KAFKA_PRODUCED.inc(topic=topic_name)
+
+
+# Events accepted while Kafka is failing or slow are spooled to disk and
+# replayed by a drainer thread. Each process locks its own spool file.
+spool_config = app_config["spool"]
+spool = Spool(
+    spool_config["filepath"],
+    send,
+    fsync=spool_config.get("fsync", "interval"),
+    fsync_interval_ms=spool_config.get("fsync_interval_ms", 1000),
+    slow_produce_ms=spool_config.get("slow_produce_ms", 500),
+    retry_interval_ms=spool_config.get("retry_interval_ms", 1000),
+)
+
+SPOOLED = metrics.Counter(
+    "receiver_spooled_events_total",
+    "Events spooled to disk while Kafka was unhealthy.",
+    ("topic",),
+)
+SPOOL_PENDING = metrics.Gauge(
+    "receiver_spool_pending_bytes",
+    "Size of the spooled events not yet replayed to Kafka.",
+)
+SPOOL_PENDING.set_function(spool.pending_bytes)
+
+
+def produce(event_type, msg):
+    """Publishes a message to the topic of its event type, or spools it
+    while Kafka is unhealthy."""
+    if spool.publish(event_type, json.dumps(msg).encode("utf-8")):
+        SPOOLED.inc(topic=get_topic_name(event_type))
+
 
 # Endpoints
 def report_attraction_info(body):
@@ -66,12 +170,14 @@ def report_attraction_info(body):
 
     msg = {
         "type": "attraction_info",
-        "datetime": dt.now().strftime("%Y-%m-%dT%H:%M:%S"),
+        "datetime": dt.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"),
+        "ingest_ts": time.time(),
         "payload": body,
     }
-    msg_str = json.dumps(msg)
-    producer.produce(msg_str.encode("utf-8"))
-    logger.info("Attraction Event posted to Kafka with trace_id %s.", body["trace_id"])
+    produce("attraction_info", msg)
+    event_logger.info(
+        "Attraction Event posted to Kafka with trace_id %s.", body["trace_id"]
+    )
 
     return NoContent, 201
 
@@ -102,18 +208,29 @@ def report_expense_info(body):
 
     msg = {
         "type": "expense_info",
-        "datetime": dt.now().strftime("%Y-%m-%dT%H:%M:%S"),
+        "datetime": dt.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"),
+        "ingest_ts": time.time(),
         "payload": body,
     }
-    msg_str = json.dumps(msg)
-    producer.produce(msg_str.encode("utf-8"))
-    logger.info("Expense Event posted to Kafka with trace_id %s.", body["trace_id"])
+    produce("expense_info", msg)
+    event_logger.info(
+        "Expense Event posted to Kafka with trace_id %s.", body["trace_id"]
+    )
 
     return NoContent, 201
 
 
-app = connexion.FlaskApp(__name__, specification_dir="")
-app.add_api("receiver.yaml", base_path="/receiver", strict_validation=True, validate_responses=True)
+app = connexion.FlaskApp(
+    __name__, specification_dir="", middlewares=validation.middlewares()
+)
+app.add_api(
+    "receiver.yaml",
+    base_path="/receiver",
+    strict_validation=True,
+    validate_responses=True,
+    validator_map=validation.validator_map(app_config.get("validation")),
+)
+app.add_middleware(metrics.MetricsMiddleware, position=MiddlewarePosition.BEFORE_EXCEPTION)
 
 if "CORS_ALLOW_ALL" in os.environ and os.environ["CORS_ALLOW_ALL"] == "yes":
     app.add_middleware(
@@ -127,4 +244,5 @@ if "CORS_ALLOW_ALL" in os.environ and os.environ["CORS_ALLOW_ALL"] == "yes":
 
 
 if __name__ == "__main__":
+    spool.start()
     app.run(port=8080, host="0.0.0.0")
@@ -0,0 +1,261 @@
+"""
+Receiver service in native ASGI mode. Serves the same API as app.py with
+async handlers on a connexion.AsyncApp, publishing to Kafka with an
+asyncio producer, so an in-flight POST waits on Kafka without holding a
+worker thread. Runs under uvicorn with the workers set in server.workers.
+
+Usage: python3 async_app.py
+"""
+import asyncio
+import contextlib
+import os
+import time
+from datetime import datetime as dt, timezone
+import json
+import logging
+import uuid
+
+import connexion
+from connexion import NoContent
+from connexion.middleware import MiddlewarePosition
+from connexion.resolver import Resolver
+from connexion.utils import get_function_from_name
+import uvicorn
+import yaml
+from aiokafka import AIOKafkaProducer
+from starlette.middleware.cors import CORSMiddleware
+
+from common import metrics, logs, topics, validation
+from spool import Spool
+
+# Endpoint configuration
+with open("config/receiver.prod.yaml", "r", encoding="utf-8") as f:
+    app_config = yaml.safe_load(f.read())
+
+# Logging
+with open("logger/log.prod.yaml", "r", encoding="utf-8") as f:
+    log_config = yaml.safe_load(f.read())
+    logs.configure(log_config, app_config.get("logging"))
+
+logger = logging.getLogger("basicLogger")
+event_logger = logs.EventLogger.from_settings(logger, app_config.get("logging"))
+
+
+def make_log(event_type, trace_id):
+    """Creates log for events with type and trace ID."""
+    event_logger.info("Received event %s with a trace id of %s", event_type, trace_id)
+
+
+def get_topic_name(event_type):
+    """Gets the name of the topic the event type is published to."""
+    return topics.get_topic_name(app_config["events"], event_type)
+
+
+# Kafka producer, event loop and spool of this worker, set up by the
+# lifespan so the uvicorn supervisor process does not take a spool slot
+producer = None
+loop = None
+spool = None
+
+PRODUCE_DURATION = metrics.Histogram(
+    "kafka_produce_duration_seconds",
+    "Duration of Kafka produce calls.",
+    ("topic",),
+)
+
+
+async def send(event_type, value):
+    """Publishes an encoded message to the topic of its event type,
+    recording the produce latency and count."""
+    topic_name = get_topic_name(event_type)
+    with PRODUCE_DURATION.time(topic=topic_name):
+        await producer.send_and_wait(topic_name, value)
+    metrics.KAFKA_PRODUCED.inc(topic=topic_name)
+
+
+def send_from_thread(event_type, value):
+    """Publishes a message from the spool drainer thread on the event loop."""
+    return asyncio.run_coroutine_threadsafe(send(event_type, value), loop).result()
+
+
+SPOOLED = metrics.Counter(
+    "receiver_spooled_events_total",
+    "Events spooled to disk while Kafka was unhealthy.",
+    ("topic",),
+)
+SPOOL_PENDING = metrics.Gauge(
+    "receiver_spool_pending_bytes",
+    "Size of the spooled events not yet replayed to Kafka.",
+)
+
+
+async def run_spool(func, *args):
+    """Runs a spool call on the default executor. Spool calls take the
+    spool lock, which the drainer thread holds while it truncates the
+    spool, and may fsync, so they are kept off the event loop."""
+    return await loop.run_in_executor(None, func, *args)
+
+
+async def produce(event_type, msg):
+    """Publishes a message to the topic of its event type, or spools it
+    while Kafka is unhealthy or does not acknowledge it within
+    slow_produce_ms. A message that times out may still reach Kafka after
+    it is spooled, so like a replayed one it can be delivered twice."""
+    value = json.dumps(msg).encode("utf-8")
+    # Read without the lock as a hint so a healthy produce skips the
+    # executor, spool_if_unhealthy checks it again under the lock
+    if spool.healthy or not await run_spool(spool.spool_if_unhealthy, event_type, value):
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(send(event_type, value), spool.slow_produce)
+        except asyncio.TimeoutError:
+            await run_spool(
+                spool.spool_failed,
+                event_type,
+                value,
+                f"not acknowledged within {spool.slow_produce * 1000:.0f} ms",
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            await run_spool(spool.spool_failed, event_type, value, e)
+        else:
+            duration = time.perf_counter() - start
+            # Only a slow produce takes the lock to mark the broker unhealthy
+            if duration >= spool.slow_produce:
+                await run_spool(spool.record_duration, duration)
+            return
+
+    SPOOLED.inc(topic=get_topic_name(event_type))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    """Starts the Kafka producer and spool drainer of the worker."""
+    global producer, loop, spool  # pylint: disable=global-statement
+    loop = asyncio.get_running_loop()
+    producer = AIOKafkaProducer(
+        bootstrap_servers=f"{app_config['events']['hostname']}:{app_config['events']['port']}"
+    )
+    await producer.start()
+
+    spool_config = app_config["spool"]
+    spool = Spool(
+        spool_config["filepath"],
+        send_from_thread,
+        fsync=spool_config.get("fsync", "interval"),
+        fsync_interval_ms=spool_config.get("fsync_interval_ms", 1000),
+        slow_produce_ms=spool_config.get("slow_produce_ms", 500),
+        retry_interval_ms=spool_config.get("retry_interval_ms", 1000),
+    )
+    SPOOL_PENDING.set_function(spool.pending_bytes)
+    spool.start()
+    try:
+        yield
+    finally:
+        await producer.stop()
+
+
+# Endpoints
+async def report_attraction_info(body):
+    """Recieves JSON from post request and
+    attaches attraction type and time received
+    and publishes this message to the Kafka
+    queue.
+
+    Parameters:
+    body (JSON): contains attraction event
+    information including user id, attraction
+    category, attraction time stamp and hours open.
+
+    Returns: None
+    """
+    body["trace_id"] = str(uuid.uuid4())
+    make_log("attraction_info", body["trace_id"])
+
+    msg = {
+        "type": "attraction_info",
+        "datetime": dt.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"),
+        "ingest_ts": time.time(),
+        "payload": body,
+    }
+    await produce("attraction_info", msg)
+    event_logger.info(
+        "Attraction Event posted to Kafka with trace_id %s.", body["trace_id"]
+    )
+
+    return NoContent, 201
+
+
+async def report_expense_info(body):
+    """Recieves JSON from post request and
+    attaches expense type and time received
+    and publishes this message to the Kafka
+    queue.
+
+    Parameters:
+    body (JSON): contains expense event
+    information including user id, expense
+    category, expense time stamp and amount.
+
+    Returns: None
+    """
+    body["trace_id"] = str(uuid.uuid4())
+    make_log("expense_info", body["trace_id"])
+
+    msg = {
+        "type": "expense_info",
+        "datetime": dt.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"),
+        "ingest_ts": time.time(),
+        "payload": body,
+    }
+    await produce("expense_info", msg)
+    event_logger.info(
+        "Expense Event posted to Kafka with trace_id %s.", body["trace_id"]
+    )
+
+    return NoContent, 201
+
+
+def resolve_function(function_name):
+    """Resolves the app.* operationIds of receiver.yaml to the handlers of
+    this module."""
+    module_name, _, name = function_name.rpartition(".")
+    if module_name == "app":
+        return globals()[name]
+
+    return get_function_from_name(function_name)
+
+
+app = connexion.AsyncApp(
+    __name__,
+    specification_dir="",
+    lifespan=lifespan,
+    middlewares=validation.middlewares(),
+)
+app.add_api(
+    "receiver.yaml",
+    base_path="/receiver",
+    strict_validation=True,
+    validate_responses=True,
+    validator_map=validation.validator_map(app_config.get("validation")),
+    resolver=Resolver(resolve_function),
+)
+app.add_middleware(metrics.MetricsMiddleware, position=MiddlewarePosition.BEFORE_EXCEPTION)
+
+if "CORS_ALLOW_ALL" in os.environ and os.environ["CORS_ALLOW_ALL"] == "yes":
+    app.add_middleware(
+        CORSMiddleware,
+        position=MiddlewarePosition.BEFORE_EXCEPTION,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+
+if __name__ == "__main__":
+    uvicorn.run(
+        "async_app:app",
+        port=8080,
+        host="0.0.0.0",
+        workers=app_config.get("server", {}).get("workers", 1),
+    )
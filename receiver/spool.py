@@ -0,0 +1,261 @@
+"""
+Append-only on-disk spool for events accepted while Kafka is unhealthy.
+
+Events are published straight to Kafka while it is healthy. A produce not
+acknowledged within slow_produce_ms is given up on and its event spooled, so
+a request never waits longer than that on the broker. A failed or slow
+produce marks the broker unhealthy, and from then on accepted events
+are appended to the spool file instead, so the POST only waits for a
+buffered file write. A drainer thread replays the spool to Kafka in order,
+and once it has caught up the spool is truncated and events go straight
+to Kafka again. Events arriving while the spool drains are appended behind
+the spooled ones, so the topic order matches the order they were accepted.
+
+The spool holds one event per line, as the event type and the encoded
+message separated by a tab. The offset of the next line to replay is kept
+in a file next to the spool, so a restarted receiver resumes the replay.
+Events replayed just before a crash can be replayed again after the
+restart, so delivery from the spool is at least once.
+"""
+
+import fcntl
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("basicLogger")
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+
+class Spool:
+    """Publishes events to Kafka, spooling them to disk while the broker
+    is unhealthy.
+
+    Parameters:
+    filepath (str): path of the spool file, where {slot} is filled with
+    the first slot not held by another process
+    send (callable): publishes an encoded message of an event type to
+    Kafka, raising if it could not, or if Kafka has not acknowledged it
+    within the optional timeout in seconds
+    fsync (str): always syncs every spooled event to disk, interval syncs
+    at most every fsync_interval_ms, never leaves it to the OS
+    slow_produce_ms (float): produce duration that marks the broker
+    unhealthy, and the longest a request waits for its produce
+    retry_interval_ms (float): wait before retrying an unhealthy broker
+    buffer_size (int): size of the spool write buffer
+    """
+
+    def __init__(
+        self,
+        filepath,
+        send,
+        fsync="interval",
+        fsync_interval_ms=1000,
+        slow_produce_ms=500,
+        retry_interval_ms=1000,
+        buffer_size=65536,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {', '.join(FSYNC_POLICIES)}")
+
+        self.send = send
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval_ms / 1000
+        self.slow_produce = slow_produce_ms / 1000
+        self.retry_interval = retry_interval_ms / 1000
+
+        directory = os.path.dirname(filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.unhealthy = threading.Condition(self.lock)
+        self.filepath, self.file = self.open_file(filepath, buffer_size)
+        self.offset_path = f"{self.filepath}.offset"
+        self.last_fsync = time.monotonic()
+        self.read_offset = self.load_offset()
+
+        # A spool left over from the last run is replayed before new events
+        self.healthy = self.file.tell() <= self.read_offset
+        if not self.healthy:
+            logger.info(
+                "Resuming spool replay of %d bytes",
+                self.file.tell() - self.read_offset,
+            )
+
+    @staticmethod
+    def open_file(filepath, buffer_size):
+        """Opens the spool file and locks it to this process. Processes
+        sharing a directory each take their own slot, and a restarted
+        process takes over a spool left behind in a free slot."""
+        slot = 0
+        while True:
+            path = filepath.format(slot=slot)
+            f = open(path, "ab", buffering=buffer_size)
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError as e:
+                f.close()
+                if path == filepath:
+                    raise RuntimeError(f"Spool {path} is held by another process") from e
+                slot += 1
+                continue
+            return path, f
+
+    def load_offset(self):
+        """Reads the replay offset saved by the last drain."""
+        try:
+            with open(self.offset_path, "r", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def save_offset(self):
+        """Saves the replay offset, replacing the file so a crash never
+        leaves it half written."""
+        tmp_path = f"{self.offset_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(self.read_offset))
+            if self.fsync != "never":
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+
+    def pending_bytes(self):
+        """Gets the size of the spooled events not yet replayed."""
+        with self.lock:
+            return self.file.tell() - self.read_offset
+
+    def append(self, event_type, value):
+        """Appends an event to the spool. Called with the lock held."""
+        self.file.write(event_type.encode("utf-8") + b"\t" + value + b"\n")
+        # The buffer is flushed so the event survives a receiver crash and
+        # the drainer can read it, fsync also covers a host crash
+        self.file.flush()
+        now = time.monotonic()
+        if self.fsync == "always" or (
+            self.fsync == "interval" and now - self.last_fsync >= self.fsync_interval
+        ):
+            os.fsync(self.file.fileno())
+            self.last_fsync = now
+
+    def mark_unhealthy(self):
+        """Sends events to the spool until the drainer has caught up.
+        Called with the lock held."""
+        if self.healthy:
+            self.healthy = False
+            self.unhealthy.notify()
+
+    def spool_if_unhealthy(self, event_type, value):
+        """Spools an event if the broker is unhealthy.
+
+        Returns:
+        True if the event was spooled, False if it should be sent to Kafka.
+        """
+        with self.lock:
+            if not self.healthy:
+                self.append(event_type, value)
+                return True
+        return False
+
+    def spool_failed(self, event_type, value, error):
+        """Spools an event Kafka failed to take and marks it unhealthy."""
+        logger.warning("Kafka produce failed, spooling events: %s", error)
+        with self.lock:
+            self.mark_unhealthy()
+            self.append(event_type, value)
+
+    def record_duration(self, duration):
+        """Marks the broker unhealthy after a slow produce."""
+        if duration >= self.slow_produce:
+            logger.warning(
+                "Kafka produce took %.0f ms, spooling events", duration * 1000
+            )
+            with self.lock:
+                self.mark_unhealthy()
+
+    def publish(self, event_type, value):
+        """Publishes an encoded message of an event type.
+
+        Returns:
+        True if the event was spooled, False if it was sent to Kafka.
+        """
+        if self.spool_if_unhealthy(event_type, value):
+            return True
+
+        start = time.perf_counter()
+        try:
+            # A message that times out may still reach Kafka after it is
+            # spooled, so like a replayed one it can be delivered twice
+            self.send(event_type, value, timeout=self.slow_produce)
+        except Exception as e:  # pylint: disable=broad-except
+            self.spool_failed(event_type, value, e)
+            return True
+        self.record_duration(time.perf_counter() - start)
+
+        return False
+
+    def replay(self):
+        """Sends the spooled events from the replay offset to Kafka.
+
+        Returns:
+        True if the spool was replayed to its end, False if a send failed.
+        """
+        with open(self.filepath, "rb") as f:
+            f.seek(self.read_offset)
+            try:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Still being written, picked up on the next pass
+                        break
+                    event_type, value = line[:-1].split(b"\t", 1)
+                    self.send(event_type.decode("utf-8"), value)
+                    self.read_offset += len(line)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.warning("Spool replay failed, retrying: %s", e)
+                return False
+            finally:
+                self.save_offset()
+
+        return True
+
+    def drain(self):
+        """Replays the spool whenever the broker is unhealthy, then truncates
+        it and sends events straight to Kafka again."""
+        while True:
+            with self.lock:
+                while self.healthy:
+                    self.unhealthy.wait()
+
+            if not self.replay():
+                time.sleep(self.retry_interval)
+                continue
+
+            with self.lock:
+                if self.read_offset < self.file.tell():
+                    # Events were spooled during the replay
+                    continue
+
+                if self.read_offset > 0:
+                    logger.info("Spool drained, producing to Kafka again")
+                    self.file.seek(0)
+                    self.file.truncate()
+                    self.read_offset = 0
+                    self.save_offset()
+                    self.healthy = True
+                    continue
+
+            # Marked unhealthy by a slow produce with nothing spooled, so
+            # the broker is given time before events are sent to it again
+            time.sleep(self.retry_interval)
+            with self.lock:
+                if self.file.tell() == 0:
+                    self.healthy = True
+
+    def start(self):
+        """Starts the drainer thread."""
+        thread = threading.Thread(target=self.drain, daemon=True)
+        thread.start()
+        return thread
@@ -5,16 +5,23 @@ user and trace ids, and counts from the mySQL database.
 """
 
 import os
-from datetime import datetime as dt
+import time
+from datetime import datetime as dt, timezone
 import json
-import logging.config
+import logging
 from threading import Thread
 import functools
+import heapq
+import itertools
+import zlib
+import base64
 
 import connexion
+from connexion import NoContent
 import yaml
+from flask import Response
 
-from sqlalchemy import select, func
+from sqlalchemy import select, func, and_, or_
 from pykafka import KafkaClient
 from pykafka.common import OffsetType
 from connexion.middleware import MiddlewarePosition
@@ -23,6 +30,8 @@ from starlette.middleware.cors import CORSMiddleware
 import db
 import models
 import create_db
+from cache import IdDigests, RecentEvents, UserEvents, utc_now
+from common import merkle, idstream, metrics, logs, topics, validation
 
 # App Config
 with open("config/storage.prod.yaml", "r", encoding="utf-8") as f:
@@ -31,15 +40,24 @@ with open("config/storage.prod.yaml", "r", encoding="utf-8") as f:
 # Logging
 with open("logger/log.prod.yaml", "r", encoding="utf-8") as f:
     log_config = yaml.safe_load(f.read())
-    logging.config.dictConfig(log_config)
+    logs.configure(log_config, app_config.get("logging"))
 
 
 logger = logging.getLogger("basicLogger")
+event_logger = logs.EventLogger.from_settings(logger, app_config.get("logging"))
 
 
 def log_event(event_type, trace_id):
     """Creates log for events with type and trace ID."""
-    logger.debug("Stored event %s with a trace id of %s", event_type, trace_id)
+    event_logger.debug("Stored event %s with a trace id of %s", event_type, trace_id)
+
+
+def to_utc(value):
+    """Converts an aware datetime to a naive UTC datetime, as stored in the
+    database."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
 
 
 def use_db_session(func):
@@ -59,12 +77,77 @@ def use_db_session(func):
     return wrapper
 
 
+# Time from the receiver accepting an event to its insert being committed
+PERSIST_LATENCY = metrics.LatencySummary(
+    "event_ingest_to_persist_seconds",
+    "Percentiles of the time from ingest to the event being stored.",
+    app_config.get("latency", {}).get("windows", [60, 300]),
+)
+
+
+# Events stored in the last few minutes, by event type
+cache_config = app_config.get("cache", {})
+recent_events = {
+    event_type: RecentEvents(
+        cache_config.get("window_seconds", 600),
+        cache_config.get("max_events", 100_000),
+    )
+    for event_type in ("attraction_info", "expense_info")
+}
+
+CACHE_REQUESTS = metrics.Counter(
+    "storage_cache_requests_total",
+    "Range queries by whether the recent events cache answered them.",
+    ("event_type", "result"),
+)
+CACHE_HIT_RATIO = metrics.Gauge(
+    "storage_cache_hit_ratio",
+    "Share of range queries answered by the recent events cache.",
+    ("event_type",),
+)
+for cached_type, cached_events in recent_events.items():
+    CACHE_HIT_RATIO.set_function(cached_events.hit_ratio, event_type=cached_type)
+
+# History pages of hot users
+user_events = UserEvents(
+    cache_config.get("max_users", 256),
+    cache_config.get("max_pages_per_user", 8),
+)
+
+# Trace ID bucket sums of the consistency check digests
+id_digests = IdDigests(cache_config.get("max_id_digests", 8192))
+
+
+def store_event(session, event_type, event):
+    """Inserts an event and adds it to the recent events cache. The event
+    is constructed with its date_created, so the cached copy holds the
+    stored value without reading the row back."""
+    session.add(event)
+    # The row is read before the commit expires its attributes
+    session.flush()
+    row = event.to_dict()
+    session.commit()
+    recent_events[event_type].add(row)
+    user_events.invalidate(row["user_id"])
+
+
+def get_recent_events(event_type, start, end):
+    """Gets the events created in a range from the recent events cache,
+    or None if the range starts before the cache."""
+    results = recent_events[event_type].get(to_utc(start), to_utc(end))
+    CACHE_REQUESTS.inc(
+        event_type=event_type, result="miss" if results is None else "hit"
+    )
+    return results
+
+
 @use_db_session
-def process_messages(session):
-    """Consumes Kafka queue messages and inserts them into mySQL database."""
+def process_messages(session, topic_name):
+    """Consumes Kafka queue messages from a topic and inserts them into
+    mySQL database."""
     hostname = f"{app_config['events']['hostname']}:{app_config['events']['port']}"
     client = KafkaClient(hosts=hostname)
-    topic = client.topics[str.encode(f"{app_config['events']['topic']}")]
+    topic = client.topics[str.encode(topic_name)]
 
     # Create a consume on a consumer group, that only reads new messages
     # (uncommitted messages) when the service re-starts (i.e., it doesn't
@@ -75,33 +158,37 @@ def process_messages(session):
         reset_offset_on_start=False,
         auto_offset_reset=OffsetType.LATEST,
     )
+    metrics.track_consumer(topic_name, consumer)
 
     # This is blocking - it will wait for a new message
     for msg in consumer:
+        metrics.KAFKA_CONSUMED.inc(topic=topic_name)
         msg_str = msg.value.decode("utf-8")
         msg = json.loads(msg_str)
-        logger.info("Message: %s", msg)
+        event_logger.debug("Message: %s", msg)
 
         payload = msg["payload"]
 
         if msg["type"] == "attraction_info":
 
-            session.add(cons_attraction_info(payload))
-            session.commit()
+            store_event(session, "attraction_info", cons_attraction_info(payload))
 
-            logger.info(
+            event_logger.info(
                 "Attraction event with trace id %s stored via Kafka.",
                 payload["trace_id"],
             )
         elif msg["type"] == "expense_info":
 
-            session.add(cons_expense_info(payload))
-            session.commit()
+            store_event(session, "expense_info", cons_expense_info(payload))
 
-            logger.info(
+            event_logger.info(
                 "Expense event with trace id %s stored via Kafka.", payload["trace_id"]
             )
 
+        # Events from older receivers have no ingest timestamp
+        if "ingest_ts" in msg:
+            PERSIST_LATENCY.observe(time.time() - msg["ingest_ts"])
+
         # Commit the new message as being read
         consumer.commit_offsets()
 
@@ -116,6 +203,7 @@ def cons_attraction_info(body):
             body["attraction_timestamp"], "%Y-%m-%d %H:%M:%S"
         ),
         trace_id=body["trace_id"],
+        date_created=utc_now(),
     )
     return event
 
@@ -128,6 +216,7 @@ def cons_expense_info(body):
         expense_category=body["expense_category"],
         expense_timestamp=dt.strptime(body["expense_timestamp"], "%Y-%m-%d %H:%M:%S"),
         trace_id=body["trace_id"],
+        date_created=utc_now(),
     )
 
     return event
@@ -135,12 +224,22 @@ def cons_expense_info(body):
 
 def get_attraction_info(start_timestamp, end_timestamp):
     """Gets new attraction entries from the mySQL database between the start and end timestamps
-    and returns the result as a list of dictionaries."""
-    session = db.make_session()
-
+    and returns the result as a list of dictionaries. Recent ranges are
+    answered from the recent events cache."""
     start = dt.fromisoformat(start_timestamp)
     end = dt.fromisoformat(end_timestamp)
 
+    results = get_recent_events("attraction_info", start, end)
+    if results is not None:
+        logger.info(
+            "Found %d attraction entries in cache (start: %s, end: %s)",
+            len(results),
+            start,
+            end,
+        )
+        return results
+
+    session = db.make_session()
     statement = (
         select(models.AttractionInfo)
         .where(models.AttractionInfo.date_created >= start)
@@ -162,12 +261,22 @@ def get_attraction_info(start_timestamp, end_timestamp):
 
 def get_expense_info(start_timestamp, end_timestamp):
     """Gets new expense entries from the mySQL database between the start and end timestamps
-    and returns the result as a list of dictionaries."""
-    session = db.make_session()
-
+    and returns the result as a list of dictionaries. Recent ranges are
+    answered from the recent events cache."""
     start = dt.fromisoformat(start_timestamp)
     end = dt.fromisoformat(end_timestamp)
 
+    results = get_recent_events("expense_info", start, end)
+    if results is not None:
+        logger.info(
+            "Found %d expense entries in cache (start: %s, end: %s)",
+            len(results),
+            start,
+            end,
+        )
+        return results
+
+    session = db.make_session()
     statement = (
         select(models.ExpenseInfo)
         .where(models.ExpenseInfo.date_created >= start)
@@ -208,15 +317,57 @@ def get_counts():
     return results
 
 
-def get_attr_ids():
+def get_date_range():
+    """Gets the first and last date_created of the events, read from the
+    date_created indexes."""
+    session = db.make_session()
+
+    firsts = []
+    lasts = []
+    for model in (models.AttractionInfo, models.ExpenseInfo):
+        first, last = session.execute(
+            select(func.min(model.date_created), func.max(model.date_created))
+        ).one()
+        if first is not None:
+            firsts.append(first)
+            lasts.append(last)
+
+    session.close()
+
+    if not firsts:
+        logger.info("Found no events for the date range.")
+        return NoContent, 204
+
+    results = {"start": min(firsts), "end": max(lasts)}
+    logger.info("Found events from %s to %s.", results["start"], results["end"])
+
+    return results, 200
+
+
+def to_id_entry(result, with_created):
+    """Converts a row into its ID entry, with the UTC time it was stored
+    if with_created is set."""
+    entry = result.to_dict_id()
+    if with_created:
+        entry["date_created"] = result.date_created.isoformat(timespec="microseconds")
+    return entry
+
+
+def get_attr_ids(since=None):
     """Gets all user and trace IDs of attraction events from the mySQL database and
-    returns them as a list of dictionaries."""
+    returns them as a list of dictionaries. If since is given, only events
+    stored at or after that timestamp are returned, with their stored time."""
     session = db.make_session()
 
     statement = select(models.AttractionInfo)
+    if since is not None:
+        statement = statement.where(
+            models.AttractionInfo.date_created >= to_utc(dt.fromisoformat(since))
+        )
 
     results = [
-        result.to_dict_id() for result in session.execute(statement).scalars().all()
+        to_id_entry(result, since is not None)
+        for result in session.execute(statement).scalars().all()
     ]
 
     logger.info("Found %d attraction id entries", len(results))
@@ -226,15 +377,21 @@ def get_attr_ids():
     return results
 
 
-def get_exp_ids():
+def get_exp_ids(since=None):
     """Gets all user and trace IDs of expense events from the mySQL database and
-    returns them as a list of dictionaries."""
+    returns them as a list of dictionaries. If since is given, only events
+    stored at or after that timestamp are returned, with their stored time."""
     session = db.make_session()
 
     statement = select(models.ExpenseInfo)
+    if since is not None:
+        statement = statement.where(
+            models.ExpenseInfo.date_created >= to_utc(dt.fromisoformat(since))
+        )
 
     results = [
-        result.to_dict_id() for result in session.execute(statement).scalars().all()
+        to_id_entry(result, since is not None)
+        for result in session.execute(statement).scalars().all()
     ]
 
     logger.info("Found %d expense id entries", len(results))
@@ -244,15 +401,349 @@ def get_exp_ids():
     return results
 
 
-def setup_kafka_thread():
-    """Creates thread for Kafka consumer."""
-    t1 = Thread(target=process_messages)
-    t1.daemon = True
-    t1.start()
+def where_trace_prefix(statement, model, prefix):
+    """Limits a statement to the rows whose trace ID starts with the prefix."""
+    lower, upper = merkle.prefix_bounds(prefix)
+    if lower is not None:
+        statement = statement.where(model.trace_id >= lower)
+    if upper is not None:
+        statement = statement.where(model.trace_id < upper)
+
+    return statement
+
+
+def digest_table(session, model, prefix):
+    """Gets the bucket sums of the trace IDs of a table under a prefix.
+
+    The cached sums are reused while the rows they cover still count the
+    same, and only the rows added since are hashed.
+    """
+    key = (model.__tablename__, prefix)
+    last_id, sums = 0, {}
+    cached = id_digests.get(key)
+    if cached is not None:
+        count = session.execute(
+            where_trace_prefix(
+                select(func.count()).where(model.id <= cached[0]), model, prefix
+            )
+        ).scalar_one()
+        if count == sum(bucket[0] for bucket in cached[1].values()):
+            last_id, sums = cached
+        else:
+            id_digests.drop(key)
+
+    max_id = session.execute(select(func.max(model.id))).scalar_one() or 0
+    if max_id > last_id:
+        trace_ids = session.execute(
+            where_trace_prefix(
+                select(model.trace_id).where(model.id > last_id, model.id <= max_id),
+                model,
+                prefix,
+            ),
+            execution_options={"yield_per": 10000},
+        ).scalars()
+        merkle.add_to_buckets(sums, trace_ids, len(prefix))
+        last_id = max_id
+
+    id_digests.put(key, last_id, {char: list(bucket) for char, bucket in sums.items()})
+
+    return sums
+
+
+def get_id_digest(prefix=""):
+    """Gets the Merkle digests of the trace ID buckets one level below the
+    prefix, over both attraction and expense events.
+
+    Returns:
+    A dictionary with the prefix and the digest of each non-empty child bucket.
+    """
+    session = db.make_session()
+
+    buckets = merkle.format_digests(
+        merkle.combine_buckets(
+            *(
+                digest_table(session, model, prefix)
+                for model in (models.AttractionInfo, models.ExpenseInfo)
+            )
+        )
+    )
+
+    session.close()
 
+    logger.info("Computed %d id digests for prefix '%s'", len(buckets), prefix)
 
-app = connexion.FlaskApp(__name__, specification_dir="")
-app.add_api("storage.yaml", base_path="/storage", strict_validation=True, validate_responses=True)
+    return {"prefix": prefix, "buckets": buckets}, 200
+
+
+def get_id_bucket(prefix):
+    """Gets the user and trace IDs of attraction and expense events whose
+    trace ID starts with the prefix, as a list of dictionaries."""
+    session = db.make_session()
+
+    results = [
+        result.to_dict_id()
+        for model in (models.AttractionInfo, models.ExpenseInfo)
+        for result in session.execute(
+            where_trace_prefix(select(model), model, prefix)
+        ).scalars()
+    ]
+
+    session.close()
+
+    logger.info("Found %d id entries for prefix '%s'", len(results), prefix)
+
+    return results, 200
+
+
+def get_id_stream():
+    """Streams the user and trace IDs of all events, sorted by trace ID, as
+    gzip compressed binary records. Both tables are read with server-side
+    cursors and merged, so memory use does not grow with the table size."""
+    tables = [
+        (models.AttractionInfo, "attraction_info"),
+        (models.ExpenseInfo, "expense_info"),
+    ]
+
+    def generate():
+        # Opened by the first read so a response that is never iterated
+        # holds no sessions, each cursor streams on its own connection
+        sessions = [db.make_session() for _ in tables]
+        try:
+            streams = [
+                (
+                    idstream.encode_record(trace_id, user_id, event_type)
+                    for trace_id, user_id in session.execute(
+                        select(model.trace_id, model.user_id).order_by(
+                            model.trace_id
+                        ),
+                        execution_options={"stream_results": True, "yield_per": 10000},
+                    )
+                )
+                for session, (model, event_type) in zip(sessions, tables)
+            ]
+            yield from idstream.gzip_chunks(heapq.merge(*streams))
+        finally:
+            for session in sessions:
+                session.close()
+
+    logger.info("Streaming sorted id records.")
+
+    return Response(
+        generate(),
+        mimetype="application/octet-stream",
+        headers={"Content-Encoding": "gzip"},
+    )
+
+
+# Event tables of the user history, by event type
+USER_EVENT_MODELS = {
+    "attraction_info": models.AttractionInfo,
+    "expense_info": models.ExpenseInfo,
+}
+
+
+def encode_cursor(event):
+    """Encodes the position of an event in the user history."""
+    key = f"{event['date_created'].isoformat()}|{event['type']}|{event['id']}"
+    return base64.urlsafe_b64encode(key.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor into its date_created, event type and id."""
+    created, event_type, event_id = (
+        base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+    )
+    if event_type not in USER_EVENT_MODELS:
+        raise ValueError(f"Unknown event type {event_type}")
+    return dt.fromisoformat(created), event_type, int(event_id)
+
+
+def history_key(event):
+    """Gets the sort key of an event in the user history."""
+    return event["date_created"], event["type"], event["id"]
+
+
+def query_user_events(session, user_id, cursor, limit):
+    """Gets a page of a user's events, newest first, by merging the newest
+    events of each table after the cursor. Each query is a range scan of
+    the (user_id, date_created) index."""
+    streams = []
+    for event_type, model in USER_EVENT_MODELS.items():
+        statement = select(model).where(model.user_id == user_id)
+        if cursor is not None:
+            created, cursor_type, cursor_id = cursor
+            # Events sort by date_created, event type and id
+            if event_type < cursor_type:
+                statement = statement.where(model.date_created <= created)
+            elif event_type == cursor_type:
+                statement = statement.where(
+                    or_(
+                        model.date_created < created,
+                        and_(model.date_created == created, model.id < cursor_id),
+                    )
+                )
+            else:
+                statement = statement.where(model.date_created < created)
+        statement = statement.order_by(
+            model.date_created.desc(), model.id.desc()
+        ).limit(limit + 1)
+
+        streams.append(
+            [
+                dict(event.to_dict(), type=event_type)
+                for event in session.execute(statement).scalars()
+            ]
+        )
+
+    events = list(
+        itertools.islice(heapq.merge(*streams, key=history_key, reverse=True), limit + 1)
+    )
+    next_cursor = encode_cursor(events[limit - 1]) if len(events) > limit else None
+
+    return events[:limit], next_cursor
+
+
+def get_user_events(user_id, cursor=None, limit=100):
+    """Gets a page of the events of a user, newest first.
+
+    Parameters:
+    user_id (str): the user to get the events of
+    cursor (str): the X-Next-Cursor header of the previous page
+    limit (int): maximum number of events to return
+
+    Returns:
+    The page of events, with an X-Next-Cursor header if there are more.
+    """
+    key = (cursor, limit)
+    page = user_events.get(user_id, key)
+    if page is None:
+        try:
+            position = decode_cursor(cursor) if cursor is not None else None
+        except ValueError:
+            return {"message": "Invalid cursor"}, 400
+
+        token = user_events.token()
+        session = db.make_session()
+        page = query_user_events(session, user_id, position, limit)
+        session.close()
+        user_events.put(user_id, key, page, token)
+
+    events, next_cursor = page
+    logger.info("Found %d events of user %s", len(events), user_id)
+
+    if next_cursor is None:
+        return events, 200
+
+    return events, 200, {"X-Next-Cursor": next_cursor}
+
+
+# Tables that can be exported, and rows fetched per server-side cursor batch
+EXPORT_TABLES = {
+    "attraction_info": models.AttractionInfo,
+    "expense_info": models.ExpenseInfo,
+}
+EXPORT_FETCH_SIZE = 10000
+
+EXPORTED_ROWS = metrics.Counter(
+    "storage_export_rows_total",
+    "Rows streamed by the export endpoint.",
+    ("table",),
+)
+
+
+def gzip_stream(chunks):
+    """Compresses a stream of byte chunks into a gzip stream."""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_default(value):
+    """Encodes the datetimes of exported rows as in the API responses."""
+    return value.isoformat() + "Z"
+
+
+def get_export(table, start_timestamp=None, end_timestamp=None, format="ndjson"):  # pylint: disable=redefined-builtin
+    """Streams the rows of a table, optionally limited to those created in a
+    time range, as gzip compressed NDJSON. The ndjson format has one object
+    per row, the columnar format one object per chunk of rows holding a
+    list of values for each column. Rows are read with a server-side cursor
+    in fixed size batches, so memory use does not grow with the table."""
+    model = EXPORT_TABLES[table]
+    columns = list(model.__table__.columns)
+    names = [column.name for column in columns]
+
+    statement = select(*columns).order_by(model.id)
+    if start_timestamp:
+        statement = statement.where(
+            model.date_created >= to_utc(dt.fromisoformat(start_timestamp))
+        )
+    if end_timestamp:
+        statement = statement.where(
+            model.date_created < to_utc(dt.fromisoformat(end_timestamp))
+        )
+
+    encoder = json.JSONEncoder(separators=(",", ":"), default=export_default)
+    session = db.make_session()
+
+    def generate():
+        try:
+            result = session.execute(
+                statement,
+                execution_options={
+                    "stream_results": True,
+                    "yield_per": EXPORT_FETCH_SIZE,
+                },
+            )
+            for rows in result.partitions():
+                EXPORTED_ROWS.inc(len(rows), table=table)
+                if format == "columnar":
+                    chunk = {"rows": len(rows), "columns": dict(zip(names, zip(*rows)))}
+                    yield (encoder.encode(chunk) + "\n").encode("utf-8")
+                else:
+                    yield "".join(
+                        encoder.encode(dict(zip(names, row))) + "\n" for row in rows
+                    ).encode("utf-8")
+        finally:
+            session.close()
+
+    logger.info(
+        "Exporting %s as %s (start: %s, end: %s)",
+        table,
+        format,
+        start_timestamp,
+        end_timestamp,
+    )
+
+    return Response(
+        gzip_stream(generate()),
+        mimetype="application/octet-stream",
+        headers={"Content-Encoding": "gzip"},
+    )
+
+
+def setup_kafka_thread():
+    """Creates a Kafka consumer thread for each topic."""
+    for topic_name in topics.get_topic_names(app_config["events"]):
+        t1 = Thread(target=process_messages, args=(topic_name,))
+        t1.daemon = True
+        t1.start()
+
+
+app = connexion.FlaskApp(
+    __name__, specification_dir="", middlewares=validation.middlewares()
+)
+app.add_api(
+    "storage.yaml",
+    base_path="/storage",
+    strict_validation=True,
+    validate_responses=True,
+    validator_map=validation.validator_map(app_config.get("validation")),
+)
+app.add_middleware(metrics.MetricsMiddleware, position=MiddlewarePosition.BEFORE_EXCEPTION)
 
 if "CORS_ALLOW_ALL" in os.environ and os.environ["CORS_ALLOW_ALL"] == "yes":
     app.add_middleware(
@@ -0,0 +1,112 @@
+"""
+Benchmark of the logging cost on the storage ingest path. Decodes synthetic
+event messages and writes the per-event log lines of the consumer loop with
+the handlers from the logger config, comparing synchronous handlers, queued
+handlers, and queued handlers with sampled event logging. Reports the
+events per second seen by the consumer thread, and the time for the queue
+listener to drain the remaining records.
+
+Usage: python3 bench_logging.py [--log-config PATH] [--events N]
+    [--sample-rate R]
+"""
+
+import argparse
+import copy
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+
+import yaml
+
+from common import logs
+
+
+def make_messages(count):
+    """Creates encoded expense event messages."""
+    user_id = str(uuid.uuid4())
+    return [
+        json.dumps(
+            {
+                "type": "expense_info",
+                "datetime": "2030-07-08T21:00:49",
+                "ingest_ts": time.time(),
+                "payload": {
+                    "user_id": user_id,
+                    "amount": 55.0,
+                    "expense_category": "Food",
+                    "expense_timestamp": "2030-07-08 21:00:49",
+                    "trace_id": str(uuid.uuid4()),
+                },
+            }
+        ).encode("utf-8")
+        for _ in range(count)
+    ]
+
+
+def bench_config(log_config, log_dir):
+    """Points the file handlers at a scratch directory and the stream
+    handlers at the null device."""
+    log_config = copy.deepcopy(log_config)
+    for name, handler in log_config["handlers"].items():
+        if "filename" in handler:
+            handler["filename"] = os.path.join(log_dir, f"{name}.log")
+        if "stream" in handler:
+            handler["stream"] = open(os.devnull, "w", encoding="utf-8")
+    return log_config
+
+
+def run(name, log_config, messages, settings):
+    """Runs the consumer loop logging and prints the throughput."""
+    logs.configure(log_config, settings)
+    logger = logging.getLogger("basicLogger")
+    event_logger = logs.EventLogger.from_settings(logger, settings)
+
+    start = time.perf_counter()
+    for raw in messages:
+        msg = json.loads(raw.decode("utf-8"))
+        event_logger.debug("Message: %s", msg)
+        event_logger.info(
+            "Expense event with trace id %s stored via Kafka.",
+            msg["payload"]["trace_id"],
+        )
+    elapsed = time.perf_counter() - start
+
+    drain_start = time.perf_counter()
+    logs.shutdown()
+    drain = time.perf_counter() - drain_start
+
+    print(
+        f"{name:<24} {len(messages) / elapsed:>12,.0f} events/s"
+        f" | drain = {drain * 1000:,.0f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--log-config", default="logger/log.prod.yaml")
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument("--sample-rate", type=float, default=0.01)
+    args = parser.parse_args()
+
+    with open(args.log_config, "r", encoding="utf-8") as f:
+        log_config = yaml.safe_load(f.read())
+
+    messages = make_messages(args.events)
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        config = bench_config(log_config, log_dir)
+        run("synchronous handlers", config, messages, {"queue": False})
+        run("queued handlers", config, messages, {"queue": True})
+        run(
+            "queued + sampled",
+            config,
+            messages,
+            {"queue": True, "events": {"sample_rate": args.sample_rate}},
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark of the string and binary UUID layouts. Fills a scratch copy of the
+expense_info table in each layout, then reports the table and index size
+and the latency of point lookups by trace id. The scratch tables are
+dropped afterwards.
+
+Usage: python3 bench_uuid.py [--rows N] [--lookups M]
+"""
+
+import argparse
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime as dt
+
+from sqlalchemy import (
+    BINARY,
+    Column,
+    DateTime,
+    Float,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    select,
+    text,
+)
+
+from db import engine
+
+LAYOUTS = {
+    "string": (String(50), str),
+    "binary": (BINARY(16), lambda value: value.bytes),
+}
+
+
+def make_table(metadata, layout):
+    """Defines a scratch expense table with UUID columns in the layout."""
+    column_type = LAYOUTS[layout][0]
+    return Table(
+        f"bench_uuid_{layout}",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("user_id", column_type, nullable=False),
+        Column("amount", Float, nullable=False),
+        Column("expense_category", String(50), nullable=False),
+        Column("expense_timestamp", DateTime, nullable=False),
+        Column("trace_id", column_type, nullable=False, index=True),
+    )
+
+
+def fill(table, layout, trace_ids, batch_size=5000):
+    """Inserts one row per trace id in batches."""
+    to_db = LAYOUTS[layout][1]
+    now = dt.now()
+    with engine.begin() as conn:
+        for start in range(0, len(trace_ids), batch_size):
+            conn.execute(
+                table.insert(),
+                [
+                    {
+                        "user_id": to_db(uuid.uuid4()),
+                        "amount": 10.0,
+                        "expense_category": "Food",
+                        "expense_timestamp": now,
+                        "trace_id": to_db(trace_id),
+                    }
+                    for trace_id in trace_ids[start : start + batch_size]
+                ],
+            )
+
+
+def table_size(table):
+    """Gets the data and index size of a table in bytes."""
+    with engine.begin() as conn:
+        conn.execute(text(f"ANALYZE TABLE {table.name}"))
+        return conn.execute(
+            text(
+                "SELECT data_length, index_length FROM information_schema.tables"
+                " WHERE table_schema = DATABASE() AND table_name = :name"
+            ),
+            {"name": table.name},
+        ).one()
+
+
+def time_lookups(table, layout, trace_ids):
+    """Times point lookups by trace id, returning latencies in ms."""
+    to_db = LAYOUTS[layout][1]
+    latencies = []
+    with engine.connect() as conn:
+        for trace_id in trace_ids:
+            statement = select(table.c.id).where(table.c.trace_id == to_db(trace_id))
+            start = time.perf_counter()
+            conn.execute(statement).one()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--lookups", type=int, default=5_000)
+    args = parser.parse_args()
+
+    trace_ids = [uuid.uuid4() for _ in range(args.rows)]
+    sample = random.sample(trace_ids, min(args.lookups, args.rows))
+
+    metadata = MetaData()
+    tables = {layout: make_table(metadata, layout) for layout in LAYOUTS}
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+
+    try:
+        for layout, table in tables.items():
+            fill(table, layout, trace_ids)
+            data_length, index_length = table_size(table)
+            latencies = sorted(time_lookups(table, layout, sample))
+            print(
+                f"{layout:<8} data = {data_length / 2**20:8.1f} MiB"
+                f" | index = {index_length / 2**20:8.1f} MiB"
+                f" | lookup p50 = {statistics.median(latencies):.3f} ms"
+                f" | p99 = {latencies[int(len(latencies) * 0.99) - 1]:.3f} ms"
+            )
+    finally:
+        metadata.drop_all(engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+In-memory caches of storage reads. The recent events buffer holds the last
+few minutes of stored events in date_created order, so the range queries
+of the processing poll can be answered without going to the database. The
+user events cache holds the history pages of hot users until the consumer
+stores a new event of theirs. The id digests cache holds the trace ID
+bucket sums of the consistency check digests, so only new rows are hashed.
+"""
+
+import bisect
+import time
+from collections import OrderedDict
+from datetime import datetime as dt, timedelta, timezone
+from threading import Lock
+
+# Resolution of date_created, DATETIME(6)
+RESOLUTION = timedelta(microseconds=1)
+
+
+def utc_now():
+    """Gets the current time as a naive UTC datetime, as stored in the
+    database."""
+    return dt.now(timezone.utc).replace(tzinfo=None)
+
+
+class RecentEvents:
+    """Time-ordered buffer of the events created in the last window.
+
+    The buffer holds every event created at or after covered_from, the
+    start time of the buffer or the point it has evicted events up to.
+    Ranges starting at or after covered_from are answered from the buffer,
+    earlier ranges fall back to the database.
+
+    Parameters:
+    window (float): seconds of events to keep
+    max_events (int): most events to keep, evicting the oldest beyond it
+    """
+
+    def __init__(self, window, max_events):
+        self.window = timedelta(seconds=window)
+        self.max_events = max_events
+        self.lock = Lock()
+        self.times = []
+        self.events = []
+        self.covered_from = utc_now()
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, event):
+        """Adds a stored event, as returned by to_dict."""
+        created = event["date_created"]
+        with self.lock:
+            # Consumer threads can commit events slightly out of order
+            i = bisect.bisect_right(self.times, created)
+            self.times.insert(i, created)
+            self.events.insert(i, event)
+            self.evict(utc_now())
+
+    def evict(self, now):
+        """Drops the events older than the window or beyond the size limit.
+        Called with the lock held."""
+        cutoff = now - self.window
+        if cutoff > self.covered_from:
+            self.covered_from = cutoff
+
+        i = bisect.bisect_left(self.times, self.covered_from)
+        excess = len(self.times) - i - self.max_events
+        if excess > 0:
+            i += excess
+            self.covered_from = self.times[i - 1] + RESOLUTION
+
+        if i:
+            del self.times[:i]
+            del self.events[:i]
+
+    def get(self, start, end):
+        """Gets the events created from start up to end.
+
+        Returns:
+        The events, or None if the buffer does not cover the start.
+        """
+        with self.lock:
+            self.evict(utc_now())
+            if start < self.covered_from:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            lo = bisect.bisect_left(self.times, start)
+            hi = bisect.bisect_left(self.times, end)
+            return self.events[lo:hi]
+
+    def hit_ratio(self):
+        """Gets the share of ranges answered from the buffer, or None
+        before the first range."""
+        with self.lock:
+            total = self.hits + self.misses
+            return self.hits / total if total else None
+
+
+class UserEvents:
+    """LRU cache of the history pages of recently requested users.
+
+    Pages are stored under the user and the page parameters, and all pages
+    of a user are dropped when one of their events is stored. A page read
+    from the database while an event of its user was stored is not cached.
+
+    Parameters:
+    max_users (int): most users to keep pages of
+    max_pages (int): most pages to keep of each user
+    """
+
+    # Longest time a page read can take and still be cached
+    MAX_READ_AGE = 60
+
+    def __init__(self, max_users, max_pages):
+        self.max_users = max_users
+        self.max_pages = max_pages
+        self.lock = Lock()
+        self.pages = OrderedDict()
+        self.sequence = 0
+        # Sequence number and time of the last invalidation of each user
+        self.invalidated = OrderedDict()
+
+    def token(self):
+        """Gets the token to pass to put for a page about to be read."""
+        with self.lock:
+            return self.sequence, time.monotonic()
+
+    def get(self, user_id, key):
+        """Gets a cached page of a user, or None."""
+        with self.lock:
+            user_pages = self.pages.get(user_id)
+            if user_pages is None or key not in user_pages:
+                return None
+            self.pages.move_to_end(user_id)
+            return user_pages[key]
+
+    def put(self, user_id, key, page, token):
+        """Caches a page of a user read since the token was taken."""
+        sequence, started = token
+        with self.lock:
+            now = time.monotonic()
+            if now - started > self.MAX_READ_AGE:
+                return
+            if self.invalidated.get(user_id, (0, 0))[0] > sequence:
+                return
+
+            user_pages = self.pages.setdefault(user_id, {})
+            self.pages.move_to_end(user_id)
+            if len(user_pages) >= self.max_pages:
+                user_pages.pop(next(iter(user_pages)))
+            user_pages[key] = page
+            if len(self.pages) > self.max_users:
+                self.pages.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Drops the pages of a user after one of their events is stored."""
+        with self.lock:
+            now = time.monotonic()
+            self.sequence += 1
+            self.pages.pop(user_id, None)
+            self.invalidated[user_id] = (self.sequence, now)
+            self.invalidated.move_to_end(user_id)
+
+            # Only reads still young enough to be cached need the record
+            while self.invalidated:
+                _, (_, invalidated_at) = next(iter(self.invalidated.items()))
+                if now - invalidated_at <= self.MAX_READ_AGE:
+                    break
+                self.invalidated.popitem(last=False)
+
+
+class IdDigests:
+    """LRU cache of the trace ID bucket sums of a table under a prefix.
+
+    Each entry holds the highest row id it covers and the [count, hash sum]
+    of each child bucket of the prefix over the rows up to that id. A reader
+    only hashes the rows added since, and drops the entry if the rows it
+    covers no longer add up to its count.
+
+    Parameters:
+    max_entries (int): most table and prefix pairs to keep
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.lock = Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        """Gets a copy of the last id and bucket sums cached under a key, or
+        None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            last_id, sums = entry
+            return last_id, {char: list(bucket) for char, bucket in sums.items()}
+
+    def put(self, key, last_id, sums):
+        """Caches the bucket sums of the rows up to the last id."""
+        with self.lock:
+            cached = self.entries.get(key)
+            # A slower reader does not replace a newer entry
+            if cached is not None and cached[0] > last_id:
+                return
+            self.entries[key] = (last_id, sums)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def drop(self, key):
+        """Drops the entry of a key whose rows changed."""
+        with self.lock:
+            self.entries.pop(key, None)
@@ -1,17 +1,75 @@
 import sys
+from sqlalchemy import inspect, text
 from models import Base
 from db import engine
 
+# Conversion of the UUID columns for each uuid_storage layout
+UUID_LAYOUTS = {
+    "binary": ("BINARY(16)", "UUID_TO_BIN({column})"),
+    "string": ("VARCHAR(50)", "BIN_TO_UUID({column})"),
+}
+
 
 def create_tables():
     Base.metadata.create_all(engine)
+    # create_all skips existing tables, so indexes added since are created here
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
 
 
 def drop_tables():
     Base.metadata.drop_all(engine)
 
 
+def migrate_uuids(layout):
+    """Converts the user_id and trace_id columns of existing tables to the
+    given uuid_storage layout. Set datastore.uuid_storage to the same
+    layout before restarting the storage service."""
+    column_type, convert = UUID_LAYOUTS[layout]
+
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if "trace_id" not in table.c:
+                continue
+            name = table.name
+            user_index = f"ix_{name}_user_id_date_created"
+            indexes = {index["name"] for index in inspect(conn).get_indexes(name)}
+            # Dropping user_id would leave its index on date_created only
+            drop_user_index = f" DROP INDEX {user_index}," if user_index in indexes else ""
+            conn.execute(
+                text(
+                    f"ALTER TABLE {name}"
+                    f" ADD COLUMN user_id_new {column_type},"
+                    f" ADD COLUMN trace_id_new {column_type}"
+                )
+            )
+            conn.execute(
+                text(
+                    f"UPDATE {name} SET"
+                    f" user_id_new = {convert.format(column='user_id')},"
+                    f" trace_id_new = {convert.format(column='trace_id')}"
+                )
+            )
+            # Dropping the old columns also drops their indexes
+            conn.execute(
+                text(
+                    f"ALTER TABLE {name}{drop_user_index}"
+                    " DROP COLUMN user_id, DROP COLUMN trace_id,"
+                    f" CHANGE COLUMN user_id_new user_id {column_type} NOT NULL,"
+                    f" CHANGE COLUMN trace_id_new trace_id {column_type} NOT NULL,"
+                    f" ADD INDEX ix_{name}_trace_id (trace_id),"
+                    f" ADD INDEX {user_index} (user_id, date_created)"
+                )
+            )
+            print(f"Migrated {name} to {layout} UUIDs.")
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "migrate":
+        migrate_uuids(sys.argv[2])
+        sys.exit()
+
     if len(sys.argv) > 1 and sys.argv[1] == "drop":
         drop_tables()
 
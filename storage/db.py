@@ -1,20 +1,45 @@
 """Set up SQLAlchemy for mySQL database connection"""
 
+import time
+
 import yaml
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
+from common import metrics
+
 # Load db variables
 with open("config/storage.prod.yaml", "r", encoding="utf-8") as f:
     db_config = yaml.safe_load(f.read())
 
-# Set up an engine
-engine = create_engine(
-    f"mysql://{db_config['datastore']['user']}:{db_config['datastore']['password']}"
-    f"@{db_config['datastore']['hostname']}/{db_config['datastore']['db']}"
+# Set up an engine. datastore.url overrides the MySQL settings, e.g. with
+# a SQLite file for the offline benchmarks.
+if "url" in db_config["datastore"]:
+    engine = create_engine(db_config["datastore"]["url"])
+else:
+    engine = create_engine(
+        f"mysql://{db_config['datastore']['user']}:{db_config['datastore']['password']}"
+        f"@{db_config['datastore']['hostname']}/{db_config['datastore']['db']}"
+    )
+
+QUERY_DURATION = metrics.Histogram(
+    "db_query_duration_seconds",
+    "Duration of database statements by statement type.",
+    ("statement",),
 )
 
 
+@event.listens_for(engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    QUERY_DURATION.observe(elapsed, statement=statement.split(None, 1)[0].upper())
+
+
 # Factory function to get a session bound to the DB engine
 def make_session():
     return sessionmaker(bind=engine)()
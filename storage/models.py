@@ -1,9 +1,42 @@
 """Defines models representing tables in mySQL database"""
 
+import uuid
+
 from sqlalchemy.orm import DeclarativeBase, mapped_column
-from sqlalchemy import Integer, String, DateTime, Float, func
+from sqlalchemy import BigInteger, Index, Integer, String, DateTime, Float, func
+from sqlalchemy.types import BINARY, TypeDecorator
 from sqlalchemy.dialects.mysql import DATETIME
 
+from db import db_config
+
+# "string" keeps UUIDs as text, "binary" packs them into BINARY(16)
+UUID_STORAGE = db_config["datastore"].get("uuid_storage", "string")
+
+
+class UUIDString(TypeDecorator):
+    """UUID column exchanged as a string, stored as BINARY(16) when the
+    uuid_storage option is binary. Binary UUIDs sort in the same order as
+    their strings, so range queries on trace IDs work in either layout.
+    """
+
+    impl = String(50)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if UUID_STORAGE == "binary":
+            return dialect.type_descriptor(BINARY(16))
+        return dialect.type_descriptor(String(50))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or UUID_STORAGE != "binary":
+            return value
+        return uuid.UUID(value).bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None or UUID_STORAGE != "binary":
+            return value
+        return str(uuid.UUID(bytes=value))
+
 
 class Base(DeclarativeBase):
     pass
@@ -15,13 +48,19 @@ class AttractionInfo(Base):
     """
 
     __tablename__ = "attraction_info"
+    # Serves the per-user history in date_created order
+    __table_args__ = (
+        Index("ix_attraction_info_user_id_date_created", "user_id", "date_created"),
+    )
     id = mapped_column(Integer, primary_key=True)
-    user_id = mapped_column(String(50), nullable=False)
+    user_id = mapped_column(UUIDString, nullable=False)
     attraction_category = mapped_column(String(50), nullable=False)
     hours_open = mapped_column(Integer, nullable=False)
     attraction_timestamp = mapped_column(DateTime, nullable=False)
-    date_created = mapped_column(DATETIME(fsp=6), nullable=False, default=func.now(6))
-    trace_id = mapped_column(String(50), nullable=False)
+    date_created = mapped_column(
+        DATETIME(fsp=6), nullable=False, default=func.now(6), index=True
+    )
+    trace_id = mapped_column(UUIDString, nullable=False, index=True)
 
     def to_dict(self):
         dict = {}
@@ -50,13 +89,19 @@ class ExpenseInfo(Base):
     """
 
     __tablename__ = "expense_info"
+    # Serves the per-user history in date_created order
+    __table_args__ = (
+        Index("ix_expense_info_user_id_date_created", "user_id", "date_created"),
+    )
     id = mapped_column(Integer, primary_key=True)
-    user_id = mapped_column(String(50), nullable=False)
+    user_id = mapped_column(UUIDString, nullable=False)
     amount = mapped_column(Float, nullable=False)
     expense_category = mapped_column(String(50), nullable=False)
     expense_timestamp = mapped_column(DateTime, nullable=False)
-    date_created = mapped_column(DATETIME(fsp=6), nullable=False, default=func.now(6))
-    trace_id = mapped_column(String(50), nullable=False)
+    date_created = mapped_column(
+        DATETIME(fsp=6), nullable=False, default=func.now(6), index=True
+    )
+    trace_id = mapped_column(UUIDString, nullable=False, index=True)
 
     def to_dict(self):
         dict = {}
@@ -77,3 +122,17 @@ class ExpenseInfo(Base):
         dict["type"] = "expense_info"
 
         return dict
+
+
+class ReplayCheckpoint(Base):
+    """Table definition for replay_checkpoint. Holds the next offset to
+    replay of each Kafka offset range of a replay, updated in the same
+    transaction as the rows inserted from the range.
+    """
+
+    __tablename__ = "replay_checkpoint"
+    topic = mapped_column(String(250), primary_key=True)
+    partition_id = mapped_column(Integer, primary_key=True)
+    range_start = mapped_column(BigInteger, primary_key=True)
+    range_end = mapped_column(BigInteger, nullable=False)
+    next_offset = mapped_column(BigInteger, nullable=False)
@@ -0,0 +1,291 @@
+"""
+Replay command for storage. Rebuilds the attraction_info and expense_info
+tables from the event topics, e.g. after losing the database or to reload
+it after a schema change.
+
+Each topic is split by partition and offset range across a process pool.
+Workers insert the events of their range in large multi-row inserts, and
+each insert is committed together with the range's checkpoint in
+replay_checkpoint, so an interrupted replay resumes from the last committed
+batch without inserting any event twice. A range whose consumer times out
+before its end is not checkpointed as done. Run the command again to resume
+an interrupted or incomplete replay, or with --restart to discard it and
+plan a new one.
+A new replay appends to the tables unless --truncate empties them first.
+
+Stop the storage service before replaying. The storage consumer group
+offsets are moved to the end of the replayed ranges, so the service
+resumes with the messages produced after the replay started.
+
+Usage: python3 replay.py [--from-offset O] [--workers N] [--chunk-size M]
+    [--batch-size B] [--restart] [--truncate]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime as dt, timezone
+
+import yaml
+from pykafka import KafkaClient
+from sqlalchemy import delete, insert, select, update
+
+import db
+import models
+import create_db
+from common import kafka_ranges, topics
+
+# App Config
+with open("config/storage.prod.yaml", "r", encoding="utf-8") as f:
+    app_config = yaml.safe_load(f.read())
+
+HOST_NAME = f"{app_config['events']['hostname']}:{app_config['events']['port']}"
+
+TABLES = {
+    "attraction_info": models.AttractionInfo.__table__,
+    "expense_info": models.ExpenseInfo.__table__,
+}
+CHECKPOINTS = models.ReplayCheckpoint.__table__
+
+# Kafka client of each worker process
+client = None
+
+
+def init_worker():
+    """Connects each worker process to Kafka once."""
+    global client
+    client = KafkaClient(hosts=HOST_NAME)
+
+
+def to_row(msg):
+    """Converts an event message into a table row. date_created is the time
+    the receiver accepted the event, so replayed rows keep their place in
+    the processing time ranges."""
+    payload = msg["payload"]
+    if "ingest_ts" in msg:
+        created = dt.fromtimestamp(msg["ingest_ts"], timezone.utc).replace(tzinfo=None)
+    else:
+        created = dt.strptime(msg["datetime"], "%Y-%m-%dT%H:%M:%S")
+
+    row = {
+        "user_id": payload["user_id"],
+        "trace_id": payload["trace_id"],
+        "date_created": created,
+    }
+    if msg["type"] == "attraction_info":
+        row["attraction_category"] = payload["attraction_category"]
+        row["hours_open"] = payload["hours_open"]
+        row["attraction_timestamp"] = dt.strptime(
+            payload["attraction_timestamp"], "%Y-%m-%d %H:%M:%S"
+        )
+    else:
+        row["amount"] = payload["amount"]
+        row["expense_category"] = payload["expense_category"]
+        row["expense_timestamp"] = dt.strptime(
+            payload["expense_timestamp"], "%Y-%m-%d %H:%M:%S"
+        )
+
+    return row
+
+
+def write_batch(checkpoint, rows, next_offset):
+    """Inserts a batch of rows and advances the range checkpoint in one
+    transaction."""
+    with db.engine.begin() as conn:
+        for event_type, table_rows in rows.items():
+            if table_rows:
+                conn.execute(insert(TABLES[event_type]), table_rows)
+        conn.execute(
+            update(CHECKPOINTS)
+            .where(CHECKPOINTS.c.topic == checkpoint["topic"])
+            .where(CHECKPOINTS.c.partition_id == checkpoint["partition_id"])
+            .where(CHECKPOINTS.c.range_start == checkpoint["range_start"])
+            .values(next_offset=next_offset)
+        )
+
+
+def replay_range(checkpoint, batch_size):
+    """Replays the messages of one offset range from its checkpoint.
+
+    Parameters:
+    checkpoint (dict): replay_checkpoint row of the range
+    batch_size (int): rows per committed insert
+
+    Returns:
+    A tuple with the checkpoint and the number of events inserted.
+    """
+    topic = client.topics[str.encode(checkpoint["topic"])]
+    rows = {event_type: [] for event_type in TABLES}
+    pending = 0
+    events = 0
+
+    for msg in kafka_ranges.read_range(
+        topic,
+        checkpoint["partition_id"],
+        checkpoint["next_offset"],
+        checkpoint["range_end"],
+    ):
+        event = json.loads(msg.value.decode("utf-8"))
+        if event["type"] in rows:
+            rows[event["type"]].append(to_row(event))
+            pending += 1
+
+        if pending >= batch_size:
+            write_batch(checkpoint, rows, msg.offset + 1)
+            events += pending
+            rows = {event_type: [] for event_type in TABLES}
+            pending = 0
+
+    # Only reached once the range was read to its end, read_range raises
+    # if it timed out before
+    write_batch(checkpoint, rows, checkpoint["range_end"])
+    events += pending
+
+    return checkpoint, events
+
+
+def plan_replay(kafka_client, from_offset, chunk_size):
+    """Splits the topics into offset ranges from an offset and saves a
+    checkpoint for each range."""
+    checkpoints = []
+    for topic_name in topics.get_topic_names(app_config["events"]):
+        topic = kafka_client.topics[str.encode(topic_name)]
+        start_offsets = None
+        if from_offset is not None:
+            start_offsets = {partition_id: from_offset for partition_id in topic.partitions}
+        for partition_id, start, end in kafka_ranges.get_offset_ranges(
+            topic, chunk_size, start_offsets
+        ):
+            checkpoints.append(
+                {
+                    "topic": topic_name,
+                    "partition_id": partition_id,
+                    "range_start": start,
+                    "range_end": end,
+                    "next_offset": start,
+                }
+            )
+
+    with db.engine.begin() as conn:
+        if checkpoints:
+            conn.execute(insert(CHECKPOINTS), checkpoints)
+
+    return checkpoints
+
+
+def load_checkpoints():
+    """Gets the checkpoints of the current replay."""
+    with db.engine.connect() as conn:
+        return [
+            dict(row._mapping)
+            for row in conn.execute(
+                select(CHECKPOINTS).order_by(
+                    CHECKPOINTS.c.topic,
+                    CHECKPOINTS.c.partition_id,
+                    CHECKPOINTS.c.range_start,
+                )
+            )
+        ]
+
+
+def get_end_offsets(checkpoints):
+    """Gets the end offset of the replayed ranges of each topic partition."""
+    end_offsets = {}
+    for checkpoint in checkpoints:
+        partition_ends = end_offsets.setdefault(checkpoint["topic"], {})
+        partition_ends[checkpoint["partition_id"]] = max(
+            partition_ends.get(checkpoint["partition_id"], 0), checkpoint["range_end"]
+        )
+
+    return end_offsets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays the event topics into storage.")
+    parser.add_argument("--from-offset", type=int, help="first offset of each partition")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=5_000)
+    parser.add_argument(
+        "--restart", action="store_true", help="discard the checkpoints of the last replay"
+    )
+    parser.add_argument(
+        "--truncate", action="store_true", help="empty the event tables first"
+    )
+    args = parser.parse_args()
+
+    create_db.create_tables()
+    kafka_client = KafkaClient(hosts=HOST_NAME)
+
+    with db.engine.begin() as conn:
+        if args.restart or args.truncate:
+            conn.execute(delete(CHECKPOINTS))
+        if args.truncate:
+            for table in TABLES.values():
+                conn.execute(delete(table))
+
+    checkpoints = load_checkpoints()
+    if checkpoints:
+        print(f"Resuming the replay of {len(checkpoints)} ranges.")
+    else:
+        checkpoints = plan_replay(kafka_client, args.from_offset, args.chunk_size)
+
+    tasks = [c for c in checkpoints if c["next_offset"] < c["range_end"]]
+    print(f"Replaying {len(tasks)} ranges with {args.workers} workers.")
+
+    start_time = time.time()
+    total_events = 0
+    failed = 0
+
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+    ) as pool:
+        futures = [pool.submit(replay_range, task, args.batch_size) for task in tasks]
+
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                checkpoint, events = future.result()
+            except TimeoutError as e:
+                failed += 1
+                print(f"[{done}/{len(tasks)}] {e}, resumed by the next run")
+                continue
+            total_events += events
+
+            elapsed = time.time() - start_time
+            print(
+                f"[{done}/{len(tasks)}] {checkpoint['topic']}"
+                f" partition {checkpoint['partition_id']}"
+                f" offsets {checkpoint['next_offset']}-{checkpoint['range_end']}"
+                f" | events = {events}"
+                f" | {total_events / max(elapsed, 1e-9):,.0f} events/s"
+            )
+
+    if failed:
+        sys.exit(
+            f"{failed} ranges were not read to their end, run the replay again"
+            " to resume them."
+        )
+
+    kafka_ranges.commit_group_offsets(
+        kafka_client, b"event_group", get_end_offsets(checkpoints)
+    )
+    # The replay is complete, the next one is planned from scratch
+    with db.engine.begin() as conn:
+        conn.execute(delete(CHECKPOINTS))
+
+    elapsed = time.time() - start_time
+    print(
+        f"Replay completed | processing_time_ms={round(elapsed * 1000)}"
+        f" | events = {total_events}"
+        f" | {total_events / max(elapsed, 1e-9):,.0f} events/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
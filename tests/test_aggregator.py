@@ -0,0 +1,86 @@
+"""Tests of the snapshot stream of the aggregator."""
+
+import asyncio
+import importlib.util
+import json
+import os
+import shutil
+import sys
+
+import pytest
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(name="aggregator", scope="module")
+def fixture_aggregator(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("aggregator")
+    for sub in ("config", "logger", "logs"):
+        os.makedirs(workdir / sub)
+    with open(
+        os.path.join(ROOT, "config/aggregator/aggregator.dev.yaml"), encoding="utf-8"
+    ) as f:
+        config = yaml.safe_load(f.read())
+    with open(workdir / "config/aggregator.prod.yaml", "w", encoding="utf-8") as f:
+        yaml.safe_dump(config, f)
+    shutil.copy(
+        os.path.join(ROOT, "config/logger/log.dev.yaml"), workdir / "logger/log.prod.yaml"
+    )
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        spec = importlib.util.spec_from_file_location(
+            "aggregator_app", os.path.join(ROOT, "aggregator", "app.py")
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["aggregator_app"] = module
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+    return module
+
+
+def updated_of(event):
+    data = event.decode("utf-8").split("data: ", 1)[1]
+    return json.loads(data)["updated"]
+
+
+def test_snapshot_published_during_a_send_is_not_missed(aggregator):
+    async def run():
+        stream = aggregator.stream_snapshots()
+        try:
+            assert (await stream.__anext__()).startswith(b"retry:")
+            aggregator.publish({"updated": "1"})
+            assert updated_of(await stream.__anext__()) == "1"
+
+            # Published while the stream is suspended at its last yield
+            aggregator.publish({"updated": "2"})
+            aggregator.publish({"updated": "3"})
+            assert updated_of(await asyncio.wait_for(stream.__anext__(), 1)) == "3"
+
+            # Nothing new, so the stream waits for the next snapshot
+            next_event = asyncio.ensure_future(stream.__anext__())
+            await asyncio.sleep(0.05)
+            assert not next_event.done()
+            aggregator.publish({"updated": "4"})
+            assert updated_of(await asyncio.wait_for(next_event, 1)) == "4"
+        finally:
+            await stream.aclose()
+
+    asyncio.run(run())
+
+
+def test_stream_starts_with_the_latest_snapshot(aggregator):
+    async def run():
+        aggregator.publish({"updated": "5"})
+        stream = aggregator.stream_snapshots()
+        try:
+            await stream.__anext__()
+            assert updated_of(await asyncio.wait_for(stream.__anext__(), 1)) == "5"
+        finally:
+            await stream.aclose()
+
+    asyncio.run(run())
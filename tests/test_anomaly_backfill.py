@@ -0,0 +1,88 @@
+"""Tests of the anomaly backfill, run in-process on the in-memory Kafka
+stand-in with a thread pool in place of the process pool."""
+
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import fake_kafka  # noqa: E402  pylint: disable=wrong-import-position
+import run_pipeline  # noqa: E402  pylint: disable=wrong-import-position
+
+TOPICS = {"attraction_info": "backfill_attractions", "expense_info": "backfill_expenses"}
+
+
+@pytest.fixture(name="backfill")
+def fixture_backfill(tmp_path, monkeypatch):
+    run_pipeline.prepare_workdir(str(tmp_path))
+    monkeypatch.chdir(tmp_path / "anomaly")
+    monkeypatch.syspath_prepend(os.path.join(ROOT, "anomaly_detector"))
+    sys.modules.pop("backfill", None)
+    import backfill  # pylint: disable=import-outside-toplevel
+
+    backfill.app_config["events"]["topics"] = TOPICS
+    monkeypatch.setattr(backfill, "KafkaClient", fake_kafka.KafkaClient)
+    monkeypatch.setattr(
+        backfill,
+        "ProcessPoolExecutor",
+        lambda max_workers, mp_context, initializer: ThreadPoolExecutor(
+            max_workers, initializer=initializer
+        ),
+    )
+    return backfill
+
+
+def produce(event_type, payloads):
+    topic = fake_kafka.KafkaClient.topics[str.encode(TOPICS[event_type])]
+    for payload in payloads:
+        msg = {"type": event_type, "ingest_ts": time.time(), "payload": payload}
+        topic.append(json.dumps(msg).encode("utf-8"))
+
+
+def make_payload(i, **fields):
+    return dict(
+        fields,
+        user_id=f"00000000-0000-0000-0000-{i:012d}",
+        trace_id=f"00000000-0000-0000-0001-{i:012d}",
+    )
+
+
+def test_backfill_from_offset_zero(backfill, monkeypatch):
+    # Every third event is out of its bounds, including the one at offset 0
+    produce(
+        "expense_info",
+        [
+            make_payload(i, amount=50 if i % 3 == 0 else 10, expense_category="Food")
+            for i in range(20)
+        ],
+    )
+    produce(
+        "attraction_info",
+        [
+            make_payload(i, hours_open=1 if i % 3 == 0 else 8, attraction_category="Zoo")
+            for i in range(10)
+        ],
+    )
+
+    monkeypatch.setattr(
+        sys, "argv", ["backfill.py", "--workers", "2", "--chunk-size", "6"]
+    )
+    backfill.main()
+
+    store = backfill.AnomalyStore(backfill.app_config["datastore"]["filepath"])
+    anomalies, _ = store.page(limit=100)
+    assert store.count() == 7 + 4
+    expenses = [a["trace_id"][-2:] for a in anomalies if a["event_type"] == "expense_info"]
+    assert sorted(expenses) == ["00", "03", "06", "09", "12", "15", "18"]
+
+    committed = fake_kafka.broker.committed[str.encode("anomaly_group")]
+    assert {name: committed[str.encode(name)] for name in TOPICS.values()} == {
+        "backfill_attractions": 10,
+        "backfill_expenses": 20,
+    }
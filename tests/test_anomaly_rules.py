@@ -0,0 +1,165 @@
+"""Tests of the anomaly rule engine."""
+
+import copy
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "anomaly_detector")
+)
+
+import rules  # noqa: E402  pylint: disable=wrong-import-position
+
+
+def make_msg(event_type, **payload):
+    payload.setdefault("user_id", "user")
+    payload.setdefault("trace_id", "trace")
+    return {"type": event_type, "payload": payload}
+
+
+def steady_values(count, mean=10.0, spread=1.0, seed=3):
+    generator = random.Random(seed)
+    return [mean + generator.uniform(-spread, spread) for _ in range(count)]
+
+
+@pytest.mark.parametrize(
+    "detector",
+    [
+        rules.EwmaDetector(alpha=0.1, threshold=4, warmup=30),
+        rules.RollingZScoreDetector(window=50, threshold=4, warmup=30),
+    ],
+)
+def test_detector_quiet_on_steady_values_and_fires_on_a_spike(detector):
+    scores = [detector.update(value) for value in steady_values(200)]
+
+    assert scores[:29] == [None] * 29
+    assert all(abs(score) <= 4 for score in scores[30:])
+    # A spike inflates the variance, so each direction is scored from the
+    # same steady state
+    assert copy.deepcopy(detector).update(30.0) > 4
+    assert copy.deepcopy(detector).update(-10.0) < -4
+
+
+def test_zscore_matches_the_window_statistics():
+    detector = rules.RollingZScoreDetector(window=4, threshold=3, warmup=2)
+    for value in (1, 2, 3, 4, 100, 5, 6, 7):
+        detector.update(value)
+
+    # Window holds 100, 5, 6, 7 only
+    values = [100, 5, 6, 7]
+    mean = sum(values) / 4
+    std = (sum((v - mean) ** 2 for v in values) / 4) ** 0.5
+    assert detector.update(8) == pytest.approx((8 - mean) / std)
+
+
+def test_constant_values_have_no_score():
+    detector = rules.RollingZScoreDetector(window=10, threshold=3, warmup=2)
+    assert [detector.update(5) for _ in range(20)] == [None] * 20
+
+
+def test_thresholds_with_category_overrides():
+    compiled = rules.compile_rules(
+        {
+            "attraction_info": {
+                "field": "hours_open",
+                "category_field": "attraction_category",
+                "min": 4,
+                "categories": {"Park": {"min": 2}},
+            },
+            "expense_info": {"field": "amount", "max": 20},
+        }
+    )
+
+    def check(event_type, **payload):
+        return rules.find_anomaly(compiled, make_msg(event_type, **payload))
+
+    assert check("attraction_info", hours_open=3, attraction_category="Zoo") == {
+        "user_id": "user",
+        "trace_id": "trace",
+        "event_type": "attraction_info",
+        "anomaly_type": "Too Low",
+        "description": "Detected: 3; too low (threshold 4)",
+    }
+    assert check("attraction_info", hours_open=3, attraction_category="Park") is None
+    assert check("attraction_info", hours_open=1, attraction_category="Park")[
+        "description"
+    ] == "Detected: 1; too low (threshold 2)"
+    assert check("expense_info", amount=20) is None
+    assert check("expense_info", amount=25.5)["anomaly_type"] == "Too High"
+
+
+def test_statistical_baselines_are_kept_per_category():
+    evaluate = rules.compile_rule(
+        {
+            "field": "amount",
+            "category_field": "expense_category",
+            "max": 1000,
+            "statistical": [{"type": "zscore", "window": 100, "threshold": 4, "warmup": 30}],
+        }
+    )
+    for food, lodging in zip(steady_values(100, 10), steady_values(100, 300, 20, seed=4)):
+        assert evaluate({"amount": food, "expense_category": "Food"}) is None
+        assert evaluate({"amount": lodging, "expense_category": "Lodging"}) is None
+
+    # Normal for lodging, far above the food baseline
+    anomaly_type, description = evaluate({"amount": 300, "expense_category": "Food"})
+    assert anomaly_type == "Too High"
+    assert description.endswith("standard deviations above the zscore mean")
+    assert evaluate({"amount": 300, "expense_category": "Lodging"}) is None
+
+
+def test_threshold_breaches_stay_out_of_the_baseline():
+    evaluate = rules.compile_rule(
+        {
+            "field": "amount",
+            "max": 50,
+            "statistical": [{"type": "ewma", "alpha": 0.1, "threshold": 4, "warmup": 30}],
+        }
+    )
+    for value in steady_values(100):
+        evaluate({"amount": value})
+    for _ in range(100):
+        assert evaluate({"amount": 1000})[1].endswith("too high (threshold 50)")
+
+    assert evaluate({"amount": 10.0}) is None
+
+
+def test_load_rules_uses_the_environment_defaults(monkeypatch):
+    monkeypatch.setenv("MIN_HOURS", "5")
+    monkeypatch.setenv("MAX_PRICE", "100")
+    compiled = rules.load_rules({})
+
+    assert compiled["attraction_info"]({"hours_open": 4})[0] == "Too Low"
+    assert compiled["expense_info"]({"amount": 101})[0] == "Too High"
+    assert compiled["expense_info"]({"amount": 99}) is None
+
+
+@pytest.mark.parametrize(
+    "rule, message",
+    [
+        ({"min": 1}, "no field"),
+        ({"field": "amount", "min": 10, "max": 5}, "above its max"),
+        (
+            {"field": "amount", "categories": {"Food": {"min": 30}}, "max": 20},
+            "above its max",
+        ),
+        ({"field": "amount", "statistical": [{"type": "median", "threshold": 3}]}, "Unknown"),
+        ({"field": "amount", "statistical": [{"type": "ewma"}]}, "no threshold"),
+        (
+            {"field": "amount", "statistical": [{"type": "ewma", "alpha": 0, "threshold": 3}]},
+            "alpha",
+        ),
+        (
+            {"field": "amount", "statistical": [{"type": "zscore", "window": 1, "threshold": 3}]},
+            "window",
+        ),
+    ],
+)
+def test_load_rules_rejects_invalid_configs(rule, message):
+    with pytest.raises(ValueError, match=message) as error:
+        rules.load_rules({"expense_info": rule})
+
+    assert "Invalid rule for expense_info" in str(error.value)
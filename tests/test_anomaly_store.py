@@ -0,0 +1,85 @@
+"""Tests of the anomaly datastore."""
+
+import os
+import sys
+import threading
+import time
+from datetime import datetime as dt, timedelta, timezone
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "anomaly_detector")
+)
+
+from store import AnomalyStore  # noqa: E402  pylint: disable=wrong-import-position
+
+START = dt(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def make_anomaly(index, detected_at=None):
+    anomaly = {
+        "user_id": f"user-{index}",
+        "trace_id": f"trace-{index}",
+        "event_type": "expense_info",
+        "anomaly_type": "Too High",
+        "description": f"anomaly {index}",
+    }
+    if detected_at is not None:
+        anomaly["detected_at"] = detected_at
+    return anomaly
+
+
+def test_replace_all_keeps_detection_times(tmp_path):
+    store = AnomalyStore(str(tmp_path / "anomalies.sqlite"))
+    store.replace_all(
+        [make_anomaly(i, START + timedelta(hours=i)) for i in range(10)]
+    )
+
+    anomalies, _ = store.page(since=START + timedelta(hours=7))
+    assert [a["trace_id"] for a in anomalies] == ["trace-7", "trace-8", "trace-9"]
+    anomalies, _ = store.page(since=START + timedelta(hours=10))
+    assert anomalies == []
+
+
+def test_append_stamps_current_time(tmp_path):
+    store = AnomalyStore(str(tmp_path / "anomalies.sqlite"))
+    store.replace_all([make_anomaly(0, START)])
+    before = dt.now(timezone.utc)
+    store.append([make_anomaly(1)])
+
+    anomalies, _ = store.page(since=before)
+    assert [a["trace_id"] for a in anomalies] == ["trace-1"]
+    assert store.count() == 2
+
+
+def test_append_stamps_after_taking_the_lock(tmp_path):
+    store = AnomalyStore(str(tmp_path / "anomalies.sqlite"))
+
+    # An append waiting for the lock must not keep a time from before it,
+    # or a later id could be stamped earlier than the one before it
+    with store.lock:
+        appender = threading.Thread(target=store.append, args=([make_anomaly(0)],))
+        appender.start()
+        time.sleep(0.05)
+        released = dt.now(timezone.utc)
+    appender.join()
+
+    anomalies, _ = store.page(since=released)
+    assert [a["trace_id"] for a in anomalies] == ["trace-0"]
+
+
+def test_concurrent_appends_keep_detection_order(tmp_path):
+    store = AnomalyStore(str(tmp_path / "anomalies.sqlite"))
+
+    def append_many(worker):
+        for i in range(50):
+            store.append([make_anomaly(worker * 100 + i)])
+
+    workers = [threading.Thread(target=append_many, args=(w,)) for w in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    rows = store.conn.execute("SELECT detected_at FROM anomalies ORDER BY id").fetchall()
+    assert len(rows) == 200
+    assert rows == sorted(rows)
@@ -0,0 +1,214 @@
+"""Tests of the id comparisons of the consistency check, with the event
+stores stood in for by functions and an httpx mock transport."""
+
+import asyncio
+import gzip
+import importlib.util
+import os
+import shutil
+import sys
+import uuid
+from datetime import datetime as dt, timedelta
+
+import httpx
+import pytest
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from common import idstream, merkle  # noqa: E402  pylint: disable=wrong-import-position
+
+
+@pytest.fixture(name="check", scope="module")
+def fixture_check(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("check")
+    for sub in ("config", "logger", "logs", "data"):
+        os.makedirs(workdir / sub)
+    with open(os.path.join(ROOT, "config/check/check.dev.yaml"), encoding="utf-8") as f:
+        config = yaml.safe_load(f.read())
+    with open(workdir / "config/check.prod.yaml", "w", encoding="utf-8") as f:
+        yaml.safe_dump(config, f)
+    shutil.copy(
+        os.path.join(ROOT, "config/logger/log.dev.yaml"), workdir / "logger/log.prod.yaml"
+    )
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        spec = importlib.util.spec_from_file_location(
+            "check_app", os.path.join(ROOT, "consistency_check", "app.py")
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["check_app"] = module
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+    return module
+
+
+def make_record(index):
+    return idstream.encode_record(
+        str(uuid.UUID(int=index << 64)), str(uuid.UUID(int=1)), "expense_info"
+    )
+
+
+def streams_of(records):
+    """Makes the stream function of compare_streams from the records of
+    each event store."""
+
+    def stream(name):
+        async def generate():
+            for record in records[name]:
+                yield record
+
+        return generate()
+
+    return stream
+
+
+def compare(check, analyzer, storage):
+    missing_in_db, missing_in_queue = asyncio.run(
+        check.compare_streams(
+            streams_of(
+                {
+                    "analyzer_stream": [make_record(i) for i in analyzer],
+                    "storage_stream": [make_record(i) for i in storage],
+                }
+            )
+        )
+    )
+    index = lambda entry: uuid.UUID(entry["trace_id"]).int >> 64  # noqa: E731
+    return [index(e) for e in missing_in_db], [index(e) for e in missing_in_queue]
+
+
+def test_streams_with_interleaved_gaps(check):
+    assert compare(check, [1, 2, 4, 5, 7, 9], [2, 3, 4, 6, 7, 8]) == ([1, 5, 9], [3, 6, 8])
+
+
+def test_streams_match_with_duplicates(check):
+    assert compare(check, [1, 1, 2, 3], [1, 2, 2, 3]) == ([], [])
+
+
+def test_one_empty_stream(check):
+    assert compare(check, [], [1, 2]) == ([], [1, 2])
+    assert compare(check, [1, 2], []) == ([1, 2], [])
+    assert compare(check, [], []) == ([], [])
+
+
+def test_truncated_stream_fails_the_check(check, monkeypatch):
+    records = {
+        "analyzer_stream": b"".join(make_record(i) for i in range(3)),
+        # Cut in the middle of the last record
+        "storage_stream": b"".join(make_record(i) for i in range(3))[:-5],
+    }
+    urls = {
+        check.app_config["eventstores"][name]["url"]: name for name in records
+    }
+
+    def handler(request):
+        name = urls[str(request.url)]
+        return httpx.Response(
+            200,
+            content=gzip.compress(records[name]),
+            headers={"Content-Encoding": "gzip"},
+        )
+
+    async def run():
+        sources = {}
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            result = await check.compare_streams(
+                lambda name: check.stream_records(client, sources, name)
+            )
+        return result, sources
+
+    result, sources = asyncio.run(run())
+    assert result == (None, None)
+    assert sources["storage_stream"]["errors"] == 1
+
+
+def test_digest_walk_pins_the_analyzer_generation(check):
+    trace_ids = [str(uuid.UUID(int=i << 100)) for i in range(1, 40)]
+    stored = trace_ids[:-1]
+    # Produced after the walk started, in a new generation of the index
+    produced = str(uuid.UUID(int=(7 << 124) + 1))
+    make_index = lambda ids: merkle.MerkleIndex(  # noqa: E731
+        {"user_id": "u", "trace_id": trace_id} for trace_id in ids
+    )
+    indexes = {1: make_index(trace_ids)}
+    analyzer_calls = []
+
+    async def fetch(name, params):
+        source, kind = name.split("_")
+        prefix = params["prefix"]
+        if source == "analyzer":
+            analyzer_calls.append(params)
+            generation = params.get("generation", max(indexes))
+            index = indexes[generation]
+            if generation == 1 and 2 not in indexes:
+                # The next event is produced right after the root digest
+                indexes[2] = make_index(trace_ids + [produced])
+            if kind == "digest":
+                return {"generation": generation, "buckets": index.children(prefix)}
+            return index.bucket(prefix)
+
+        ids = [trace_id for trace_id in stored if trace_id.startswith(prefix)]
+        if kind == "digest":
+            return {"buckets": merkle.digest_children(ids, prefix)}
+        return [{"user_id": "u", "trace_id": trace_id} for trace_id in ids]
+
+    missing_in_db, missing_in_queue = asyncio.run(check.compare_digests(fetch))
+
+    assert [entry["trace_id"] for entry in missing_in_db] == [trace_ids[-1]]
+    assert missing_in_queue == []
+    assert analyzer_calls[0] == {"prefix": ""}
+    assert all(params["generation"] == 1 for params in analyzer_calls[1:])
+
+
+def test_since_window_bounds_both_sides(check):
+    since = dt(2026, 1, 1, 12, 0, 0)
+    until = since + timedelta(minutes=5)
+    slack = timedelta(seconds=30)
+    second = timedelta(seconds=1)
+    # Trace index, received time and stored time of each event
+    events = [
+        (1, since - 2 * second, since + second),  # straddles the start
+        (2, since + second, since + 2 * second),
+        (3, since + 3 * second, None),  # lost before storage
+        (4, until + second, None),  # received after the window
+        (5, None, since + 4 * second),  # stored without being queued
+        (6, until - second, until + second),  # straddles the end
+        (7, since - 2 * slack, since - slack),  # checked by an earlier run
+    ]
+
+    def entry(index, **times):
+        entry = {"user_id": "u", "trace_id": str(uuid.UUID(int=index << 64))}
+        entry.update(
+            {key: value.isoformat(timespec="microseconds") for key, value in times.items()}
+        )
+        return entry
+
+    async def fetch(name, params):
+        start = dt.fromisoformat(params["since"].rstrip("Z"))
+        if name == "analyzer_ids":
+            end = dt.fromisoformat(params["until"].rstrip("Z"))
+            return [
+                entry(index, datetime=received)
+                for index, received, _ in events
+                if received is not None and start <= received < end
+            ]
+        if name == "storage_attr_ids":
+            return [
+                entry(index, date_created=stored)
+                for index, _, stored in events
+                if stored is not None and stored >= start
+            ]
+        return []
+
+    missing_in_db, missing_in_queue = asyncio.run(
+        check.compare_since(fetch, since, until, slack)
+    )
+
+    index = lambda entry: uuid.UUID(entry["trace_id"]).int >> 64  # noqa: E731
+    assert [index(e) for e in missing_in_db] == [3]
+    assert [index(e) for e in missing_in_queue] == [5]
@@ -0,0 +1,63 @@
+"""Tests of the binary id stream records and their external sort."""
+
+import gzip
+import os
+import random
+import sys
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import idstream  # noqa: E402  pylint: disable=wrong-import-position
+
+
+def make_records(count, seed=0):
+    rng = random.Random(seed)
+    return [
+        idstream.encode_record(
+            str(uuid.UUID(int=rng.getrandbits(128))),
+            str(uuid.UUID(int=rng.getrandbits(128))),
+            rng.choice(idstream.EVENT_TYPES),
+        )
+        for _ in range(count)
+    ]
+
+
+def test_record_round_trip():
+    trace_id, user_id = str(uuid.uuid4()), str(uuid.uuid4())
+    record = idstream.encode_record(trace_id, user_id, "expense_info")
+    assert len(record) == idstream.RECORD_SIZE
+    assert idstream.decode_record(record) == {
+        "user_id": user_id,
+        "trace_id": trace_id,
+        "type": "expense_info",
+    }
+
+
+def test_records_sort_like_trace_id_strings():
+    records = make_records(200)
+    by_record = [idstream.decode_record(r)["trace_id"] for r in sorted(records)]
+    assert by_record == sorted(by_record)
+
+
+def test_gzip_chunks_decompress_to_the_records(monkeypatch):
+    monkeypatch.setattr(idstream, "CHUNK_RECORDS", 16)
+    records = make_records(100)
+    assert gzip.decompress(b"".join(idstream.gzip_chunks(iter(records)))) == b"".join(
+        records
+    )
+    assert gzip.decompress(b"".join(idstream.gzip_chunks(iter([])))) == b""
+
+
+def test_sort_records_in_memory():
+    records = make_records(50)
+    assert list(idstream.sort_records(iter(records), run_records=100)) == sorted(records)
+    assert not list(idstream.sort_records(iter([])))
+
+
+def test_sort_records_merges_spilled_runs():
+    records = make_records(1000, seed=1)
+    # Duplicates land in different runs
+    records += records[:10]
+    for run_records in (7, 100, 1010):
+        assert list(idstream.sort_records(iter(records), run_records)) == sorted(records)
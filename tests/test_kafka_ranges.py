@@ -0,0 +1,64 @@
+"""Tests of the offset range reads, on the in-memory Kafka stand-in."""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import fake_kafka  # noqa: E402  pylint: disable=wrong-import-position
+from common import kafka_ranges  # noqa: E402  pylint: disable=wrong-import-position
+
+
+@pytest.fixture(name="topic")
+def fixture_topic(request):
+    topic = fake_kafka.KafkaClient.topics[str.encode(request.node.name)]
+    for i in range(10):
+        topic.append(str(i).encode("utf-8"))
+    return topic
+
+
+def read_offsets(topic, start, end):
+    return [
+        msg.offset
+        for msg in kafka_ranges.read_range(topic, 0, start, end, consumer_timeout_ms=10)
+    ]
+
+
+def test_ranges_cover_the_partition(topic):
+    assert kafka_ranges.get_offset_ranges(topic, 4) == [(0, 0, 4), (0, 4, 8), (0, 8, 10)]
+    assert kafka_ranges.get_offset_ranges(topic, 4, {0: 6}) == [(0, 6, 10)]
+
+
+def test_read_range_from_offset_zero(topic):
+    assert read_offsets(topic, 0, 4) == [0, 1, 2, 3]
+
+
+def test_read_range_within_and_to_the_end(topic):
+    assert read_offsets(topic, 4, 8) == [4, 5, 6, 7]
+    assert read_offsets(topic, 8, 10) == [8, 9]
+    assert read_offsets(topic, 5, 5) == []
+
+
+def test_ranges_read_every_message_once(topic):
+    offsets = [
+        offset
+        for _, start, end in kafka_ranges.get_offset_ranges(topic, 3)
+        for offset in read_offsets(topic, start, end)
+    ]
+    assert offsets == list(range(10))
+
+
+def test_read_range_raises_if_the_end_is_not_reached(topic):
+    with pytest.raises(TimeoutError):
+        read_offsets(topic, 6, 12)
+
+
+def test_commit_resumes_after_the_range(topic):
+    kafka_ranges.commit_group_offsets(
+        fake_kafka.KafkaClient(), b"group", {topic.name.decode(): {0: 4}}
+    )
+    consumer = topic.get_simple_consumer(consumer_group=b"group")
+    assert consumer.consume().offset == 4
@@ -0,0 +1,96 @@
+"""Tests of the Merkle digests of trace IDs."""
+
+import os
+import random
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import merkle  # noqa: E402  pylint: disable=wrong-import-position
+
+random.seed(7)
+TRACE_IDS = [str(uuid.UUID(int=random.getrandbits(128))) for _ in range(2000)]
+ENTRIES = [{"user_id": "u", "trace_id": trace_id} for trace_id in TRACE_IDS]
+
+
+def starting_with(prefix):
+    return [trace_id for trace_id in TRACE_IDS if trace_id.startswith(prefix)]
+
+
+@pytest.mark.parametrize("prefix", ["", "0", "f", "a3", "ff", "0123abcd"])
+def test_prefix_bounds(prefix):
+    lower, upper = merkle.prefix_bounds(prefix)
+    for trace_id in TRACE_IDS + [lower or "", upper or ""]:
+        if not trace_id:
+            continue
+        inside = (lower is None or trace_id >= lower) and (
+            upper is None or trace_id < upper
+        )
+        assert inside == trace_id.startswith(prefix)
+
+
+def test_prefix_bounds_of_the_last_bucket_are_unbounded_above():
+    assert merkle.prefix_bounds("") == (None, None)
+    assert merkle.prefix_bounds("ff")[1] is None
+
+
+@pytest.mark.parametrize("prefix", ["", "7", "c4"])
+def test_digest_children_matches_the_index(prefix):
+    index = merkle.MerkleIndex(random.sample(ENTRIES, len(ENTRIES)))
+
+    digests = merkle.digest_children(starting_with(prefix), prefix)
+
+    assert digests == index.children(prefix)
+    assert sorted(digests) == sorted({t[len(prefix)] for t in starting_with(prefix)})
+
+
+def test_parent_digest_is_the_sum_of_its_children():
+    parent = merkle.digest_children(TRACE_IDS, "")["5"]
+    count, total = 0, 0
+    for digest in merkle.digest_children(starting_with("5"), "5").values():
+        child_count, child_total = digest.split(":")
+        count += int(child_count)
+        total += int(child_total, 16)
+
+    assert parent == merkle.format_digest(count, total)
+
+
+def test_missing_id_changes_only_its_buckets():
+    missing = TRACE_IDS[0]
+    full = merkle.digest_children(TRACE_IDS, "")
+    partial = merkle.digest_children(TRACE_IDS[1:], "")
+
+    assert {char for char in full if full[char] != partial[char]} == {missing[0]}
+
+
+def test_bucket_holds_the_entries_with_the_prefix():
+    index = merkle.MerkleIndex(ENTRIES)
+
+    assert [entry["trace_id"] for entry in index.bucket("3e")] == sorted(
+        starting_with("3e")
+    )
+    assert index.bucket("") == index.entries
+
+
+def test_add_to_buckets_accumulates():
+    sums = merkle.add_to_buckets({}, TRACE_IDS[:700], 0)
+    merkle.add_to_buckets(sums, TRACE_IDS[700:], 0)
+
+    assert merkle.format_digests(sums) == merkle.digest_children(TRACE_IDS, "")
+
+
+def test_combined_buckets_match_the_union():
+    attractions = merkle.add_to_buckets({}, TRACE_IDS[::2], 0)
+    expenses = merkle.add_to_buckets({}, TRACE_IDS[1::2], 0)
+
+    combined = merkle.combine_buckets(attractions, expenses)
+
+    assert merkle.format_digests(combined) == merkle.digest_children(TRACE_IDS, "")
+
+
+def test_empty_ids_have_no_buckets():
+    assert merkle.digest_children([], "ab") == {}
+    assert merkle.MerkleIndex([]).children("") == {}
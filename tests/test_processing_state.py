@@ -0,0 +1,71 @@
+"""Tests of the lease and fenced writes of the processing state backends."""
+
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "processing"))
+
+import state  # noqa: E402  pylint: disable=wrong-import-position
+
+STATS = {"num_attr": 1, "avg_hours_open": 2.5, "num_exp": 0, "avg_amount": 0}
+
+
+@pytest.fixture(params=["file", "db"])
+def backend(request, tmp_path):
+    if request.param == "file":
+        return state.FileState(str(tmp_path / "processing.json"))
+    return state.DBState(f"sqlite:///{tmp_path / 'state.sqlite'}")
+
+
+def test_read_before_write(backend):
+    assert backend.read() is None
+
+
+def test_holder_writes_and_renews(backend):
+    assert backend.acquire("a", 15)
+    assert backend.acquire("a", 15)
+    assert backend.write(STATS, "a")
+    assert backend.read() == STATS
+
+
+def test_lease_excludes_other_owners(backend):
+    assert backend.acquire("a", 15)
+    assert not backend.acquire("b", 15)
+    assert not backend.write(STATS, "b")
+    assert backend.read() is None
+
+
+def test_expired_lease_is_taken_over(backend):
+    assert backend.acquire("a", 0.2)
+    time.sleep(0.3)
+    assert backend.acquire("b", 15)
+    # The old holder's write is fenced off
+    assert not backend.write({"stale": True}, "a")
+    assert backend.write(STATS, "b")
+    assert backend.read() == STATS
+
+
+def test_lease_keeps_sub_second_precision(backend):
+    assert backend.acquire("a", 1)
+    assert not backend.acquire("b", 1)
+    time.sleep(1.2)
+    assert backend.acquire("b", 1)
+
+
+def test_release_frees_the_lease(backend):
+    assert backend.acquire("a", 15)
+    backend.release("b")
+    assert not backend.acquire("b", 15)
+    backend.release("a")
+    assert backend.acquire("b", 15)
+
+
+def test_lease_expires_is_double_on_mysql():
+    from sqlalchemy.dialects import mysql
+    from sqlalchemy.schema import CreateTable
+
+    ddl = str(CreateTable(state.state_table).compile(dialect=mysql.dialect()))
+    assert "lease_expires DOUBLE" in ddl
@@ -0,0 +1,61 @@
+"""Tests of the receiver spool."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "receiver"))
+
+from spool import Spool  # noqa: E402  pylint: disable=wrong-import-position
+
+
+class Broker:
+    """Records the sends of a spool, timing out the live ones while down."""
+
+    def __init__(self):
+        self.down = False
+        self.sent = []
+        self.timeouts = []
+
+    def send(self, event_type, value, timeout=None):
+        if timeout is not None:
+            self.timeouts.append(timeout)
+            if self.down:
+                raise TimeoutError("Delivery not reported in time")
+        self.sent.append((event_type, value))
+
+
+def make_spool(tmp_path, broker):
+    return Spool(
+        str(tmp_path / "receiver-{slot}.spool"),
+        broker.send,
+        fsync="never",
+        slow_produce_ms=250,
+    )
+
+
+def test_publish_bounds_the_produce(tmp_path):
+    broker = Broker()
+    spool = make_spool(tmp_path, broker)
+
+    assert not spool.publish("expense_info", b"1")
+    assert broker.timeouts == [0.25]
+    assert broker.sent == [("expense_info", b"1")]
+    assert spool.healthy
+
+
+def test_timed_out_produce_is_spooled_and_replayed(tmp_path):
+    broker = Broker()
+    spool = make_spool(tmp_path, broker)
+
+    broker.down = True
+    assert spool.publish("expense_info", b"1")
+    assert not spool.healthy
+    # Spooled without another produce while unhealthy
+    assert spool.publish("attraction_info", b"2")
+    assert len(broker.timeouts) == 1
+    assert broker.sent == []
+
+    broker.down = False
+    assert spool.replay()
+    assert broker.sent == [("expense_info", b"1"), ("attraction_info", b"2")]
+    assert spool.pending_bytes() == 0
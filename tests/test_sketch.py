@@ -0,0 +1,92 @@
+"""Tests of the windowed percentile sketch."""
+
+import math
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.sketch import WindowedSketch  # noqa: E402  pylint: disable=wrong-import-position
+
+QUANTILES = [0.0, 0.5, 0.9, 0.99, 1.0]
+
+
+class Clock:
+    """Manually advanced clock."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def exact_quantile(values, quantile):
+    ordered = sorted(values)
+    return ordered[math.floor(quantile * (len(ordered) - 1))]
+
+
+@pytest.mark.parametrize("relative_accuracy", [0.01, 0.05])
+def test_quantiles_within_relative_accuracy(relative_accuracy):
+    generator = random.Random(11)
+    values = [generator.lognormvariate(0, 2) for _ in range(20_000)]
+    sketch = WindowedSketch(60, relative_accuracy=relative_accuracy, clock=Clock())
+    for value in values:
+        sketch.add(value)
+
+    for quantile, estimate in zip(QUANTILES, sketch.quantiles(QUANTILES)):
+        exact = exact_quantile(values, quantile)
+        assert abs(estimate - exact) <= relative_accuracy * exact * (1 + 1e-9)
+
+
+def test_empty_window():
+    sketch = WindowedSketch(60, clock=Clock())
+    assert sketch.quantiles(QUANTILES) == [None] * len(QUANTILES)
+
+
+def test_single_sample():
+    sketch = WindowedSketch(60, clock=Clock())
+    sketch.add(0.25)
+
+    for estimate in sketch.quantiles(QUANTILES):
+        assert estimate == pytest.approx(0.25, rel=0.01)
+
+
+def test_values_below_the_minimum_count_as_zero():
+    sketch = WindowedSketch(60, clock=Clock())
+    for value in (0, 1e-9, 0, 5.0):
+        sketch.add(value)
+
+    low, median, _, _, high = sketch.quantiles(QUANTILES)
+    assert low == 0.0
+    assert median == 0.0
+    assert high == pytest.approx(5.0, rel=0.01)
+
+
+def test_window_expiry():
+    clock = Clock()
+    sketch = WindowedSketch(60, slices=6, clock=clock)
+    for _ in range(100):
+        sketch.add(1000.0)
+
+    clock.now = 30.0
+    for _ in range(10):
+        sketch.add(1.0)
+    # Both slices are in the window, most values are the old ones
+    assert sketch.quantiles([0.5])[0] == pytest.approx(1000.0, rel=0.01)
+
+    # The first slice leaves the window once a full window has passed
+    clock.now = 59.9
+    assert sketch.quantiles([0.5])[0] == pytest.approx(1000.0, rel=0.01)
+    clock.now = 60.0
+    assert sketch.quantiles([0.0, 1.0]) == pytest.approx([1.0, 1.0], rel=0.01)
+
+    clock.now = 90.0
+    assert sketch.quantiles([0.5]) == [None]
+
+    # A window that was empty takes new values again
+    sketch.add(7.0)
+    assert sketch.quantiles([0.5])[0] == pytest.approx(7.0, rel=0.01)
@@ -0,0 +1,84 @@
+"""Tests of the storage read caches."""
+
+import os
+import sys
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "storage"))
+
+import cache  # noqa: E402  pylint: disable=wrong-import-position
+
+
+def make_event(created, event_id):
+    return {"id": event_id, "date_created": created}
+
+
+def test_recent_events_misses_before_start():
+    recent = cache.RecentEvents(window=600, max_events=100)
+    start = recent.covered_from
+    assert recent.get(start - timedelta(seconds=1), start) is None
+    assert recent.get(start, start + timedelta(seconds=1)) == []
+    assert recent.hit_ratio() == 0.5
+
+
+def test_recent_events_ranges_are_start_inclusive_end_exclusive():
+    recent = cache.RecentEvents(window=600, max_events=100)
+    start = recent.covered_from
+    times = [start + timedelta(milliseconds=i) for i in range(5)]
+    # Added out of order, as concurrent consumer threads commit
+    for i in (3, 0, 4, 1, 2):
+        recent.add(make_event(times[i], i))
+
+    events = recent.get(times[1], times[4])
+    assert [event["id"] for event in events] == [1, 2, 3]
+
+
+def test_recent_events_size_limit_moves_coverage():
+    recent = cache.RecentEvents(window=600, max_events=3)
+    start = recent.covered_from
+    times = [start + timedelta(milliseconds=i) for i in range(5)]
+    for i, created in enumerate(times):
+        recent.add(make_event(created, i))
+
+    # The two oldest events were evicted, so ranges reaching them miss
+    assert recent.get(times[1], times[4]) is None
+    assert recent.covered_from == times[1] + cache.RESOLUTION
+    events = recent.get(times[2], times[4] + cache.RESOLUTION)
+    assert [event["id"] for event in events] == [2, 3, 4]
+
+
+def test_user_events_invalidation_drops_pages():
+    user_events = cache.UserEvents(max_users=10, max_pages=10)
+    user_events.put("u1", (None, 10), "page", user_events.token())
+    assert user_events.get("u1", (None, 10)) == "page"
+
+    user_events.invalidate("u1")
+    assert user_events.get("u1", (None, 10)) is None
+
+
+def test_user_events_skips_pages_read_during_a_store():
+    user_events = cache.UserEvents(max_users=10, max_pages=10)
+    token = user_events.token()
+    # An event of the user was stored while the page was read
+    user_events.invalidate("u1")
+    user_events.put("u1", (None, 10), "stale", token)
+    assert user_events.get("u1", (None, 10)) is None
+
+    # Other users are not affected
+    user_events.put("u2", (None, 10), "page", token)
+    assert user_events.get("u2", (None, 10)) == "page"
+
+
+def test_user_events_evicts_least_recent_user_and_oldest_page():
+    user_events = cache.UserEvents(max_users=2, max_pages=2)
+    for user_id in ("u1", "u2"):
+        user_events.put(user_id, 1, "page", user_events.token())
+    user_events.get("u1", 1)
+    user_events.put("u3", 1, "page", user_events.token())
+    assert user_events.get("u2", 1) is None
+    assert user_events.get("u1", 1) == "page"
+
+    for key in (2, 3):
+        user_events.put("u1", key, "page", user_events.token())
+    assert user_events.get("u1", 1) is None
+    assert user_events.get("u1", 3) == "page"
@@ -0,0 +1,111 @@
+"""Tests of the cached trace ID digests of storage, served in-process on a
+SQLite database."""
+
+import os
+import sys
+import uuid
+from datetime import datetime as dt
+
+import pykafka
+import pytest
+from sqlalchemy import delete, select
+from starlette.testclient import TestClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import fake_kafka  # noqa: E402  pylint: disable=wrong-import-position
+import run_pipeline  # noqa: E402  pylint: disable=wrong-import-position
+from common import merkle  # noqa: E402  pylint: disable=wrong-import-position
+
+
+@pytest.fixture(scope="module")
+def storage(tmp_path_factory):
+    # The storage modules are shared with the other storage tests
+    module = sys.modules.get("storage_app")
+    if module is None:
+        cwd = os.getcwd()
+        pykafka.KafkaClient = fake_kafka.KafkaClient
+        workdir = str(tmp_path_factory.mktemp("storage"))
+        run_pipeline.prepare_workdir(workdir)
+        module = run_pipeline.load_service(workdir, "storage")
+        os.chdir(cwd)
+        sys.modules["create_db"].create_tables()
+
+    return module
+
+
+def add_events(count):
+    session = sys.modules["db"].make_session()
+    models = sys.modules["models"]
+    for i in range(count):
+        now = dt(2026, 1, 1)
+        if i % 2:
+            event = models.ExpenseInfo(
+                user_id=str(uuid.uuid4()),
+                amount=1.0,
+                expense_category="Food",
+                expense_timestamp=now,
+                trace_id=str(uuid.uuid4()),
+            )
+        else:
+            event = models.AttractionInfo(
+                user_id=str(uuid.uuid4()),
+                attraction_category="Park",
+                hours_open=1,
+                attraction_timestamp=now,
+                trace_id=str(uuid.uuid4()),
+            )
+        session.add(event)
+    session.commit()
+    session.close()
+
+
+def stored_trace_ids():
+    session = sys.modules["db"].make_session()
+    models = sys.modules["models"]
+    trace_ids = [
+        trace_id
+        for model in (models.AttractionInfo, models.ExpenseInfo)
+        for trace_id in session.execute(select(model.trace_id)).scalars()
+    ]
+    session.close()
+    return trace_ids
+
+
+def get_digest(storage, prefix):
+    response = TestClient(storage.app).get(
+        "/storage/ids/digest", params={"prefix": prefix}
+    )
+    assert response.status_code == 200
+    return response.json()["buckets"]
+
+
+def expected_digest(prefix):
+    trace_ids = [t for t in stored_trace_ids() if t.startswith(prefix)]
+    return merkle.digest_children(trace_ids, prefix)
+
+
+@pytest.mark.parametrize("prefix", ["", "a"])
+def test_digest_follows_new_rows(storage, prefix):
+    add_events(60)
+    assert get_digest(storage, prefix) == expected_digest(prefix)
+    last_id, _ = storage.id_digests.get(("attraction_info", prefix))
+
+    add_events(40)
+    assert get_digest(storage, prefix) == expected_digest(prefix)
+    assert storage.id_digests.get(("attraction_info", prefix))[0] > last_id
+
+
+def test_digest_recomputed_after_rows_are_deleted(storage):
+    add_events(20)
+    assert get_digest(storage, "") == expected_digest("")
+
+    session = sys.modules["db"].make_session()
+    models = sys.modules["models"]
+    first_id = session.execute(select(models.ExpenseInfo.id).limit(1)).scalar_one()
+    session.execute(delete(models.ExpenseInfo).where(models.ExpenseInfo.id == first_id))
+    session.commit()
+    session.close()
+
+    assert get_digest(storage, "") == expected_digest("")
@@ -0,0 +1,94 @@
+"""Tests of the paginated user history of storage, served in-process on a
+SQLite database."""
+
+import os
+import sys
+import uuid
+from datetime import datetime as dt, timedelta
+
+import pykafka
+import pytest
+from starlette.testclient import TestClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import fake_kafka  # noqa: E402  pylint: disable=wrong-import-position
+import run_pipeline  # noqa: E402  pylint: disable=wrong-import-position
+
+USER_ID = str(uuid.uuid4())
+
+
+@pytest.fixture(scope="module")
+def storage(tmp_path_factory):
+    cwd = os.getcwd()
+    pykafka.KafkaClient = fake_kafka.KafkaClient
+    workdir = str(tmp_path_factory.mktemp("storage"))
+    run_pipeline.prepare_workdir(workdir)
+    module = run_pipeline.load_service(workdir, "storage")
+    os.chdir(cwd)
+    sys.modules["create_db"].create_tables()
+
+    # Attractions and expenses interleaved, with date_created ties across
+    # and within the tables
+    base = dt(2026, 1, 1)
+    session = sys.modules["db"].make_session()
+    models = sys.modules["models"]
+    for i in range(25):
+        created = base + timedelta(seconds=i // 3)
+        if i % 2:
+            event = models.ExpenseInfo(
+                user_id=USER_ID,
+                amount=float(i),
+                expense_category="Food",
+                expense_timestamp=created,
+                trace_id=str(uuid.uuid4()),
+                date_created=created,
+            )
+        else:
+            event = models.AttractionInfo(
+                user_id=USER_ID,
+                attraction_category="Park",
+                hours_open=i,
+                attraction_timestamp=created,
+                trace_id=str(uuid.uuid4()),
+                date_created=created,
+            )
+        session.add(event)
+    session.commit()
+    session.close()
+
+    return TestClient(module.app)
+
+
+def read_pages(client, limit):
+    pages = []
+    params = {"limit": limit}
+    while True:
+        response = client.get(f"/storage/users/{USER_ID}/events", params=params)
+        assert response.status_code == 200
+        pages.append(response.json())
+        if "X-Next-Cursor" not in response.headers:
+            return pages
+        params = {"limit": limit, "cursor": response.headers["X-Next-Cursor"]}
+
+
+@pytest.mark.parametrize("limit", [1, 4, 7, 25, 100])
+def test_pages_cover_every_event_newest_first(storage, limit):
+    pages = read_pages(storage, limit)
+    events = [event for page in pages for event in page]
+
+    assert all(len(page) <= limit for page in pages)
+    assert len(events) == 25
+    assert len({(event["type"], event["id"]) for event in events}) == 25
+    keys = [(event["date_created"], event["type"], event["id"]) for event in events]
+    assert keys == sorted(keys, reverse=True)
+
+
+def test_invalid_cursor_is_rejected(storage):
+    for cursor in ("not-base64!", "Zm9v", "MjAyNi0wMS0wMVQwMDowMDowMHxib2d1c3wx"):
+        response = storage.get(
+            f"/storage/users/{USER_ID}/events", params={"cursor": cursor}
+        )
+        assert response.status_code == 400
+        assert response.json() == {"message": "Invalid cursor"}
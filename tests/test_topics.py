@@ -0,0 +1,52 @@
+"""Tests of the event topic resolution shared by the services."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import topics  # noqa: E402  pylint: disable=wrong-import-position
+
+TOPICS = {"attraction_info": "attraction_events", "expense_info": "expense_events"}
+
+
+def make_config(mode=None):
+    events = {"topic": "events", "topics": dict(TOPICS)}
+    if mode is not None:
+        events["mode"] = mode
+    return events
+
+
+@pytest.mark.parametrize(
+    "mode, expected",
+    [(None, "events"), ("combined", "events"), ("split", "expense_events"), ("both", "events")],
+)
+def test_publish_topic(mode, expected):
+    assert topics.get_topic_name(make_config(mode), "expense_info") == expected
+
+
+@pytest.mark.parametrize(
+    "mode, expected",
+    [
+        (None, ["events"]),
+        ("combined", ["events"]),
+        ("split", ["attraction_events", "expense_events"]),
+        ("both", ["events", "attraction_events", "expense_events"]),
+    ],
+)
+def test_consumed_topics(mode, expected):
+    assert topics.get_topic_names(make_config(mode)) == expected
+
+
+@pytest.mark.parametrize(
+    "mode, expected",
+    [
+        ("combined", ["events"]),
+        ("split", ["attraction_events"]),
+        ("both", ["events", "attraction_events"]),
+    ],
+)
+def test_consumed_topics_of_event_type(mode, expected):
+    assert topics.get_topic_names(make_config(mode), "attraction_info") == expected
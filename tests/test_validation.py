@@ -0,0 +1,93 @@
+"""Tests of the fast-path OpenAPI validation, on a small API served
+in-process."""
+
+import os
+import sys
+
+import connexion
+from connexion.resolver import Resolver
+from starlette.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import validation  # noqa: E402  pylint: disable=wrong-import-position
+
+SPEC = {
+    "openapi": "3.0.0",
+    "info": {"title": "Items", "version": "1.0.0"},
+    "paths": {
+        "/items": {
+            "post": {
+                "operationId": "post_item",
+                "requestBody": {
+                    "required": True,
+                    "content": {
+                        "application/json": {
+                            "schema": {"$ref": "#/components/schemas/Item"}
+                        }
+                    },
+                },
+                "responses": {
+                    "201": {
+                        "description": "Created",
+                        "content": {
+                            "application/json": {
+                                "schema": {"$ref": "#/components/schemas/Item"}
+                            }
+                        },
+                    }
+                },
+            }
+        }
+    },
+    "components": {
+        "schemas": {
+            "Item": {
+                "type": "object",
+                "required": ["count"],
+                "properties": {"count": {"type": "integer"}},
+            }
+        }
+    },
+}
+
+
+def post_item(body):
+    return {"count": body["count"] if body["count"] >= 0 else "negative"}, 201
+
+
+def make_client(monkeypatch):
+    compiled = []
+    init = validation.CompiledSchema.__init__
+
+    def counting_init(self, schema, validator_cls):
+        compiled.append(validator_cls)
+        init(self, schema, validator_cls)
+
+    monkeypatch.setattr(validation.CompiledSchema, "__init__", counting_init)
+    app = connexion.FlaskApp(__name__, middlewares=validation.middlewares())
+    app.add_api(
+        SPEC,
+        validate_responses=True,
+        validator_map=validation.validator_map(),
+        resolver=Resolver(lambda operation_id: post_item),
+    )
+    return TestClient(app), compiled
+
+
+def test_schemas_are_compiled_once_per_operation(monkeypatch):
+    client, compiled = make_client(monkeypatch)
+
+    for count in range(5):
+        assert client.post("/items", json={"count": count}).status_code == 201
+
+    # One request body and one response body schema
+    assert len(compiled) == 2
+
+
+def test_compiled_schemas_still_validate(monkeypatch):
+    client, _ = make_client(monkeypatch)
+
+    assert client.post("/items", json={"count": "one"}).status_code == 400
+    assert client.post("/items", json={}).status_code == 400
+    assert client.post("/items", json={"count": -1}).status_code == 500